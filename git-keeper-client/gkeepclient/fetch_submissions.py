@@ -276,7 +276,7 @@ def fetch_submissions(class_name: str, assignment_name: str,
     :param destination_path: directory in which to fetch the assignment
     """
 
-    info = server_interface.get_info()
+    info = server_interface.get_info([class_name])
 
     create_dir_if_non_existent(destination_path, confirm=True)
 
@@ -210,6 +210,10 @@ def add_query_subparser(subparsers):
                            metavar='<number of days>',
                            help='number of days considered recent (optional)',
                            nargs='?')
+    subparser.add_argument('-c', '--class', dest='class_names',
+                           metavar='<class name>', action='append',
+                           help='only query this class, may be given more '
+                                'than once (optional)')
 
 
 def add_trigger_subparser(subparsers):
@@ -257,21 +261,24 @@ def initialize_action_parser() -> GraderParser:
     return parser
 
 
-def run_query(query_type: str, number_of_days: int):
+def run_query(query_type: str, number_of_days: int, class_names=None):
     """
     Run the query specified by query_type.
 
     :param query_type: type of the query
+    :param number_of_days: number of days considered recent
+    :param class_names: names of the classes to query, or None for all
+     classes
     """
 
     if query_type == 'classes':
         list_classes()
     elif query_type == 'assignments':
-        list_assignments()
+        list_assignments(class_names)
     elif query_type == 'students':
-        list_students()
+        list_students(class_names)
     elif query_type == 'recent':
-        list_recent(number_of_days)
+        list_recent(number_of_days, class_names)
 
 
 def main():
@@ -328,7 +335,8 @@ def main():
                               parsed_args.assignment_name,
                               dest_path)
         elif action_name == 'query':
-            run_query(parsed_args.query_type, parsed_args.number_of_days)
+            run_query(parsed_args.query_type, parsed_args.number_of_days,
+                      parsed_args.class_names)
         elif action_name == 'trigger':
             trigger_tests(parsed_args.class_name, parsed_args.assignment_name,
                           parsed_args.student_usernames)
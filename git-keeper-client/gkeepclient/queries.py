@@ -36,13 +36,16 @@ def list_classes():
 
 @config_parsed
 @server_interface_connected
-def list_assignments():
+def list_assignments(class_names=None):
     """
     Print the names of all the assignments owned by the faculty, grouped by
     class.
+
+    :param class_names: names of the classes to list assignments for, or
+     None for all classes
     """
 
-    info = server_interface.get_info()
+    info = server_interface.get_info(class_names)
 
     for class_name in sorted(info.keys()):
         print(class_name, ':', sep='')
@@ -63,12 +66,18 @@ def list_assignments():
 
 @config_parsed
 @server_interface_connected
-def list_students():
+def list_students(class_names=None):
     """
     Print all the students in classes owned by the faculty, grouped by class.
+
+    :param class_names: names of the classes to list students for, or None
+     for all classes
     """
 
     for class_name in server_interface.get_classes():
+        if class_names is not None and class_name not in class_names:
+            continue
+
         print(class_name, ':', sep='')
 
         for student in server_interface.get_students(class_name):
@@ -79,12 +88,14 @@ def list_students():
 
 @config_parsed
 @server_interface_connected
-def list_recent(number_of_days):
+def list_recent(number_of_days, class_names=None):
     """
     Print recent submissions.
 
     :param number_of_days: submissions past this number of days ago are not
      recent
+    :param class_names: names of the classes to print submissions for, or
+     None for all classes
     """
 
     if number_of_days is None:
@@ -93,7 +104,7 @@ def list_recent(number_of_days):
     print('Recent submissions:')
     print()
 
-    info = server_interface.get_info()
+    info = server_interface.get_info(class_names)
 
     for class_name in sorted(info.keys()):
         class_name_printed = False
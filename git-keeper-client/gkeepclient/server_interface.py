@@ -47,20 +47,25 @@ Example usage::
 """
 
 import csv
+import gzip
 import json
 import os
 from shlex import quote
+from tempfile import NamedTemporaryFile
 from time import time
 
 from paramiko import SSHClient, AutoAddPolicy, SSHException
 
 from gkeepclient.client_configuration import config
 from gkeepcore.gkeep_exception import GkeepException
+from gkeepcore.info_delta import apply_info_delta, InfoDeltaError
 from gkeepcore.log_file import log_append_command
 from gkeepcore.path_utils import user_log_path, gkeepd_to_faculty_log_path, \
     faculty_upload_dir_path, faculty_assignment_dir_path,\
     faculty_class_dir_path, assignment_published_file_path, \
-    faculty_classes_dir_path, class_student_csv_path, faculty_info_path
+    faculty_classes_dir_path, class_student_csv_path, faculty_info_path, \
+    faculty_info_latest_path, parse_info_generation_filename, \
+    faculty_info_index_path, info_delta_path
 from gkeepcore.student import Student
 
 
@@ -74,6 +79,14 @@ class ServerCommandExitFailure(ServerInterfaceError):
     pass
 
 
+# path to the local copy of the info, relative to the local home directory
+INFO_CACHE_RELATIVE_PATH = '.config/git-keeper/info_cache.json'
+
+# if the local copy is more generations behind than this, the full info is
+# downloaded rather than the deltas
+MAX_DELTAS_APPLIED = 20
+
+
 class ServerInterface:
     """
     Provides methods for interacting with the server over a paramiko SSH
@@ -90,6 +103,9 @@ class ServerInterface:
         self._home_dir = None
         self._event_log_path = None
 
+        # generation of the info last read by get_info()
+        self._info_generation = None
+
     def is_connected(self):
         """
         Determine if we're connected to the server.
@@ -350,20 +366,23 @@ class ServerInterface:
         command = log_append_command(self._event_log_path, event_type, payload)
         self.run_command(command)
 
-    def read_file_bytes(self, file_path: str, seek_position=0) -> bytes:
+    def read_file_bytes(self, file_path: str, seek_position=0,
+                        max_byte_count=None) -> bytes:
         """
         Read a file from the server, optionally starting at a byte
         offset, and return the data as bytes.
 
         :param file_path: path to the file
         :param seek_position: byte offset at which to start reading
+        :param max_byte_count: maximum number of bytes to read, None to read
+         to the end
         :return: data from the file as bytes
         """
 
         try:
             with self._sftp_client.open(file_path) as f:
                 f.seek(seek_position)
-                data = f.read()
+                data = f.read(max_byte_count)
         except Exception as e:
             raise ServerInterfaceError(e)
 
@@ -596,29 +615,223 @@ class ServerInterface:
 
         return students
 
-    def get_info(self) -> dict:
+    def get_info(self, class_names=None) -> dict:
         """
         Get the dictionary of info from the server.
 
+        The latest.json link in the info directory points to the file
+        containing the latest generation of the info. Servers that predate
+        the link write files named by the time, and the last one is read.
+
+        A copy of the info is kept locally along with its generation. If the
+        server has newer generations, the deltas from the copy's generation
+        are downloaded and applied to it. The full info is downloaded if
+        there is no copy or if any delta is missing.
+
+        If class_names is given, the dictionary only contains those classes.
+        If the local copy cannot be brought up to date and the server writes
+        per-class partitions, only the partitions for those classes are
+        downloaded rather than the full info.
+
+        :param class_names: names of the classes to get info for, or None for
+         all classes
         :return: dictionary of info
         """
 
+        cache = _read_info_cache()
+
         info_path = faculty_info_path(self._home_dir)
+        latest_path = faculty_info_latest_path(self._home_dir)
+
+        try:
+            generation_filename = self._sftp_client.readlink(latest_path)
+        except IOError:
+            generation_filename = None
+
+        if generation_filename is not None and cache is not None:
+            generation = parse_info_generation_filename(generation_filename)
+            info = self._update_cached_info(cache, generation)
+
+            if info is not None:
+                self._info_generation = generation
+                return _select_classes(info, class_names)
 
-        # Get the contents of the last file in the directory, or an empty
-        # string if the directory is empty.
-        command = \
-            'echo | cat {0}/`ls {0} | tail -1`'.format(info_path).rstrip()
+        if class_names is not None:
+            info = self._get_partitioned_info(class_names)
+
+            if info is not None:
+                return info
 
         try:
-            info_json = self.run_command(command)
+            if generation_filename is None:
+                # Get the contents of the last file in the directory, or an
+                # empty string if the directory is empty.
+                command = ('echo | cat {0}/`ls {0} | tail -1`'
+                           .format(info_path).rstrip())
+                info_json = self.run_command(command)
+                self._info_generation = None
+            else:
+                generation_path = os.path.join(info_path,
+                                               generation_filename)
+                info_json = self.read_file_text(generation_path)
+                self._info_generation = \
+                    parse_info_generation_filename(generation_filename)
+
             info = json.loads(info_json)
         except Exception as e:
             raise ServerInterfaceError('Error loading info from JSON: {0}'
                                        .format(e))
 
+        if self._info_generation is not None:
+            _write_info_cache(info, self._info_generation)
+
+        return _select_classes(info, class_names)
+
+    def _update_cached_info(self, cache, generation):
+        # Bring the cached info up to the given generation by applying
+        # deltas. Returns None if that is not possible.
+
+        cached_generation = cache['generation']
+        info = cache['info']
+
+        if generation == cached_generation:
+            return info
+
+        if (generation is None or generation < cached_generation or
+                generation - cached_generation > MAX_DELTAS_APPLIED):
+            return None
+
+        try:
+            for delta_generation in range(cached_generation + 1,
+                                          generation + 1):
+                delta_path = info_delta_path(self._home_dir,
+                                             delta_generation)
+                delta = json.loads(self.read_file_text(delta_path))
+
+                if delta['generation'] != delta_generation:
+                    return None
+
+                apply_info_delta(info, delta['operations'])
+        except (ServerInterfaceError, InfoDeltaError, ValueError, KeyError,
+                TypeError):
+            return None
+
+        _write_info_cache(info, generation)
+
         return info
 
+    def _get_partitioned_info(self, class_names):
+        # Get the info for some classes from their partitions. Returns None
+        # if the server does not write partitions.
+
+        info_path = faculty_info_path(self._home_dir)
+        index_path = faculty_info_index_path(self._home_dir)
+
+        try:
+            index_json = self.read_file_text(index_path)
+        except ServerInterfaceError:
+            return None
+
+        info = {}
+
+        try:
+            index = json.loads(index_json)
+
+            for class_name in class_names:
+                entry = index['classes'].get(class_name)
+
+                # like the full info, classes that do not exist are left out
+                if entry is None:
+                    continue
+
+                data = self.read_file_bytes(os.path.join(info_path,
+                                                         entry['path']))
+
+                if entry['path'].endswith('.gz'):
+                    data = gzip.decompress(data)
+
+                info[class_name] = json.loads(data.decode('utf-8'))
+
+            self._info_generation = index['generation']
+        except Exception as e:
+            raise ServerInterfaceError('Error loading info from JSON: {0}'
+                                       .format(e))
+
+        return info
+
+    def info_generation(self):
+        """
+        Get the generation of the info last returned by get_info().
+
+        Generations increase each time the server refreshes the info, so
+        comparing them tells whether the info has changed.
+
+        :return: the generation number, or None if the info has not been
+         read or the server does not number generations
+        """
+
+        return self._info_generation
+
+
+def _info_cache_path():
+    return os.path.join(config.local_home_dir, INFO_CACHE_RELATIVE_PATH)
+
+
+def _read_info_cache():
+    # Read the local copy of the info. Returns None if there is no usable
+    # copy for this server and user.
+
+    try:
+        with open(_info_cache_path()) as f:
+            cache = json.load(f)
+
+        if (cache['host'] != config.server_host or
+                cache['username'] != config.server_username or
+                not isinstance(cache['generation'], int) or
+                not isinstance(cache['info'], dict)):
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return cache
+
+
+def _write_info_cache(info, generation):
+    # Replace the local copy of the info. The copy is only an optimization,
+    # so errors are ignored.
+
+    cache = {
+        'host': config.server_host,
+        'username': config.server_username,
+        'generation': generation,
+        'info': info,
+    }
+
+    cache_path = _info_cache_path()
+    cache_dir_path = os.path.dirname(cache_path)
+
+    try:
+        os.makedirs(cache_dir_path, exist_ok=True)
+
+        with NamedTemporaryFile('w', dir=cache_dir_path, prefix='.',
+                                delete=False) as f:
+            json.dump(cache, f)
+
+        os.replace(f.name, cache_path)
+    except OSError:
+        pass
+
+
+def _select_classes(info, class_names):
+    # Get the part of the info for the given classes, or all of it if
+    # class_names is None
+
+    if class_names is None:
+        return info
+
+    return {class_name: info[class_name] for class_name in class_names
+            if class_name in info}
+
 
 # Module-level interface instance. Someone must call connect() on this before
 # it is used
@@ -46,18 +46,22 @@ class ServerLogFileReader(LogFileReader):
 
         return byte_count
 
-    def _read_bytes(self) -> bytes:
+    def _read_bytes(self, file_position: int, max_byte_count=None) -> bytes:
         """
-        Retrieve data as bytes from the file from _seek_position to the end
+        Retrieve data as bytes from the file starting at file_position
 
         Raises LogFileException
 
+        :param file_position: offset into the file to start reading from
+        :param max_byte_count: maximum number of bytes to read, None to read
+         to the end
         :return: data from the file as bytes
         """
 
         try:
             data_bytes = server_interface.read_file_bytes(self._file_path,
-                                                          self._seek_position)
+                                                          file_position,
+                                                          max_byte_count)
         except ServerInterfaceError as e:
             raise LogFileException(e)
 
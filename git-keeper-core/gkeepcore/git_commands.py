@@ -14,12 +14,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-"""Provides functions for running git commands."""
+"""
+Provides functions for running git commands.
 
-import os
+The functions that read the HEAD commit of a repository, and the history
+behind it, read the repository's files directly using gkeepcore.git_reader.
+If the repository cannot be read that way, they query a long-running git
+cat-file process from cat_file_pool rather than starting a new git process
+for every query.
+"""
 
+import os
+import selectors
+from collections import OrderedDict
+from subprocess import Popen, PIPE, DEVNULL
+from threading import Lock
+from time import perf_counter
+
+from gkeepcore.git_reader import GitReaderError, read_head_hash, \
+    read_commit, head_summary, parse_commit
 from gkeepcore.shell_command import run_command_in_directory, run_command, \
-    CommandError
+    CommandError, CommandTimeoutError
+
+# maximum number of git cat-file processes kept running by cat_file_pool
+CAT_FILE_POOL_SIZE = 16
+
+# seconds to wait for a git cat-file process to answer a query
+CAT_FILE_TIMEOUT = 30
 
 
 def git_remote_add(repo_path, remote_name, url):
@@ -173,9 +194,17 @@ def git_head_hash(repo_path):
     :return: commit hash of HEAD
     """
 
-    cmd = ['git', 'rev-parse', 'HEAD']
+    try:
+        return read_head_hash(repo_path)
+    except GitReaderError:
+        pass
 
-    return run_command_in_directory(repo_path, cmd).rstrip()
+    info = cat_file_pool.object_info(repo_path, 'HEAD')
+
+    if info is None:
+        raise CommandError('HEAD does not exist in {0}'.format(repo_path))
+
+    return info[0]
 
 
 def git_head_hash_date(repo_path):
@@ -188,18 +217,15 @@ def git_head_hash_date(repo_path):
     :return: tuple containing the hash and the timestamp
     """
 
-    cmd = ['git', 'log', '-1', '--format=%H %at']
-
-    output = run_command_in_directory(repo_path, cmd)
-    split_output = output.split()
+    try:
+        repo_hash = read_head_hash(repo_path)
+        return repo_hash, read_commit(repo_path, repo_hash).author_time
+    except GitReaderError:
+        pass
 
-    if len(split_output) != 2:
-        raise CommandError(output)
+    commit = _read_commit_from_pool(repo_path, 'HEAD')
 
-    repo_hash = split_output[0]
-    timestamp = int(split_output[1])
-
-    return repo_hash, timestamp
+    return commit.hash, commit.author_time
 
 
 def git_hashes_and_times(repo_path):
@@ -236,3 +262,331 @@ def git_hashes_and_times(repo_path):
         raise CommandError('No output')
 
     return hashes_and_times
+
+
+def git_head_summary(repo_path):
+    """
+    Get the hash and commit time of the HEAD of a git repository, and the
+    number of commits reachable from HEAD.
+
+    The time is integer seconds from the epoch.
+
+    The commits are counted incrementally, so calling this repeatedly on a
+    repository that receives new commits only reads the new commits.
+
+    Raises CommandError on failure.
+
+    :param repo_path: path to the repository
+    :return: tuple containing the hash, the time, and the number of commits
+    """
+
+    try:
+        return head_summary(repo_path)
+    except GitReaderError:
+        pass
+
+    # walk the history through git cat-file instead
+    return head_summary(repo_path, git_head_hash, _read_commit_from_pool)
+
+
+def _read_commit_from_pool(repo_path, name):
+    # Read a commit with cat_file_pool. Raises CommandError if the object
+    # is not a commit.
+
+    commit_object = cat_file_pool.read_object(repo_path, name)
+
+    if commit_object is None or commit_object[1] != 'commit':
+        raise CommandError('{0} is not a commit in {1}'.format(name,
+                                                               repo_path))
+
+    commit_hash, object_type, contents = commit_object
+
+    try:
+        return parse_commit(commit_hash, contents)
+    except GitReaderError as e:
+        raise CommandError(e)
+
+
+class _SessionClosedError(Exception):
+    # Raised by CatFileSession.query() if the session has been closed
+    pass
+
+
+class CatFileSession:
+    """
+    A long-running git cat-file process for a single repository.
+
+    With the --batch-check option each query returns the hash, type, and size
+    of an object. With --batch the contents of the object are returned as
+    well.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, repo_path, batch_option='--batch-check',
+                 timeout=CAT_FILE_TIMEOUT):
+        """
+        Start the git cat-file process.
+
+        Raises CommandError if the process cannot be started.
+
+        :param repo_path: path to the repository
+        :param batch_option: '--batch-check' or '--batch'
+        :param timeout: seconds to wait for the answer to a query
+        """
+
+        self.repo_path = repo_path
+        self._batch_option = batch_option
+        self._timeout = timeout
+        self._lock = Lock()
+        self._buffer = b''
+
+        try:
+            self._process = Popen(['git', 'cat-file', batch_option],
+                                  cwd=repo_path, stdin=PIPE, stdout=PIPE,
+                                  stderr=DEVNULL)
+        except OSError as e:
+            raise CommandError('Could not start git cat-file in {0}: {1}'
+                               .format(repo_path, e))
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._process.stdout, selectors.EVENT_READ)
+
+    def query(self, name):
+        """
+        Look up an object.
+
+        Raises CommandError if git does not answer, in which case the session
+        should be closed.
+
+        :param name: name of the object, such as a hash or a ref
+        :return: (hash, type, size) tuple for --batch-check, or
+         (hash, type, contents) tuple for --batch, or None if the object
+         does not exist
+        """
+
+        if '\n' in name:
+            raise CommandError('Invalid object name: {0}'.format(name))
+
+        with self._lock:
+            if self._process is None:
+                raise _SessionClosedError()
+
+            deadline = perf_counter() + self._timeout
+
+            try:
+                self._process.stdin.write(name.encode() + b'\n')
+                self._process.stdin.flush()
+            except OSError as e:
+                raise CommandError('git cat-file failed in {0}: {1}'
+                                   .format(self.repo_path, e))
+
+            header = self._read_line(deadline).decode(errors='replace')
+
+            # missing objects are reported as "<name> missing", or
+            # "<name> ambiguous" for ambiguous short hashes
+            if header.endswith(' missing') or header.endswith(' ambiguous'):
+                return None
+
+            fields = header.split()
+
+            if len(fields) != 3 or not fields[2].isdigit():
+                raise CommandError('Unexpected output from git cat-file: {0}'
+                                   .format(header))
+
+            object_hash, object_type, size = fields[0], fields[1], \
+                int(fields[2])
+
+            if self._batch_option == '--batch-check':
+                return object_hash, object_type, size
+
+            # the contents are followed by a newline
+            contents = self._read_exactly(size + 1, deadline)[:-1]
+
+            return object_hash, object_type, contents
+
+    def close(self):
+        """Stop the git cat-file process."""
+
+        with self._lock:
+            if self._process is None:
+                return
+
+            self._selector.close()
+
+            # git cat-file exits when its input is closed
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except Exception:
+                self._process.kill()
+                self._process.wait()
+
+            self._process.stdout.close()
+            self._process = None
+
+    def _read_line(self, deadline):
+        while b'\n' not in self._buffer:
+            self._fill(deadline)
+
+        line, newline, self._buffer = self._buffer.partition(b'\n')
+
+        return line
+
+    def _read_exactly(self, byte_count, deadline):
+        while len(self._buffer) < byte_count:
+            self._fill(deadline)
+
+        data = self._buffer[:byte_count]
+        self._buffer = self._buffer[byte_count:]
+
+        return data
+
+    def _fill(self, deadline):
+        # Read whatever output is available, waiting until the deadline
+
+        remaining = deadline - perf_counter()
+
+        if remaining <= 0 or len(self._selector.select(remaining)) == 0:
+            raise CommandTimeoutError('git cat-file in {0} did not answer '
+                                      'within {1} seconds'
+                                      .format(self.repo_path, self._timeout))
+
+        chunk = os.read(self._process.stdout.fileno(), 65536)
+
+        if len(chunk) == 0:
+            raise CommandError('git cat-file exited in {0}'
+                               .format(self.repo_path))
+
+        self._buffer += chunk
+
+
+class CatFileSessionPool:
+    """
+    Keeps git cat-file processes running for the most recently queried
+    repositories, so that repeated queries do not start a git process each
+    time.
+
+    A git cat-file process can only read the repository it was started in,
+    so there is a session for each repository. Each session is started with
+    --batch so that it can answer both kinds of query. When there are more
+    sessions than the pool size, the least recently used session is closed.
+
+    A session that fails is closed, and a new one is started for the next
+    query.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, size=CAT_FILE_POOL_SIZE):
+        """
+        :param size: maximum number of sessions to keep running
+        """
+
+        self._size = size
+        self._lock = Lock()
+
+        # maps repository paths to sessions, least recently used first
+        self._sessions = OrderedDict()
+
+    def object_info(self, repo_path, name):
+        """
+        Get the hash, type, and size of an object.
+
+        Raises CommandError if git fails.
+
+        :param repo_path: path to the repository
+        :param name: name of the object, such as a hash or a ref
+        :return: (hash, type, size) tuple, or None if the object does not
+         exist
+        """
+
+        git_object = self._query(repo_path, name)
+
+        if git_object is None:
+            return None
+
+        object_hash, object_type, contents = git_object
+
+        return object_hash, object_type, len(contents)
+
+    def read_object(self, repo_path, name):
+        """
+        Get the hash, type, and contents of an object.
+
+        Raises CommandError if git fails.
+
+        :param repo_path: path to the repository
+        :param name: name of the object, such as a hash or a ref
+        :return: (hash, type, contents) tuple with the contents as bytes, or
+         None if the object does not exist
+        """
+
+        return self._query(repo_path, name)
+
+    def close_all(self):
+        """Close all the sessions."""
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            session.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _query(self, repo_path, name):
+        key = os.path.realpath(repo_path)
+
+        while True:
+            session = self._get_session(key)
+
+            try:
+                return session.query(name)
+            except _SessionClosedError:
+                # another thread closed it, start a new one
+                continue
+            except CommandError:
+                self._discard(key, session)
+                raise
+
+    def _get_session(self, key):
+        # Get the session for a key, starting one if needed and closing the
+        # least recently used sessions if there are too many
+
+        evicted_sessions = []
+
+        with self._lock:
+            session = self._sessions.get(key)
+
+            if session is None:
+                session = CatFileSession(key, batch_option='--batch')
+                self._sessions[key] = session
+
+            self._sessions.move_to_end(key)
+
+            while len(self._sessions) > self._size:
+                evicted_key, evicted_session = \
+                    self._sessions.popitem(last=False)
+                evicted_sessions.append(evicted_session)
+
+        # closing waits for queries in progress, so do it without holding
+        # the pool lock
+        for evicted_session in evicted_sessions:
+            evicted_session.close()
+
+        return session
+
+    def _discard(self, key, session):
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+
+        session.close()
+
+
+# module-level instance for global access
+cat_file_pool = CatFileSessionPool()
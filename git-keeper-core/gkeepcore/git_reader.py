@@ -0,0 +1,510 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides functions for reading the HEAD commit of a git repository directly
+from the files in the repository, without running git.
+
+Only the common cases are handled: HEAD is read from loose refs and
+packed-refs, and commits are read from loose objects or from packs with
+version 2 indexes. Anything else, such as a deltified commit, alternates, or
+a .git file pointing elsewhere, raises GitReaderError so that the caller can
+fall back to running git.
+
+Counting the commits reachable from HEAD requires walking the history.
+head_summary() remembers the commits it has seen in each repository so that
+later calls only walk the new commits. The pack indexes of each repository
+are loaded once and kept until the pack directory changes, so looking up a
+packed commit is a binary search in memory.
+"""
+
+import os
+import re
+import struct
+import zlib
+from collections import namedtuple, OrderedDict
+from threading import Lock
+
+from gkeepcore.gkeep_exception import GkeepException
+
+# maximum number of repositories to remember commits for
+MAX_CACHED_REPOS = 10000
+
+# maximum number of pack directories to keep loaded pack indexes for
+MAX_CACHED_PACK_DIRS = 1000
+
+# pack object types
+_OBJ_COMMIT = 1
+_OBJ_OFS_DELTA = 6
+_OBJ_REF_DELTA = 7
+
+_hash_regex = re.compile('[0-9a-f]{40}')
+
+Commit = namedtuple('Commit', ['hash', 'parents', 'author_time'])
+
+
+class GitReaderError(GkeepException):
+    """Raised if a repository cannot be read without running git."""
+    pass
+
+
+def find_git_dir(repo_path: str) -> str:
+    """
+    Get the path of the directory containing the git data of a repository.
+
+    :param repo_path: path to a bare repository or a working copy
+    :return: path to the git directory
+    """
+
+    git_dir_path = os.path.join(repo_path, '.git')
+
+    if os.path.isdir(git_dir_path):
+        return git_dir_path
+
+    if os.path.exists(git_dir_path):
+        raise GitReaderError('{0} is a .git file'.format(git_dir_path))
+
+    if not os.path.isfile(os.path.join(repo_path, 'HEAD')):
+        raise GitReaderError('{0} is not a git repository'.format(repo_path))
+
+    return repo_path
+
+
+def read_head_hash(repo_path: str) -> str:
+    """
+    Get the hash of the commit that HEAD refers to.
+
+    :param repo_path: path to the repository
+    :return: the commit hash
+    """
+
+    git_dir_path = find_git_dir(repo_path)
+    head = _read_text(os.path.join(git_dir_path, 'HEAD')).strip()
+
+    if _hash_regex.fullmatch(head):
+        return head
+
+    if not head.startswith('ref: '):
+        raise GitReaderError('Unexpected HEAD in {0}'.format(repo_path))
+
+    return _resolve_ref(git_dir_path, head[len('ref: '):])
+
+
+def read_commit(repo_path: str, commit_hash: str) -> Commit:
+    """
+    Read a commit object.
+
+    :param repo_path: path to the repository
+    :param commit_hash: hash of the commit
+    :return: Commit with the hashes of its parents and its author time
+    """
+
+    git_dir_path = find_git_dir(repo_path)
+    data = _read_commit_data(git_dir_path, commit_hash)
+
+    return parse_commit(commit_hash, data)
+
+
+def parse_commit(commit_hash: str, data: bytes) -> Commit:
+    """
+    Parse the contents of a commit object.
+
+    :param commit_hash: hash of the commit
+    :param data: contents of the commit object
+    :return: Commit with the hashes of its parents and its author time
+    """
+
+    parents = []
+    author_time = None
+
+    # the headers end at the first blank line
+    for line in data.split(b'\n'):
+        if line == b'':
+            break
+
+        if line.startswith(b'parent '):
+            parents.append(line[len(b'parent '):].decode())
+        elif line.startswith(b'author '):
+            # author Name <email> <seconds since the epoch> <time zone>
+            try:
+                author_time = int(line.rsplit(b' ', 2)[1])
+            except (IndexError, ValueError):
+                pass
+
+    if author_time is None:
+        raise GitReaderError('Could not parse commit {0}'
+                             .format(commit_hash))
+
+    return Commit(commit_hash, parents, author_time)
+
+
+def head_summary(repo_path: str, read_head_function=read_head_hash,
+                 read_commit_function=read_commit) -> tuple:
+    """
+    Get the hash and author time of the HEAD commit, and the number of
+    commits reachable from HEAD.
+
+    The repository is read directly from its files by default. Callers that
+    read objects some other way can pass their own functions, which share
+    the remembered commits.
+
+    :param repo_path: path to the repository
+    :param read_head_function: function like read_head_hash()
+    :param read_commit_function: function like read_commit()
+    :return: (hash, author time, commit count) tuple
+    """
+
+    return _commit_counter.head_summary(repo_path, read_head_function,
+                                        read_commit_function)
+
+
+class _CommitCounter:
+    # Remembers the commits reachable from HEAD for each repository, so
+    # that when HEAD moves only the new commits need to be read
+
+    def __init__(self):
+        self._lock = Lock()
+
+        # maps repository paths to (head hash, author time, frozenset of
+        # commit hashes), least recently used first
+        self._repos = OrderedDict()
+
+    def head_summary(self, repo_path, read_head_function,
+                     read_commit_function):
+        repo_key = os.path.realpath(repo_path)
+        head_hash = read_head_function(repo_path)
+
+        with self._lock:
+            cached = self._repos.get(repo_key)
+
+        if cached is not None and cached[0] == head_hash:
+            author_time, commits = cached[1], cached[2]
+        else:
+            commits, author_time = self._walk(repo_path, head_hash, cached,
+                                              read_commit_function)
+
+        with self._lock:
+            self._repos[repo_key] = (head_hash, author_time, commits)
+            self._repos.move_to_end(repo_key)
+
+            while len(self._repos) > MAX_CACHED_REPOS:
+                self._repos.popitem(last=False)
+
+        return head_hash, author_time, len(commits)
+
+    def _walk(self, repo_path, head_hash, cached, read_commit_function):
+        # Find all the commits reachable from head_hash, without reading
+        # any commits known to be reachable from the previous head. If the
+        # previous head is not reachable the history was rewritten, so walk
+        # everything.
+
+        if cached is None:
+            old_head_hash, old_commits = None, frozenset()
+        else:
+            old_head_hash, old_commits = cached[0], cached[2]
+
+        new_commits = set()
+        reached_old_head = False
+        author_time = None
+
+        to_visit = [head_hash]
+
+        while len(to_visit) > 0:
+            commit_hash = to_visit.pop()
+
+            if commit_hash in new_commits:
+                continue
+
+            if commit_hash in old_commits:
+                if commit_hash == old_head_hash:
+                    reached_old_head = True
+                continue
+
+            commit = read_commit_function(repo_path, commit_hash)
+
+            if commit_hash == head_hash:
+                author_time = commit.author_time
+
+            new_commits.add(commit_hash)
+            to_visit.extend(commit.parents)
+
+        if author_time is None:
+            # head_hash itself was already known
+            author_time = read_commit_function(repo_path,
+                                               head_hash).author_time
+
+        if old_head_hash is not None and not reached_old_head:
+            return self._walk(repo_path, head_hash, None,
+                              read_commit_function)
+
+        return frozenset(old_commits | new_commits), author_time
+
+
+_commit_counter = _CommitCounter()
+
+
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        raise GitReaderError(e)
+
+
+def _resolve_ref(git_dir_path, ref_name):
+    # Find the hash a ref points to, in its loose ref file or in packed-refs
+
+    if '..' in ref_name.split('/'):
+        raise GitReaderError('Invalid ref {0}'.format(ref_name))
+
+    ref_path = os.path.join(git_dir_path, ref_name)
+
+    if os.path.isfile(ref_path):
+        value = _read_text(ref_path).strip()
+
+        if _hash_regex.fullmatch(value):
+            return value
+
+        # symbolic refs other than HEAD are unusual
+        raise GitReaderError('Unexpected contents in {0}'.format(ref_path))
+
+    packed_refs_path = os.path.join(git_dir_path, 'packed-refs')
+
+    if os.path.isfile(packed_refs_path):
+        for line in _read_text(packed_refs_path).splitlines():
+            # skip the header and peeled tag lines
+            if line.startswith('#') or line.startswith('^'):
+                continue
+
+            split_line = line.split(' ')
+
+            if len(split_line) == 2 and split_line[1] == ref_name:
+                return split_line[0]
+
+    raise GitReaderError('{0} does not exist in {1}'.format(ref_name,
+                                                             git_dir_path))
+
+
+def _read_commit_data(git_dir_path, commit_hash):
+    # Get the contents of a commit object, from a loose object or a pack
+
+    if not _hash_regex.fullmatch(commit_hash):
+        raise GitReaderError('Invalid hash {0}'.format(commit_hash))
+
+    objects_path = os.path.join(git_dir_path, 'objects')
+
+    loose_path = os.path.join(objects_path, commit_hash[:2], commit_hash[2:])
+
+    try:
+        with open(loose_path, 'rb') as f:
+            raw_data = zlib.decompress(f.read())
+    except FileNotFoundError:
+        return _read_packed_commit_data(objects_path, commit_hash)
+    except (OSError, zlib.error) as e:
+        raise GitReaderError(e)
+
+    # loose objects start with "<type> <size>\0"
+    header, null, data = raw_data.partition(b'\0')
+
+    if not header.startswith(b'commit '):
+        raise GitReaderError('{0} is not a commit'.format(commit_hash))
+
+    return data
+
+
+def _read_packed_commit_data(objects_path, commit_hash):
+    # Find a commit in the packs and return its contents
+
+    binary_hash = bytes.fromhex(commit_hash)
+    pack_dir_path = os.path.join(objects_path, 'pack')
+
+    for pack_index in _pack_index_cache.indexes(pack_dir_path):
+        offset = pack_index.find(binary_hash)
+
+        if offset is not None:
+            return _read_pack_object(pack_index.pack_path, offset,
+                                     commit_hash)
+
+    raise GitReaderError('Commit {0} not found in {1}'.format(commit_hash,
+                                                              objects_path))
+
+
+class _PackIndex:
+    # The contents of a version 2 pack index, loaded into memory
+
+    def __init__(self, idx_path):
+        try:
+            with open(idx_path, 'rb') as f:
+                self._idx = f.read()
+        except OSError as e:
+            raise GitReaderError(e)
+
+        if (self._idx[:8] != b'\377tOc\0\0\0\2' or
+                len(self._idx) < 8 + 256 * 4):
+            raise GitReaderError('{0} is not a version 2 index'
+                                 .format(idx_path))
+
+        self.pack_path = idx_path[:-len('.idx')] + '.pack'
+
+        # the fanout table holds the number of hashes whose first byte is
+        # less than or equal to each value
+        self._fanout = struct.unpack('>256I', self._idx[8:8 + 256 * 4])
+        self._object_count = self._fanout[255]
+
+        # the sorted hashes are followed by the CRCs, the 4 byte offsets, and
+        # the table of 8 byte offsets
+        self._hashes_offset = 8 + 256 * 4
+        self._offsets_offset = self._hashes_offset + 24 * self._object_count
+        self._large_offsets_offset = (self._offsets_offset +
+                                      4 * self._object_count)
+
+        if len(self._idx) < self._large_offsets_offset:
+            raise GitReaderError('{0} is truncated'.format(idx_path))
+
+    def find(self, binary_hash):
+        # Return the offset of an object in the pack, or None if the pack
+        # does not contain it
+
+        idx = self._idx
+        first_byte = binary_hash[0]
+
+        low = self._fanout[first_byte - 1] if first_byte > 0 else 0
+        high = self._fanout[first_byte]
+
+        # binary search the sorted hashes
+        while low < high:
+            middle = (low + high) // 2
+            start = self._hashes_offset + 20 * middle
+            middle_hash = idx[start:start + 20]
+
+            if middle_hash < binary_hash:
+                low = middle + 1
+            elif middle_hash > binary_hash:
+                high = middle
+            else:
+                break
+        else:
+            return None
+
+        start = self._offsets_offset + 4 * middle
+        offset = int.from_bytes(idx[start:start + 4], 'big')
+
+        # offsets with the high bit set index the table of 8 byte offsets
+        if offset & 0x80000000:
+            start = self._large_offsets_offset + 8 * (offset & 0x7fffffff)
+            offset = int.from_bytes(idx[start:start + 8], 'big')
+
+        return offset
+
+
+class _PackIndexCache:
+    # Keeps the loaded pack indexes of each pack directory. Packs are never
+    # modified in place, only added and removed, which changes the
+    # directory, so the indexes are loaded again only when the directory's
+    # inode or modification time changes.
+
+    def __init__(self):
+        self._lock = Lock()
+
+        # maps pack directory paths to (fingerprint, list of _PackIndex),
+        # least recently used first
+        self._pack_dirs = OrderedDict()
+
+    def indexes(self, pack_dir_path):
+        try:
+            stat = os.stat(pack_dir_path)
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            raise GitReaderError(e)
+
+        fingerprint = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._lock:
+            cached = self._pack_dirs.get(pack_dir_path)
+
+            if cached is not None and cached[0] == fingerprint:
+                self._pack_dirs.move_to_end(pack_dir_path)
+                return cached[1]
+
+        try:
+            filenames = sorted(os.listdir(pack_dir_path))
+        except OSError as e:
+            raise GitReaderError(e)
+
+        pack_indexes = [_PackIndex(os.path.join(pack_dir_path, filename))
+                        for filename in filenames
+                        if filename.endswith('.idx')]
+
+        with self._lock:
+            self._pack_dirs[pack_dir_path] = (fingerprint, pack_indexes)
+            self._pack_dirs.move_to_end(pack_dir_path)
+
+            while len(self._pack_dirs) > MAX_CACHED_PACK_DIRS:
+                self._pack_dirs.popitem(last=False)
+
+        return pack_indexes
+
+
+_pack_index_cache = _PackIndexCache()
+
+
+def _read_pack_object(pack_path, offset, commit_hash):
+    # Read a commit from a pack at the given offset
+
+    try:
+        with open(pack_path, 'rb') as f:
+            f.seek(offset)
+
+            # the header is the type and the size, in a variable length
+            # encoding
+            byte = f.read(1)[0]
+            object_type = (byte >> 4) & 7
+            size = byte & 15
+            shift = 4
+
+            while byte & 0x80:
+                byte = f.read(1)[0]
+                size |= (byte & 0x7f) << shift
+                shift += 7
+
+            if object_type in (_OBJ_OFS_DELTA, _OBJ_REF_DELTA):
+                raise GitReaderError('Commit {0} is deltified'
+                                     .format(commit_hash))
+
+            if object_type != _OBJ_COMMIT:
+                raise GitReaderError('{0} is not a commit'
+                                     .format(commit_hash))
+
+            decompressor = zlib.decompressobj()
+            data = b''
+
+            while not decompressor.eof:
+                chunk = f.read(4096)
+
+                if len(chunk) == 0:
+                    raise GitReaderError('{0} is truncated'
+                                         .format(pack_path))
+
+                data += decompressor.decompress(chunk)
+    except (OSError, IndexError, zlib.error) as e:
+        raise GitReaderError(e)
+
+    if len(data) != size:
+        raise GitReaderError('Commit {0} has the wrong size'
+                             .format(commit_hash))
+
+    return data
@@ -0,0 +1,107 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides functions for computing the changes between two generations of a
+faculty member's info, and for applying them.
+
+A delta is a list of operations. Each operation is a list whose first
+element is the operation name:
+
+    ["set", <path>, <value>]
+    ["delete", <path>]
+
+A path is a list of dictionary keys leading from the top of the info to the
+value that is set or deleted, for example
+[<class name>, "assignments", <assignment name>, "students_repos",
+<student username>, "hash"]. Deltas are stored as JSON, so operations are
+lists rather than tuples.
+"""
+
+from gkeepcore.gkeep_exception import GkeepException
+
+
+class InfoDeltaError(GkeepException):
+    """Raised if a delta cannot be applied."""
+    pass
+
+
+def info_delta(old_info: dict, new_info: dict) -> list:
+    """
+    Compute the operations which turn one generation of the info into
+    another.
+
+    :param old_info: the older info
+    :param new_info: the newer info
+    :return: list of operations
+    """
+
+    operations = []
+
+    _diff(old_info, new_info, [], operations)
+
+    return operations
+
+
+def apply_info_delta(info: dict, delta: list):
+    """
+    Apply a delta to the info, modifying it in place.
+
+    Raises InfoDeltaError if the delta does not fit the info, which means it
+    was computed from a different generation.
+
+    :param info: the info to modify
+    :param delta: list of operations from info_delta()
+    """
+
+    try:
+        for operation in delta:
+            name, path = operation[0], operation[1]
+
+            parent = info
+
+            for key in path[:-1]:
+                parent = parent[key]
+
+            if name == 'set':
+                parent[path[-1]] = operation[2]
+            elif name == 'delete':
+                del parent[path[-1]]
+            else:
+                raise InfoDeltaError('Unknown operation: {0}'.format(name))
+    except (IndexError, KeyError, TypeError) as e:
+        raise InfoDeltaError('Invalid delta: {0}'.format(e))
+
+
+def _diff(old, new, path, operations):
+    # Add the operations that turn the dictionary old into the dictionary
+    # new, at path, to operations
+
+    for key in old:
+        if key not in new:
+            operations.append(['delete', path + [key]])
+
+    for key, new_value in new.items():
+        if key not in old:
+            operations.append(['set', path + [key], new_value])
+            continue
+
+        old_value = old[key]
+
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            _diff(old_value, new_value, path + [key], operations)
+        elif old_value != new_value:
+            operations.append(['set', path + [key], new_value])
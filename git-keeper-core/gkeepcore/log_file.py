@@ -19,21 +19,41 @@ Provides functionality for reading and writing log files.
 
 LogFileReader is used by log file pollers for monitoring and reading log files.
 It is an abstract class, different concrete classes allow reading from local
-or remote logs.
+or remote logs. Readers keep working when a log is compacted, see
+compacted_log_header().
 
 log_append_command() builds a shell command for appending to a log.
 
+format_log_line() builds a log line in the same format without a shell, and
+LogAppender appends such lines to local log files from within the process.
+
 """
 
 import abc
+import os
 import re
+from collections import OrderedDict
 from shlex import quote
+from threading import Lock
+from time import time
+
+try:
+    from time import time_ns
+except ImportError:
+    # Python < 3.7, which the client still supports
+    def time_ns():
+        return int(time() * 10**9)
 
 from gkeepcore.gkeep_exception import GkeepException
 
 # keep the log line to 4KB or less to maintain write atomicity
 MAX_LOG_LINE_LENGTH = 4096
 
+# first line of a log whose consumed data has been removed, followed by the
+# number of bytes that were removed
+COMPACTED_LOG_HEADER = ('# THIS FILE WAS AUTO-GENERATED, DO NOT EDIT! '
+                        'compacted_from=')
+
 
 class LogFileException(GkeepException):
     """
@@ -93,6 +113,12 @@ class LogFileReader(metaclass=abc.ABCMeta):
     """
     Base class for creating objects to be used by a LogPollingThread to read
     log files.
+
+    Seek positions are offsets into all of the data ever written to the log,
+    not into the file as it is now. When a log is compacted the data that has
+    already been read is dropped and the first line of the new file records
+    how many bytes came before it (see compacted_log_header()), so positions
+    remain valid across compaction.
     """
 
     def __init__(self, file_path: str, seek_position=None):
@@ -105,9 +131,16 @@ class LogFileReader(metaclass=abc.ABCMeta):
         """
         self._file_path = file_path
 
+        # number of bytes dropped from the front of the log by compaction, and
+        # the length of the header line that replaced them
+        self._compacted_from = 0
+        self._header_length = 0
+
+        self._read_compaction_header()
+
         if seek_position is None:
             # seek to the end
-            self._seek_position = self.get_byte_count()
+            self._seek_position = self.get_end_position()
         else:
             self._seek_position = seek_position
 
@@ -121,19 +154,36 @@ class LogFileReader(metaclass=abc.ABCMeta):
 
     def get_seek_position(self) -> int:
         """
-        Get the next read offset into the file.
+        Get the next read offset into the log.
 
         :return: the current seek position
         """
         return self._seek_position
 
+    def get_end_position(self, byte_count=None) -> int:
+        """
+        Get the seek position of the end of the log.
+
+        :param byte_count: current size of the file, if already known
+        :return: the seek position after the last byte in the file
+        """
+
+        if byte_count is None:
+            byte_count = self.get_byte_count()
+
+        return self._compacted_from + byte_count - self._header_length
+
     def has_new_lines(self) -> bool:
         """
         Determine if the file has grown since it was last read.
 
         :return: True if there is new text in the file to read, False otherwise
         """
-        return self.get_byte_count() > self._seek_position
+
+        byte_count = self.get_byte_count()
+        self._check_compaction()
+
+        return self.get_end_position(byte_count) > self._seek_position
 
     def get_new_lines(self) -> list:
         """
@@ -146,11 +196,24 @@ class LogFileReader(metaclass=abc.ABCMeta):
         :return: a list of strings representing each new line
         """
 
-        if not self.has_new_lines():
-            return []
+        # a compaction can replace the file at any time, so the header is
+        # checked again after reading. If it changed, the data was read from
+        # the wrong offset and must be read again.
+        while True:
+            self._check_compaction()
+            compaction = (self._compacted_from, self._header_length)
 
-        # get the data as bytes so we can accurately update the seek position
-        data_bytes = self._read_bytes()
+            # get the data as bytes so we can accurately update the seek
+            # position
+            data_bytes = self._read_bytes(self._file_position())
+
+            self._read_compaction_header()
+
+            if (self._compacted_from, self._header_length) == compaction:
+                break
+
+        if len(data_bytes) == 0:
+            return []
 
         # move the seek position to the end of the file
         self._seek_position += len(data_bytes)
@@ -178,6 +241,38 @@ class LogFileReader(metaclass=abc.ABCMeta):
 
         return events
 
+    def _file_position(self) -> int:
+        # Offset into the file as it is now that corresponds to
+        # _seek_position
+
+        return self._seek_position - self._compacted_from + self._header_length
+
+    def _check_compaction(self):
+        # Read the header again, since the file may have been compacted
+        # without changing size. The header itself is the only reliable sign
+        # of a compaction.
+
+        self._read_compaction_header()
+
+        # if data we had not read yet was dropped there is no getting it
+        # back, so continue from the start of what remains
+        if self._seek_position < self._compacted_from:
+            self._seek_position = self._compacted_from
+
+    def _read_compaction_header(self):
+        # Read the first line of the file to find out if it has been
+        # compacted. The header is short, so only that much is read.
+
+        header_bytes = self._read_bytes(0, len(COMPACTED_LOG_HEADER) + 24)
+        compacted_from = parse_compacted_log_header(header_bytes)
+
+        if compacted_from is None:
+            self._compacted_from = 0
+            self._header_length = 0
+        else:
+            self._compacted_from = compacted_from
+            self._header_length = header_bytes.index(b'\n') + 1
+
     @abc.abstractmethod
     def get_byte_count(self) -> int:
         """
@@ -187,14 +282,48 @@ class LogFileReader(metaclass=abc.ABCMeta):
         """
 
     @abc.abstractmethod
-    def _read_bytes(self) -> bytes:
+    def _read_bytes(self, file_position: int, max_byte_count=None) -> bytes:
         """
-        Retrieve data as bytes from the file from _seek_position to the end
+        Retrieve data as bytes from the file starting at an offset into the
+        file as it is now.
 
+        :param file_position: offset into the file to start reading from
+        :param max_byte_count: maximum number of bytes to read, None to read
+         to the end
         :return: data from the file as bytes
         """
 
 
+def compacted_log_header(compacted_from: int) -> str:
+    """
+    Build the first line of a compacted log.
+
+    :param compacted_from: number of bytes that were written to the log
+     before the data that follows the header
+    :return: the header line, ending with a newline
+    """
+
+    return '{0}{1}\n'.format(COMPACTED_LOG_HEADER, compacted_from)
+
+
+def parse_compacted_log_header(data: bytes):
+    """
+    Extract the byte count from the header of a compacted log.
+
+    :param data: bytes from the start of the log file
+    :return: the byte count from the header, or None if the data does not
+     start with a compacted log header
+    """
+
+    match = re.match(re.escape(COMPACTED_LOG_HEADER.encode()) + b'(\\d+)\n',
+                     data)
+
+    if match is None:
+        return None
+
+    return int(match.group(1))
+
+
 def log_append_command(file_path: str, item_type: str, text: str):
     """
     Create a shell command to append to a log file.
@@ -226,3 +355,203 @@ def log_append_command(file_path: str, item_type: str, text: str):
                                                      quoted_path))
 
     return command
+
+
+def log_timestamp(seconds=None) -> str:
+    """
+    Format a time the same way as the timestamps written by
+    log_append_command(), which uses $(date +%s.%N | cut -c 1-15).
+
+    :param seconds: seconds since the epoch, defaults to the current time
+    :return: the timestamp as a string
+    """
+
+    if seconds is None:
+        nanoseconds = time_ns()
+    else:
+        nanoseconds = int(seconds * 10**9)
+
+    timestamp = '{0}.{1:09d}'.format(nanoseconds // 10**9,
+                                      nanoseconds % 10**9)
+
+    return timestamp[:15]
+
+
+def format_log_line(item_type: str, text: str, timestamp=None) -> str:
+    """
+    Build a line to append to a log file, in the same format as the lines
+    written by the command from log_append_command().
+
+    Newlines in the text are replaced with two spaces. If the line would be
+    longer than MAX_LOG_LINE_LENGTH bytes, not counting the newline, the text
+    is truncated and ends with ...
+
+    :param item_type: a string describing the event type
+    :param text: the payload of the event
+    :param timestamp: timestamp string to use, defaults to log_timestamp()
+    :return: the line, ending with a newline
+    """
+
+    if timestamp is None:
+        timestamp = log_timestamp()
+
+    text = text.replace('\n', '  ')
+
+    prefix = '{0} {1} '.format(timestamp, item_type)
+
+    max_text_length = MAX_LOG_LINE_LENGTH - len(prefix.encode())
+    text_bytes = text.encode()
+
+    if len(text_bytes) > max_text_length:
+        # cut on a byte boundary, dropping any partial character
+        text_bytes = text_bytes[:max_text_length - 3]
+        text = text_bytes.decode(errors='ignore') + '...'
+
+    return prefix + text + '\n'
+
+
+class LogAppender:
+    """
+    Appends lines to local log files without running a shell.
+
+    Files are opened with O_APPEND and the descriptors are kept open, so
+    appending is a single write() system call. All the lines passed to one
+    call of append_lines() are written with one write(), so lines from
+    different threads or processes never interleave.
+
+    At most max_open_files descriptors are kept open, closing the least
+    recently used one when another file is opened. If a file has been removed
+    or replaced since it was opened, it is opened again before writing.
+
+    All methods are thread safe.
+    """
+    def __init__(self, max_open_files=64):
+        """
+        Create an appender with no open files.
+
+        :param max_open_files: maximum number of descriptors to keep open
+        """
+
+        self._max_open_files = max_open_files
+
+        self._lock = Lock()
+
+        # maps file paths to open file descriptors, least recently used first
+        self._descriptors = OrderedDict()
+
+    def append(self, file_path: str, item_type: str, text: str):
+        """
+        Append a single event to a log file.
+
+        Raises LogFileException if the file cannot be written.
+
+        :param file_path: path to the log file
+        :param item_type: a string describing the event type
+        :param text: the payload of the event
+        """
+
+        self.append_lines(file_path, [format_log_line(item_type, text)])
+
+    def append_lines(self, file_path: str, lines: list, fsync=False):
+        """
+        Append lines built by format_log_line() to a log file.
+
+        Raises LogFileException if the file cannot be written.
+
+        :param file_path: path to the log file
+        :param lines: lines to append, each ending with a newline
+        :param fsync: if True, flush the file to disk after writing
+        """
+
+        data = ''.join(lines).encode()
+
+        with self._lock:
+            try:
+                fd = self._get_descriptor(file_path)
+
+                # write() may write fewer bytes than requested, in which case
+                # keep going with the rest
+                while len(data) > 0:
+                    written = os.write(fd, data)
+                    data = data[written:]
+
+                if fsync:
+                    os.fsync(fd)
+            except OSError as e:
+                self._close(file_path)
+                raise LogFileException('Error writing to {0}: {1}'
+                                       .format(file_path, e))
+
+    def sync(self, file_path: str):
+        """
+        Flush a log file that has been appended to out to disk.
+
+        Raises LogFileException on error.
+
+        :param file_path: path to the log file
+        """
+
+        with self._lock:
+            if file_path not in self._descriptors:
+                return
+
+            try:
+                os.fsync(self._descriptors[file_path])
+            except OSError as e:
+                raise LogFileException('Error syncing {0}: {1}'
+                                       .format(file_path, e))
+
+    def close(self):
+        """Close all the open files."""
+
+        with self._lock:
+            for file_path in list(self._descriptors):
+                self._close(file_path)
+
+    def _get_descriptor(self, file_path):
+        # Get the descriptor for a file, opening it if need be. The lock must
+        # be held.
+
+        if file_path in self._descriptors:
+            if self._is_current(file_path):
+                self._descriptors.move_to_end(file_path)
+                return self._descriptors[file_path]
+
+            self._close(file_path)
+
+        if len(self._descriptors) >= self._max_open_files:
+            least_recent_path = next(iter(self._descriptors))
+            self._close(least_recent_path)
+
+        # the same mode that >> in a shell would create the file with
+        self._descriptors[file_path] = \
+            os.open(file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+
+        return self._descriptors[file_path]
+
+    def _is_current(self, file_path):
+        # Determine if the open descriptor for a file still refers to the file
+        # at file_path, which is not the case if the file was removed or
+        # renamed. The lock must be held.
+
+        try:
+            path_stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+
+        descriptor_stat = os.fstat(self._descriptors[file_path])
+
+        return (path_stat.st_ino == descriptor_stat.st_ino and
+                path_stat.st_dev == descriptor_stat.st_dev)
+
+    def _close(self, file_path):
+        # Close the descriptor for a file if it is open. The lock must be
+        # held.
+
+        fd = self._descriptors.pop(file_path, None)
+
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
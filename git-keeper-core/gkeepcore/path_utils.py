@@ -235,6 +235,129 @@ def faculty_info_path(home_dir: str):
     return os.path.join(home_dir, 'info')
 
 
+def faculty_info_latest_path(home_dir: str):
+    """
+    Build the path to the link in a faculty member's info directory which
+    points to the latest info file.
+
+    :param home_dir: home directory of the faculty member
+    :return: path to the link
+    """
+
+    return os.path.join(faculty_info_path(home_dir), 'latest.json')
+
+
+def faculty_info_index_path(home_dir: str):
+    """
+    Build the path to the link in a faculty member's info directory which
+    points to the latest info index.
+
+    :param home_dir: home directory of the faculty member
+    :return: path to the link
+    """
+
+    return os.path.join(faculty_info_path(home_dir), 'index.json')
+
+
+def info_index_dir_path(home_dir: str):
+    """
+    Build the path to the directory containing the info indexes of a faculty
+    member.
+
+    :param home_dir: home directory of the faculty member
+    :return: path to the directory
+    """
+
+    return os.path.join(faculty_info_path(home_dir), 'index')
+
+
+def info_partitions_dir_path(home_dir: str):
+    """
+    Build the path to the directory containing the per-class partitions of a
+    faculty member's info.
+
+    :param home_dir: home directory of the faculty member
+    :return: path to the directory
+    """
+
+    return os.path.join(faculty_info_path(home_dir), 'classes')
+
+
+def info_deltas_dir_path(home_dir: str):
+    """
+    Build the path to the directory containing the deltas between
+    generations of a faculty member's info.
+
+    :param home_dir: home directory of the faculty member
+    :return: path to the directory
+    """
+
+    return os.path.join(faculty_info_path(home_dir), 'deltas')
+
+
+def info_delta_path(home_dir: str, generation: int):
+    """
+    Build the path to the delta which turns the previous generation of a
+    faculty member's info into the given generation.
+
+    :param home_dir: home directory of the faculty member
+    :param generation: generation number
+    :return: path to the delta
+    """
+
+    return os.path.join(info_deltas_dir_path(home_dir),
+                        info_generation_filename(generation))
+
+
+def info_partition_path(home_dir: str, class_name: str, generation: int):
+    """
+    Build the path to the partition of a faculty member's info for a class,
+    written in a generation of the info.
+
+    :param home_dir: home directory of the faculty member
+    :param class_name: name of the class
+    :param generation: generation number
+    :return: path to the partition, without a compression suffix
+    """
+
+    return os.path.join(info_partitions_dir_path(home_dir), class_name,
+                        info_generation_filename(generation))
+
+
+def info_generation_filename(generation: int) -> str:
+    """
+    Build the name of the info file for a generation of the info.
+
+    The generation is zero padded so that sorting the names sorts the
+    generations.
+
+    :param generation: generation number
+    :return: name of the file
+    """
+
+    return '{0:010d}.json'.format(generation)
+
+
+def parse_info_generation_filename(filename: str):
+    """
+    Extract the generation number from the name of an info file.
+
+    :param filename: name of the file
+    :return: the generation number, or None if the name is not the name of
+     an info file
+    """
+
+    if not filename.endswith('.json'):
+        return None
+
+    generation_string = filename[:-len('.json')]
+
+    if len(generation_string) != 10 or not generation_string.isdigit():
+        return None
+
+    return int(generation_string)
+
+
 def assignment_published_file_path(class_name: str, assignment_name: str,
                                    home_dir: str):
     """
@@ -0,0 +1,502 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides a long-lived helper process which carries out filesystem operations
+as root, so that a separate sudo process does not need to be started for
+every operation.
+
+The helper is started once with sudo:
+
+    sudo -n python3 -I -m gkeepcore.privileged_helper <root> [<root> ...]
+
+Each root is a directory that operations are allowed to touch. Paths must be
+strictly inside one of the roots after resolving symbolic links in their
+parent directories. Since users can create links inside the roots, the last
+component of a path is never followed if it is a symbolic link: operations
+which read or write a file refuse links, and the others act on the link
+itself. The target of a new symbolic link may be anywhere, since only the
+link is created.
+
+The helper reads batches of operations from stdin and writes the results to
+stdout, one JSON document per line. A batch is a list of operations, each a
+dictionary with an "op" key naming the operation and keys for its
+arguments:
+
+    {"op": "mkdir", "path": ...}
+    {"op": "chmod", "path": ..., "mode": "750", "recursive": false}
+    {"op": "chown", "path": ..., "user": ..., "group": ...,
+     "recursive": false}
+    {"op": "cp", "source": ..., "dest": ..., "recursive": false}
+    {"op": "mv", "source": ..., "dest": ...}
+    {"op": "rm", "path": ..., "recursive": false}
+    {"op": "touch", "path": ...}
+    {"op": "hard_link", "source": ..., "dest": ...}
+    {"op": "symbolic_link", "source": ..., "dest": ...}
+
+The operations behave like the commands of the same names in
+gkeepcore.system_commands. The operations of a batch are carried out in
+order and stop at the first failure. The result is a list with one
+dictionary per operation, {"ok": true} or {"ok": false, "error": ...}.
+
+PrivilegedHelper starts the helper and sends it batches. Use the
+module-level instance privileged_helper.
+"""
+
+import json
+import os
+import shutil
+import stat
+import sys
+from grp import getgrnam
+from pwd import getpwnam
+from subprocess import Popen, PIPE, DEVNULL
+from threading import Lock
+
+from gkeepcore.gkeep_exception import GkeepException
+
+
+class PrivilegedHelperError(GkeepException):
+    """Raised if the helper cannot be reached."""
+    pass
+
+
+class OperationError(GkeepException):
+    """Raised if an operation is not valid or fails."""
+    pass
+
+
+def default_allowed_roots() -> list:
+    """
+    Get the directories the helper is allowed to operate in by default: the
+    directory containing the home directories of users.
+
+    The system temporary directory is deliberately not allowed, since anyone
+    can create files there. Callers that need temporary files should create
+    them in their home directory.
+
+    :return: list of directory paths
+    """
+
+    home_root = os.path.dirname(os.path.expanduser('~'))
+
+    return [home_root]
+
+
+class PrivilegedHelper:
+    """
+    Starts the privileged helper and sends it batches of operations.
+
+    If the helper cannot be started, most likely because sudo has not been
+    configured to allow it, is_available() returns False and callers should
+    fall back to running commands with sudo.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, allowed_roots=None):
+        """
+        :param allowed_roots: directories the helper may operate in, defaults
+         to default_allowed_roots()
+        """
+
+        self._allowed_roots = allowed_roots
+        self._lock = Lock()
+        self._process = None
+
+        # None until the helper has been started for the first time
+        self._available = None
+
+    def is_available(self) -> bool:
+        """
+        Determine if batches can be sent to the helper, starting it if this is
+        the first call.
+
+        :return: True if the helper is running
+        """
+
+        with self._lock:
+            if self._available is None:
+                self._available = self._start()
+
+            return self._available
+
+    def run_batch(self, operations: list) -> list:
+        """
+        Send a batch of operations to the helper and wait for the results.
+
+        Raises PrivilegedHelperError if the helper is not available or stops
+        responding. The helper is not used again after an error.
+
+        :param operations: list of operation dictionaries
+        :return: list of result dictionaries, one per operation
+        """
+
+        if not self.is_available():
+            raise PrivilegedHelperError('privileged helper is not available')
+
+        with self._lock:
+            try:
+                self._process.stdin.write(json.dumps(operations) + '\n')
+                self._process.stdin.flush()
+                results = json.loads(self._process.stdout.readline())
+            except (OSError, ValueError) as e:
+                self._stop()
+                raise PrivilegedHelperError('privileged helper failed: {0}'
+                                            .format(e))
+
+            if not isinstance(results, list) or \
+                    len(results) != len(operations):
+                self._stop()
+                raise PrivilegedHelperError('privileged helper sent an '
+                                            'invalid response')
+
+            return results
+
+    def shutdown(self):
+        """Stop the helper if it is running."""
+
+        with self._lock:
+            self._stop()
+
+    def _start(self):
+        # Start the helper and wait for it to report that it is ready. The
+        # lock must be held.
+
+        allowed_roots = self._allowed_roots or default_allowed_roots()
+
+        # -I keeps the current directory and the environment from affecting
+        # which modules are imported as root
+        command = (['sudo', '-n', sys.executable, '-I', '-m',
+                    'gkeepcore.privileged_helper'] + allowed_roots)
+
+        try:
+            self._process = Popen(command, stdin=PIPE, stdout=PIPE,
+                                  stderr=DEVNULL, universal_newlines=True)
+            ready = json.loads(self._process.stdout.readline())
+        except (OSError, ValueError):
+            self._stop()
+            return False
+
+        if ready != {'ready': True}:
+            self._stop()
+            return False
+
+        return True
+
+    def _stop(self):
+        # Stop the helper. Closing stdin tells it to exit. The lock must be
+        # held.
+
+        self._available = False
+
+        if self._process is None:
+            return
+
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except Exception:
+            self._process.kill()
+
+        self._process = None
+
+
+class OperationRunner:
+    """
+    Carries out operations natively with os and shutil.
+
+    The helper process uses one to carry out operations as root. Operations
+    that do not need root are carried out by gkeepcore.system_commands
+    itself, since they do not need the restrictions on links and paths.
+    """
+
+    def __init__(self, allowed_roots=None):
+        """
+        :param allowed_roots: directories that operations may touch, None to
+         allow any path
+        """
+
+        if allowed_roots is None:
+            self._allowed_roots = None
+        else:
+            self._allowed_roots = [os.path.realpath(root)
+                                   for root in allowed_roots]
+
+    def run_batch(self, operations) -> list:
+        """
+        Carry out a batch of operations, stopping at the first failure.
+
+        :param operations: list of operation dictionaries
+        :return: list of result dictionaries, one per operation
+        """
+
+        if not isinstance(operations, list):
+            return []
+
+        results = []
+        failed = False
+
+        for operation in operations:
+            if failed:
+                results.append({'ok': False,
+                                'error': 'not run, an earlier operation '
+                                         'failed'})
+                continue
+
+            try:
+                self.run_operation(operation)
+                results.append({'ok': True})
+            except (OperationError, OSError, KeyError, TypeError,
+                    ValueError) as e:
+                failed = True
+                results.append({'ok': False, 'error': str(e)})
+
+        return results
+
+    def run_operation(self, operation: dict):
+        """
+        Carry out a single operation.
+
+        Raises OperationError, OSError, KeyError, TypeError, or ValueError if
+        the operation is not valid or fails.
+
+        :param operation: operation dictionary
+        """
+
+        if not isinstance(operation, dict):
+            raise OperationError('operation must be a dictionary')
+
+        name = operation.get('op')
+        method = getattr(self, '_op_{0}'.format(name), None)
+
+        if method is None:
+            raise OperationError('unknown operation: {0}'.format(name))
+
+        method(operation)
+
+    def _check_path(self, path) -> str:
+        # Make sure a path is strictly inside one of the allowed roots. The
+        # last component is not resolved so that links themselves can be
+        # operated on. Returns the normalized path.
+
+        if self._allowed_roots is None:
+            return path
+
+        if not isinstance(path, str) or not os.path.isabs(path):
+            raise OperationError('path must be absolute: {0}'.format(path))
+
+        path = os.path.normpath(path)
+        parent_path = os.path.realpath(os.path.dirname(path))
+        resolved_path = os.path.join(parent_path, os.path.basename(path))
+
+        for root in self._allowed_roots:
+            if (resolved_path != root and
+                    os.path.commonpath([root, resolved_path]) == root):
+                return resolved_path
+
+        raise OperationError('path is not allowed: {0}'.format(path))
+
+    def _op_mkdir(self, operation):
+        os.makedirs(self._check_path(operation['path']), exist_ok=True)
+
+    def _op_chmod(self, operation):
+        path = self._check_path(operation['path'])
+        mode = int(str(operation['mode']), 8)
+
+        for path in self._walk(path, operation.get('recursive', False)):
+            # like chmod -R, links are skipped
+            if not os.path.islink(path):
+                os.chmod(path, mode)
+
+    def _op_chown(self, operation):
+        path = self._check_path(operation['path'])
+        uid = getpwnam(operation['user']).pw_uid
+        gid = getgrnam(operation['group']).gr_gid
+
+        for path in self._walk(path, operation.get('recursive', False)):
+            os.chown(path, uid, gid, follow_symlinks=False)
+
+    def _op_cp(self, operation):
+        source_path = self._check_path(operation['source'])
+        dest_path = self._dest_path(operation['dest'], source_path)
+
+        if os.path.isdir(source_path) and not os.path.islink(source_path):
+            if not operation.get('recursive', False):
+                raise OperationError('{0} is a directory'
+                                     .format(source_path))
+            shutil.copytree(source_path, dest_path, symlinks=True,
+                            copy_function=_copy_file)
+        else:
+            _copy_file(source_path, dest_path)
+
+    def _op_mv(self, operation):
+        source_path = self._check_path(operation['source'])
+        dest_path = self._dest_path(operation['dest'], source_path)
+
+        shutil.move(source_path, dest_path)
+
+    def _op_rm(self, operation):
+        path = self._check_path(operation['path'])
+
+        if os.path.isdir(path) and not os.path.islink(path):
+            if not operation.get('recursive', False):
+                raise OperationError('{0} is a directory'.format(path))
+            shutil.rmtree(path)
+        else:
+            # like rm -f, a missing file is not an error
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _op_touch(self, operation):
+        path = self._check_path(operation['path'])
+
+        fd = _open_no_follow(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+        try:
+            os.utime(fd)
+        finally:
+            os.close(fd)
+
+    def _op_hard_link(self, operation):
+        # like ln, a link given as the source is linked to, not followed
+        source_path = self._check_path(operation['source'])
+        os.link(source_path, self._check_path(operation['dest']),
+                follow_symlinks=False)
+
+    def _op_symbolic_link(self, operation):
+        # the target is only stored in the link, so it may be anywhere
+        source_path = operation['source']
+
+        if not isinstance(source_path, str):
+            raise OperationError('source must be a string')
+
+        os.symlink(source_path, self._check_path(operation['dest']))
+
+    def _dest_path(self, dest_path, source_path) -> str:
+        # Like cp and mv, copying or moving to an existing directory puts the
+        # source inside it. A destination that is a link is refused rather
+        # than followed or replaced.
+
+        dest_path = self._check_path(dest_path)
+
+        if os.path.islink(dest_path):
+            raise OperationError('{0} is a symbolic link'.format(dest_path))
+
+        if os.path.isdir(dest_path):
+            dest_path = self._check_path(
+                os.path.join(dest_path, os.path.basename(source_path)))
+
+            if os.path.islink(dest_path):
+                raise OperationError('{0} is a symbolic link'
+                                     .format(dest_path))
+
+        return dest_path
+
+    def _walk(self, path, recursive):
+        # Yield path, and everything below it if recursive is True, without
+        # following links
+
+        yield path
+
+        if not recursive or os.path.islink(path) or not os.path.isdir(path):
+            return
+
+        for dir_path, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                yield os.path.join(dir_path, name)
+
+
+def _open_no_follow(path, flags, mode=0o666) -> int:
+    # Open a file, refusing to follow a symbolic link in the last component
+    # of the path. O_NOFOLLOW makes the check and the open a single step, so
+    # a link cannot be swapped in between them.
+
+    try:
+        return os.open(path, flags | os.O_NOFOLLOW, mode)
+    except OSError as e:
+        if os.path.islink(path):
+            raise OperationError('{0} is a symbolic link'.format(path))
+        raise
+
+
+def _copy_file(source_path, dest_path):
+    # Copy the contents and permissions of a regular file without following
+    # links, for cp. Links inside directories copied by copytree() are
+    # copied as links and never get here. Special permission bits are not
+    # copied, so a copy made as root never becomes setuid.
+
+    # O_NONBLOCK keeps a FIFO from blocking the open
+    source_fd = _open_no_follow(source_path, os.O_RDONLY | os.O_NONBLOCK)
+
+    try:
+        source_stat = os.fstat(source_fd)
+
+        if not stat.S_ISREG(source_stat.st_mode):
+            raise OperationError('{0} is not a regular file'
+                                 .format(source_path))
+
+        source_mode = source_stat.st_mode & 0o777
+        dest_fd = _open_no_follow(dest_path,
+                                  os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                  source_mode)
+
+        try:
+            with open(source_fd, 'rb', closefd=False) as source_file, \
+                    open(dest_fd, 'wb', closefd=False) as dest_file:
+                shutil.copyfileobj(source_file, dest_file)
+
+            os.fchmod(dest_fd, source_mode)
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(source_fd)
+
+    return dest_path
+
+
+def main():
+    """
+    Entry point of the helper process. The arguments are the allowed roots.
+    """
+
+    if len(sys.argv) < 2:
+        print('Usage: python3 -I -m gkeepcore.privileged_helper '
+              '<root> [<root> ...]', file=sys.stderr)
+        sys.exit(1)
+
+    runner = OperationRunner(sys.argv[1:])
+
+    print(json.dumps({'ready': True}), flush=True)
+
+    # stdin is closed when the parent process is done with the helper
+    for line in sys.stdin:
+        try:
+            operations = json.loads(line)
+        except ValueError:
+            operations = None
+
+        print(json.dumps(runner.run_batch(operations)), flush=True)
+
+
+# module-level instance for global access
+privileged_helper = PrivilegedHelper()
+
+
+if __name__ == '__main__':
+    main()
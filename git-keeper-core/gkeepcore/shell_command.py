@@ -16,13 +16,64 @@
 
 """
 Provides a run_command() function for running shell commands.
+
+Commands are run in their own process group. If a command runs for longer
+than its timeout, the whole group is killed and CommandTimeoutError is
+raised. Commands that are not given a timeout get a default timeout based on
+the program being run, see default_timeout().
+
+run_command_with_result() returns a CommandResult which includes the
+resources that the command used.
 """
 
 import os
-from subprocess import check_output, CalledProcessError, STDOUT
+import selectors
+import signal
+from collections import namedtuple
+from subprocess import Popen, PIPE, STDOUT
+from time import perf_counter, sleep
 
 from gkeepcore.gkeep_exception import GkeepException
 
+# default timeouts in seconds, by program name
+DEFAULT_TIMEOUTS = {
+    'git': 300,
+    'useradd': 60,
+    'usermod': 60,
+    'chpasswd': 60,
+    'groupadd': 60,
+    'chmod': 120,
+    'chown': 120,
+    'cp': 120,
+    'ln': 120,
+    'mkdir': 120,
+    'mv': 120,
+    'rm': 120,
+    'touch': 120,
+}
+
+# seconds to wait after asking a timed out command to terminate before
+# killing it
+TERMINATE_GRACE_PERIOD = 5
+
+# used as the default for timeout parameters, meaning default_timeout()
+DEFAULT = object()
+
+CommandResult = namedtuple('CommandResult', ['output', 'returncode',
+                                             'wall_time', 'user_time',
+                                             'system_time', 'max_rss'])
+CommandResult.__doc__ = """
+The result of running a command.
+
+output - stdout of the command as a string, including stderr by default
+returncode - exit code of the command, or the negated signal number if it was
+ killed by a signal
+wall_time - seconds the command ran for
+user_time - seconds of user CPU time used by the command
+system_time - seconds of system CPU time used by the command
+max_rss - maximum resident set size of the command in kilobytes
+"""
+
 
 class CommandError(GkeepException):
     """
@@ -32,27 +83,81 @@ class CommandError(GkeepException):
     pass
 
 
-def run_command(command, sudo=False, stderr=STDOUT) -> str:
+class CommandTimeoutError(CommandError):
+    """Raised if a command does not finish before its timeout."""
+    pass
+
+
+def default_timeout(command):
+    """
+    Get the default timeout for a command from DEFAULT_TIMEOUTS, based on the
+    program it runs.
+
+    :param command: a shell command as a string or a list of strings
+     representing each argument, not including sudo
+    :return: timeout in seconds, or None for no timeout
+    """
+
+    if isinstance(command, str):
+        command = command.split()
+
+    if len(command) == 0:
+        return None
+
+    program = os.path.basename(command[0])
+
+    return DEFAULT_TIMEOUTS.get(program)
+
+
+def run_command(command, sudo=False, stderr=STDOUT, cwd=None,
+                timeout=DEFAULT, output_callback=None) -> str:
     """
     Run a shell command and return the output.
 
     By default the output is stdout and stderr combined.
 
-    Raises a CommandError exception if the command has a non-zero exit code.
+    Raises a CommandError exception if the command has a non-zero exit code,
+    and CommandTimeoutError if it times out.
 
     :param command: a shell command as a string or a list of strings
      representing each argument
     :param sudo: set to True to run the command using sudo
     :param stderr: where to send stderr
+    :param cwd: working directory for the command, None for the current
+     working directory
+    :param timeout: seconds to let the command run before killing it, None
+     for no timeout. Defaults to default_timeout(command).
+    :param output_callback: function to call with each line of output as a
+     string as the command produces it
     :return: the output of the command
 
     """
 
+    return run_command_with_result(command, sudo=sudo, stderr=stderr,
+                                   cwd=cwd, timeout=timeout,
+                                   output_callback=output_callback).output
+
+
+def run_command_with_result(command, sudo=False, stderr=STDOUT, cwd=None,
+                            timeout=DEFAULT,
+                            output_callback=None) -> CommandResult:
+    """
+    Run a shell command and return its output and resource usage.
+
+    Takes the same parameters as run_command() and raises the same
+    exceptions.
+
+    :return: a CommandResult
+    """
+
     # command must be a string or list
     if not isinstance(command, str) and not isinstance(command, list):
         raise CommandError('command must be a string or a list, not {0}'
                            .format(type(command)))
 
+    if timeout is DEFAULT:
+        timeout = default_timeout(command)
+
     # prepend sudo if need be
     if sudo:
         if isinstance(command, str):
@@ -60,65 +165,167 @@ def run_command(command, sudo=False, stderr=STDOUT) -> str:
         else:
             command = ['sudo', '-n'] + command
 
-    # run the command
+    start_time = perf_counter()
+
+    # shell must be True if we're using a string instead of a list. The
+    # command gets its own process group so that everything it starts can be
+    # killed if it times out.
     try:
-        if isinstance(command, str):
-            # shell must be True if we're using a string instead of a list
-            output = check_output(command, stderr=stderr, shell=True)
-        else:
-            output = check_output(command, stderr=stderr, shell=False)
-    except CalledProcessError as e:
+        process = Popen(command, stdout=PIPE, stderr=stderr,
+                        shell=isinstance(command, str), cwd=cwd,
+                        start_new_session=True)
+    except OSError as e:
+        raise CommandError(e)
+
+    output_bytes, timed_out = _read_output(process, timeout, output_callback)
+
+    if timed_out:
+        # a command run with sudo cannot be killed directly, so do not wait
+        # forever if it ignores SIGTERM
+        wait_options = os.WNOHANG
+        wait_deadline = perf_counter() + TERMINATE_GRACE_PERIOD
+    else:
+        wait_options = 0
+        wait_deadline = None
+
+    # wait4() reaps the process and provides its resource usage
+    pid, status, rusage = os.wait4(process.pid, wait_options)
+
+    while pid == 0:
+        if perf_counter() > wait_deadline:
+            raise CommandTimeoutError('Command timed out after {0} seconds '
+                                      'and could not be killed'
+                                      .format(timeout))
+        sleep(0.1)
+        pid, status, rusage = os.wait4(process.pid, wait_options)
+
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+
+    # Popen must not try to reap the process again
+    process.returncode = returncode
+
+    # convert the output from bytes to a string
+    output = output_bytes.decode('utf-8', errors='replace')
+
+    if timed_out:
+        raise CommandTimeoutError('Command timed out after {0} seconds: {1}'
+                                  .format(timeout, output))
+
+    if returncode != 0:
         # the CommandError exception will contain the output as a string
-        raise CommandError(e.output.decode('utf-8'))
+        raise CommandError(output)
 
-    # convert the output from bytes to a string when returning
-    return output.decode('utf-8')
+    return CommandResult(output, returncode, perf_counter() - start_time,
+                         rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss)
 
 
-class ChangeDirectoryContext:
-    """
-    For use as a context manager to change into a directory and change out
-    again.
+def _read_output(process, timeout, output_callback):
+    # Read stdout from a process until it is closed, killing the process
+    # group if the timeout passes. Any stderr pipe is drained and discarded,
+    # the same as check_output(). Returns the output as bytes and whether or
+    # not the command timed out.
 
-    Example:
+    deadline = None if timeout is None else perf_counter() + timeout
+    timed_out = False
 
-        with ChangeDirectoryContext('path/to/dir'):
-            # do stuff in the new working directory
+    output_chunks = []
+    partial_line = b''
 
-        # changed back to old directory
-    """
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ)
+
+    if process.stderr is not None:
+        selector.register(process.stderr, selectors.EVENT_READ)
 
-    def __init__(self, path):
-        self._old_wd = os.getcwd()
-        self._new_wd = path
+    with selector:
+        while len(selector.get_map()) > 0:
+            if deadline is None:
+                wait_time = None
+            else:
+                wait_time = deadline - perf_counter()
 
-    def __enter__(self):
-        os.chdir(self._new_wd)
+                if wait_time <= 0:
+                    if timed_out:
+                        # the command ignored being asked to terminate
+                        _kill_process_group(process, signal.SIGKILL)
+                        break
 
-    def __exit__(self, *args):
-        os.chdir(self._old_wd)
+                    timed_out = True
+                    _kill_process_group(process, signal.SIGTERM)
+                    deadline = perf_counter() + TERMINATE_GRACE_PERIOD
+                    continue
+
+            for key, events in selector.select(wait_time):
+                data = os.read(key.fd, 65536)
+
+                if len(data) == 0:
+                    selector.unregister(key.fileobj)
+                    continue
+
+                if key.fileobj is not process.stdout:
+                    continue
+
+                output_chunks.append(data)
+
+                if output_callback is not None:
+                    lines = (partial_line + data).split(b'\n')
+                    partial_line = lines.pop()
+
+                    for line in lines:
+                        output_callback(line.decode('utf-8',
+                                                    errors='replace'))
+
+    if output_callback is not None and len(partial_line) > 0:
+        output_callback(partial_line.decode('utf-8', errors='replace'))
+
+    process.stdout.close()
+
+    if process.stderr is not None:
+        process.stderr.close()
+
+    return b''.join(output_chunks), timed_out
+
+
+def _kill_process_group(process, signal_number):
+    # Send a signal to every process in the command's process group. The
+    # processes may have exited already, and processes run with sudo may not
+    # be signaled directly, but sudo passes SIGTERM on to its command.
+
+    try:
+        os.killpg(process.pid, signal_number)
+    except (ProcessLookupError, PermissionError):
+        pass
 
 
-def run_command_in_directory(path, command, sudo=False, stderr=STDOUT):
+def run_command_in_directory(path, command, sudo=False, stderr=STDOUT,
+                             timeout=DEFAULT, output_callback=None):
     """
-    Change into a new working directory, run a command, and change back.
+    Run a command with a different working directory.
 
     Raises CommandError if the command could not be called or has a non-zero
-    exit code.
+    exit code, and CommandTimeoutError if it times out.
 
-    After returning, the working directory will be the original working
-    directory regardless of whether an exception was thrown or not.
+    The working directory of this process is not changed, so this is safe to
+    call from multiple threads at once.
 
     :param path: new working directory to change in to
     :param command: a shell command as a string or a list of strings
      representing each argument
     :param sudo: set to True to run the command using sudo
     :param stderr: where to send stderr
+    :param timeout: seconds to let the command run before killing it, see
+     run_command()
+    :param output_callback: function to call with each line of output
     :return: the output of the command
     """
     try:
-        with ChangeDirectoryContext(path):
-            output = run_command(command, sudo=sudo, stderr=stderr)
+        output = run_command(command, sudo=sudo, stderr=stderr, cwd=path,
+                             timeout=timeout, output_callback=output_callback)
+    except CommandError:
+        raise
     except Exception as e:
         raise CommandError(e)
 
@@ -16,16 +16,45 @@
 
 """
 Provides functions for system calls and command line filesystem operations.
+
+Filesystem operations that do not need sudo are carried out in-process with
+os and shutil rather than by running commands, following the same rules as
+the commands they replace. Operations that are run with sudo are carried out
+by the privileged helper from gkeepcore.privileged_helper if it is
+available, rather than starting a sudo process for each one. SudoBatch sends
+several operations to the helper at once.
 """
 
 import os
+import re
+import shutil
+import stat
 from getpass import getuser
 from grp import getgrgid, getgrnam
 from pwd import getpwuid, getpwnam
 from shutil import which
 
+from gkeepcore.privileged_helper import privileged_helper, \
+    PrivilegedHelperError
 from gkeepcore.shell_command import run_command, CommandError
 
+# permission bits that each class of user in a symbolic mode can change
+_WHO_BITS = {
+    'u': stat.S_ISUID | stat.S_IRWXU,
+    'g': stat.S_ISGID | stat.S_IRWXG,
+    'o': stat.S_ISVTX | stat.S_IRWXO,
+}
+_WHO_BITS['a'] = _WHO_BITS['u'] | _WHO_BITS['g'] | _WHO_BITS['o']
+
+# permission bits named by each letter of a symbolic mode, for all classes
+_PERMISSION_BITS = {
+    'r': 0o444,
+    'w': 0o222,
+    'x': 0o111,
+    's': stat.S_ISUID | stat.S_ISGID,
+    't': stat.S_ISVTX,
+}
+
 
 def this_user():
     """
@@ -44,8 +73,21 @@ def this_group():
     :return: the group name
     """
 
-    username = getuser()
-    gid = getpwnam(username).pw_gid
+    return default_group(getuser())
+
+
+def default_group(user):
+    """
+    Get the name of the default group of a user, which is not necessarily
+    named after the user.
+
+    Raises KeyError if the user or group does not exist.
+
+    :param user: username of the user
+    :return: the group name
+    """
+
+    gid = getpwnam(user).pw_gid
     group_name = getgrgid(gid).gr_name
 
     return group_name
@@ -53,10 +95,12 @@ def this_group():
 
 def chmod(path, permissions_mode, recursive=False, sudo=False):
     """
-    Change the permissions of a file or directory using chmod.
+    Change the permissions of a file or directory.
 
     The mode specifies the read/write/execute permissions for the user, group,
-    and others. The mode is passed to chmod.
+    and others. Octal modes such as '750' and symbolic modes which name the
+    classes they change, such as 'g+rx,o-rwx', are set directly. Any other
+    mode is passed to chmod.
 
     :param path: path to the file or directory
     :param permissions_mode: chmod mode
@@ -76,7 +120,17 @@ def chmod(path, permissions_mode, recursive=False, sudo=False):
     else:
         cmd = ['chmod', permissions_mode, path]
 
-    run_command(cmd, sudo=sudo)
+    if sudo:
+        # the helper only takes octal modes
+        if re.fullmatch('[0-7]{3,4}', permissions_mode):
+            _run_with_sudo(_chmod_operation(path, permissions_mode,
+                                            recursive), cmd)
+        else:
+            run_command(cmd, sudo=True)
+    elif _parse_mode(permissions_mode) is None:
+        run_command(cmd)
+    else:
+        _run(_chmod_operation(path, permissions_mode, recursive), cmd, False)
 
 
 def sudo_chown(path, user, group, recursive=False):
@@ -93,12 +147,8 @@ def sudo_chown(path, user, group, recursive=False):
      path
     """
 
-    if recursive:
-        cmd = ['chown', '-R', '{0}:{1}'.format(user, group), path]
-    else:
-        cmd = ['chown', '{0}:{1}'.format(user, group), path]
-
-    run_command(cmd, sudo=True)
+    cmd = _chown_command(path, user, group, recursive)
+    _run_with_sudo(_chown_operation(path, user, group, recursive), cmd)
 
 
 def sudo_add_user_to_group(user, group):
@@ -252,7 +302,7 @@ def mkdir(path, sudo=False):
     """
 
     cmd = ['mkdir', '-p', path]
-    run_command(cmd, sudo=sudo)
+    _run(_path_operation('mkdir', path), cmd, sudo)
 
 
 def make_symbolic_link(source_path: str, link_path: str, sudo=False):
@@ -265,7 +315,23 @@ def make_symbolic_link(source_path: str, link_path: str, sudo=False):
     """
 
     cmd = ['ln', '-s', source_path, link_path]
-    run_command(cmd, sudo=sudo)
+    operation = _source_dest_operation('symbolic_link', source_path,
+                                       link_path)
+    _run(operation, cmd, sudo)
+
+
+def make_hard_link(source_path: str, link_path: str, sudo=False):
+    """
+    Create a hard link to a file.
+
+    :param source_path: path to the existing file
+    :param link_path: path to the link to be created
+    :param sudo: if True, it will be run as root using sudo
+    """
+
+    cmd = ['ln', source_path, link_path]
+    operation = _source_dest_operation('hard_link', source_path, link_path)
+    _run(operation, cmd, sudo)
 
 
 def touch(path, sudo=False):
@@ -278,7 +344,7 @@ def touch(path, sudo=False):
     """
 
     cmd = ['touch', path]
-    run_command(cmd, sudo=sudo)
+    _run(_path_operation('touch', path), cmd, sudo)
 
 
 def mv(source_path, dest_path, sudo=False):
@@ -295,7 +361,7 @@ def mv(source_path, dest_path, sudo=False):
     """
 
     cmd = ['mv', source_path, dest_path]
-    run_command(cmd, sudo=sudo)
+    _run(_source_dest_operation('mv', source_path, dest_path), cmd, sudo)
 
 
 def cp(source_path, dest_path, recursive=False, sudo=False):
@@ -314,14 +380,8 @@ def cp(source_path, dest_path, recursive=False, sudo=False):
     :param sudo: if True, it will be run as root using sudo
     """
 
-    cmd = ['cp']
-
-    if recursive:
-        cmd.append('-r')
-
-    cmd += [source_path, dest_path]
-
-    run_command(cmd, sudo=sudo)
+    cmd = _cp_command(source_path, dest_path, recursive)
+    _run(_cp_operation(source_path, dest_path, recursive), cmd, sudo)
 
 
 def rm(path, recursive=False, sudo=False):
@@ -335,6 +395,242 @@ def rm(path, recursive=False, sudo=False):
     :param sudo: if True, it will be run as root using sudo
     """
 
+    cmd = _rm_command(path, recursive)
+    _run(_rm_operation(path, recursive), cmd, sudo)
+
+
+class SudoBatch:
+    """
+    Collects filesystem operations to be run as root and runs them together.
+
+    With the privileged helper the whole batch costs one round trip to the
+    helper. Without it, each operation is run with sudo in turn.
+
+    Example usage::
+
+        batch = SudoBatch()
+        batch.mkdir(path)
+        batch.chown(path, user, group)
+        batch.run()
+
+    """
+
+    def __init__(self):
+        """Create an empty batch."""
+
+        # (helper operation, equivalent command) pairs
+        self._operations = []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def mkdir(self, path):
+        """
+        Add an operation like mkdir(path, sudo=True).
+
+        :param path: path to the new directory
+        """
+
+        self._operations.append((_path_operation('mkdir', path),
+                                 ['mkdir', '-p', path]))
+
+    def chmod(self, path, permissions_mode: str, recursive=False):
+        """
+        Add an operation like chmod(path, permissions_mode, sudo=True).
+
+        :param path: path to the file or directory
+        :param permissions_mode: octal mode as a string, such as '750'
+        :param recursive: if True it will change files and directories
+         recursively
+        """
+
+        if not re.fullmatch('[0-7]{3,4}', permissions_mode):
+            raise CommandError('mode must be octal: {0}'
+                               .format(permissions_mode))
+
+        if recursive:
+            cmd = ['chmod', '-R', permissions_mode, path]
+        else:
+            cmd = ['chmod', permissions_mode, path]
+
+        self._operations.append((_chmod_operation(path, permissions_mode,
+                                                  recursive), cmd))
+
+    def chown(self, path, user, group, recursive=False):
+        """
+        Add an operation like sudo_chown().
+
+        :param path: path to the file or directory
+        :param user: new user owner
+        :param group: new group owner
+        :param recursive: if True will apply to all files and directories
+         under path
+        """
+
+        self._operations.append((_chown_operation(path, user, group,
+                                                  recursive),
+                                 _chown_command(path, user, group,
+                                                recursive)))
+
+    def cp(self, source_path, dest_path, recursive=False):
+        """
+        Add an operation like cp(source_path, dest_path, sudo=True).
+
+        :param source_path: path to the file or directory to be copied
+        :param dest_path: the new path or an existing directory to copy the
+         file into
+        :param recursive: if True, will copy directories
+        """
+
+        self._operations.append((_cp_operation(source_path, dest_path,
+                                               recursive),
+                                 _cp_command(source_path, dest_path,
+                                             recursive)))
+
+    def mv(self, source_path, dest_path):
+        """
+        Add an operation like mv(source_path, dest_path, sudo=True).
+
+        :param source_path: the original path to the file or directory
+        :param dest_path: the new path or an existing directory to move the
+         file into
+        """
+
+        self._operations.append((_source_dest_operation('mv', source_path,
+                                                        dest_path),
+                                 ['mv', source_path, dest_path]))
+
+    def rm(self, path, recursive=False):
+        """
+        Add an operation like rm(path, sudo=True).
+
+        :param path: path to the file or directory to be removed
+        :param recursive: if True, will remove directories
+        """
+
+        self._operations.append((_rm_operation(path, recursive),
+                                 _rm_command(path, recursive)))
+
+    def touch(self, path):
+        """
+        Add an operation like touch(path, sudo=True).
+
+        :param path: path to the file or directory
+        """
+
+        self._operations.append((_path_operation('touch', path),
+                                 ['touch', path]))
+
+    def run(self):
+        """
+        Run the operations in the order they were added, then empty the
+        batch.
+
+        Raises CommandError if an operation fails. Operations after the one
+        that failed are not run.
+        """
+
+        operations = self._operations
+        self._operations = []
+
+        if len(operations) == 0:
+            return
+
+        if not privileged_helper.is_available():
+            for operation, cmd in operations:
+                run_command(cmd, sudo=True)
+            return
+
+        try:
+            results = privileged_helper.run_batch([operation for operation, cmd
+                                                   in operations])
+        except PrivilegedHelperError as e:
+            raise CommandError(e)
+
+        for (operation, cmd), result in zip(operations, results):
+            if not result.get('ok'):
+                raise CommandError('{0}: {1}'.format(' '.join(cmd),
+                                                     result.get('error')))
+
+
+def _run(operation: dict, cmd: list, sudo: bool):
+    # Carry out an operation, using the privileged helper if sudo is True
+    # and in-process otherwise
+
+    if sudo:
+        _run_with_sudo(operation, cmd)
+        return
+
+    try:
+        _local_operations[operation['op']](operation)
+    except (CommandError, OSError, shutil.Error) as e:
+        raise CommandError('{0}: {1}'.format(' '.join(cmd), e))
+
+
+def _run_with_sudo(operation: dict, cmd: list):
+    # Carry out an operation as root with the privileged helper if it is
+    # available, or by running the equivalent command with sudo
+
+    if not privileged_helper.is_available():
+        run_command(cmd, sudo=True)
+        return
+
+    try:
+        result = privileged_helper.run_batch([operation])[0]
+    except PrivilegedHelperError as e:
+        raise CommandError(e)
+
+    if not result.get('ok'):
+        raise CommandError('{0}: {1}'.format(' '.join(cmd),
+                                             result.get('error')))
+
+
+def _path_operation(name, path):
+    return {'op': name, 'path': path}
+
+
+def _source_dest_operation(name, source_path, dest_path):
+    return {'op': name, 'source': source_path, 'dest': dest_path}
+
+
+def _chmod_operation(path, permissions_mode, recursive):
+    return {'op': 'chmod', 'path': path, 'mode': permissions_mode,
+            'recursive': recursive}
+
+
+def _chown_operation(path, user, group, recursive):
+    return {'op': 'chown', 'path': path, 'user': user, 'group': group,
+            'recursive': recursive}
+
+
+def _chown_command(path, user, group, recursive):
+    if recursive:
+        return ['chown', '-R', '{0}:{1}'.format(user, group), path]
+    else:
+        return ['chown', '{0}:{1}'.format(user, group), path]
+
+
+def _cp_operation(source_path, dest_path, recursive):
+    return {'op': 'cp', 'source': source_path, 'dest': dest_path,
+            'recursive': recursive}
+
+
+def _cp_command(source_path, dest_path, recursive):
+    cmd = ['cp']
+
+    if recursive:
+        cmd.append('-r')
+
+    cmd += [source_path, dest_path]
+
+    return cmd
+
+
+def _rm_operation(path, recursive):
+    return {'op': 'rm', 'path': path, 'recursive': recursive}
+
+
+def _rm_command(path, recursive):
     cmd = ['rm', '-f']
 
     if recursive:
@@ -342,4 +638,252 @@ def rm(path, recursive=False, sudo=False):
 
     cmd.append(path)
 
-    run_command(cmd, sudo=sudo)
+    return cmd
+
+
+# The functions below carry out operations in-process without sudo. Unlike
+# the privileged helper, which refuses links that users could have planted,
+# they follow the rules of the commands they replace.
+
+def _local_mkdir(operation):
+    os.makedirs(operation['path'], exist_ok=True)
+
+
+def _local_chmod(operation):
+    # Like chmod -R, links are followed if they are named directly but
+    # skipped if they are found inside a directory
+
+    path = operation['path']
+    clauses = _parse_mode(operation['mode'])
+
+    _chmod_path(path, clauses)
+
+    if not operation['recursive'] or not os.path.isdir(path):
+        return
+
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in dir_names + file_names:
+            child_path = os.path.join(dir_path, name)
+
+            if not os.path.islink(child_path):
+                _chmod_path(child_path, clauses)
+
+
+def _local_cp(operation):
+    # Like cp, the source is followed if it is a link, unless it is copied
+    # recursively in which case the link itself is copied
+
+    source_path = operation['source']
+    dest_path = _into_directory(source_path, operation['dest'])
+    recursive = operation['recursive']
+
+    if recursive and os.path.islink(source_path):
+        _copy_link(source_path, dest_path)
+    elif os.path.isdir(source_path):
+        if not recursive:
+            raise CommandError('{0} is a directory'.format(source_path))
+        _copy_tree(source_path, dest_path)
+    else:
+        _copy_file(source_path, dest_path)
+
+
+def _local_mv(operation):
+    # shutil.move() already moves into an existing directory
+    shutil.move(operation['source'], operation['dest'])
+
+
+def _local_rm(operation):
+    path = operation['path']
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        if not operation['recursive']:
+            raise CommandError('{0} is a directory'.format(path))
+        shutil.rmtree(path)
+    else:
+        # like rm -f, a missing file is not an error
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _local_touch(operation):
+    # Like touch, an existing file or directory only has its times updated,
+    # and links are followed
+
+    path = operation['path']
+
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        with open(path, 'a'):
+            pass
+
+
+def _local_hard_link(operation):
+    # like ln, a link given as the source is linked to, not followed
+    source_path = operation['source']
+    dest_path = _into_directory(source_path, operation['dest'])
+
+    os.link(source_path, dest_path, follow_symlinks=False)
+
+
+def _local_symbolic_link(operation):
+    source_path = operation['source']
+    dest_path = _into_directory(source_path, operation['dest'])
+
+    os.symlink(source_path, dest_path)
+
+
+def _into_directory(source_path, dest_path) -> str:
+    # Like cp and ln, a destination that is an existing directory gets the
+    # source put inside it
+
+    if os.path.isdir(dest_path):
+        return os.path.join(dest_path, os.path.basename(source_path))
+
+    return dest_path
+
+
+def _copy_file(source_path, dest_path):
+    # Like cp without -p, a new file gets the permissions of the source
+    # limited by the umask, and an existing file keeps its permissions
+
+    source_mode = stat.S_IMODE(os.stat(source_path).st_mode) & 0o777
+
+    with open(source_path, 'rb') as source_file:
+        dest_fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                          source_mode)
+
+        with open(dest_fd, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+
+
+def _copy_link(source_path, dest_path):
+    # Like cp -r, a link replaces an existing file rather than writing
+    # through it
+
+    if os.path.lexists(dest_path) and not os.path.isdir(dest_path):
+        os.remove(dest_path)
+
+    os.symlink(os.readlink(source_path), dest_path)
+
+
+def _copy_tree(source_path, dest_path):
+    # Like cp -r, copying onto an existing directory merges the contents,
+    # and links inside the source are copied as links
+
+    if os.path.isdir(dest_path):
+        restore_mode = None
+    else:
+        source_mode = stat.S_IMODE(os.stat(source_path).st_mode)
+        os.mkdir(dest_path, source_mode)
+
+        # the contents cannot be copied into a directory we cannot write
+        # to, so its permissions are set once it is full
+        restore_mode = stat.S_IMODE(os.stat(dest_path).st_mode)
+        os.chmod(dest_path, restore_mode | stat.S_IRWXU)
+
+    for entry in os.scandir(source_path):
+        entry_dest_path = os.path.join(dest_path, entry.name)
+
+        if entry.is_symlink():
+            _copy_link(entry.path, entry_dest_path)
+        elif entry.is_dir():
+            _copy_tree(entry.path, entry_dest_path)
+        else:
+            _copy_file(entry.path, entry_dest_path)
+
+    if restore_mode is not None:
+        os.chmod(dest_path, restore_mode)
+
+
+def _parse_mode(permissions_mode: str):
+    # Parse an octal or symbolic mode into a list of
+    # (class bits, operator, permission bits, keep set-ID bits) clauses.
+    # Permission bits are a string of letters from a symbolic mode, or an
+    # int from an octal mode. Returns None for modes that are not supported
+    # in-process, which are symbolic modes that do not name the classes they
+    # change (those depend on the umask) or that copy permissions from one
+    # class to another.
+
+    if re.fullmatch('[0-7]{1,5}', permissions_mode):
+        # like chmod, a numeric mode with fewer than 5 digits leaves the
+        # set-user-ID and set-group-ID bits of a directory alone
+        return [(_WHO_BITS['a'], '=', int(permissions_mode, 8),
+                 len(permissions_mode) < 5)]
+
+    clauses = []
+
+    for clause in permissions_mode.split(','):
+        match = re.fullmatch('([ugoa]+)((?:[-+=][rwxXst]*)+)', clause)
+
+        if match is None:
+            return None
+
+        who_bits = 0
+
+        for who in match.group(1):
+            who_bits |= _WHO_BITS[who]
+
+        # like chmod, = leaves the set-user-ID and set-group-ID bits of a
+        # directory alone unless s is given
+        for operator, permissions in re.findall('([-+=])([rwxXst]*)',
+                                                match.group(2)):
+            clauses.append((who_bits, operator, permissions,
+                            's' not in permissions))
+
+    return clauses
+
+
+def _chmod_path(path, clauses):
+    # Apply parsed mode clauses to a single path, following links
+
+    path_stat = os.stat(path)
+    old_mode = stat.S_IMODE(path_stat.st_mode)
+    is_dir = stat.S_ISDIR(path_stat.st_mode)
+    new_mode = old_mode
+
+    for who_bits, operator, permissions, keep_set_id_bits in clauses:
+        if isinstance(permissions, int):
+            permission_bits = permissions
+        else:
+            permission_bits = 0
+
+            for permission in permissions:
+                if permission == 'X':
+                    # execute only for directories and files that some
+                    # class can already execute
+                    if is_dir or new_mode & 0o111:
+                        permission_bits |= 0o111
+                else:
+                    permission_bits |= _PERMISSION_BITS[permission]
+
+        permission_bits &= who_bits
+
+        if operator == '+':
+            new_mode |= permission_bits
+        elif operator == '-':
+            new_mode &= ~permission_bits
+        else:
+            cleared_bits = who_bits
+
+            if is_dir and keep_set_id_bits:
+                cleared_bits &= ~(stat.S_ISUID | stat.S_ISGID)
+
+            new_mode = (new_mode & ~cleared_bits) | permission_bits
+
+    if new_mode != old_mode:
+        os.chmod(path, new_mode)
+
+
+_local_operations = {
+    'mkdir': _local_mkdir,
+    'chmod': _local_chmod,
+    'cp': _local_cp,
+    'mv': _local_mv,
+    'rm': _local_rm,
+    'touch': _local_touch,
+    'hard_link': _local_hard_link,
+    'symbolic_link': _local_symbolic_link,
+}
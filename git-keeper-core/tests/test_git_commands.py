@@ -0,0 +1,111 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the git cat-file session pool in gkeepcore.git_commands."""
+
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from gkeepcore.git_commands import cat_file_pool, CatFileSessionPool, \
+    git_head_summary
+from gkeepcore.shell_command import CommandError
+
+_env = dict(os.environ, GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='t@t',
+            GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='t@t')
+
+
+def _git(repo_path, *args):
+    return subprocess.check_output(['git', '-C', repo_path] + list(args),
+                                   env=_env, universal_newlines=True)
+
+
+def _make_repo(repo_path):
+    _git(os.path.dirname(repo_path), 'init', '-q', '-b', 'master',
+         repo_path)
+    _git(repo_path, 'commit', '-q', '--allow-empty', '-m', 'commit')
+
+
+def test_cat_file_session_pool():
+    pool = CatFileSessionPool(size=2)
+
+    with TemporaryDirectory() as temp_dir_path:
+        repo_paths = [os.path.join(temp_dir_path, name)
+                      for name in ('a', 'b')]
+
+        for repo_path in repo_paths:
+            _make_repo(repo_path)
+
+        repo_path = repo_paths[0]
+        head_hash = _git(repo_path, 'rev-parse', 'HEAD').strip()
+
+        assert pool.object_info(repo_path, 'HEAD')[:2] == (head_hash,
+                                                          'commit')
+        assert pool.object_info(repo_path, '0' * 40) is None
+
+        object_hash, object_type, contents = \
+            pool.read_object(repo_path, 'HEAD')
+        assert contents.startswith(b'tree ')
+
+        # the running session sees new commits
+        _git(repo_path, 'commit', '-q', '--allow-empty', '-m', 'commit')
+        new_head_hash = _git(repo_path, 'rev-parse', 'HEAD').strip()
+
+        assert pool.object_info(repo_path, 'HEAD')[0] == new_head_hash
+
+        # the least recently used session is closed
+        pool.object_info(repo_paths[1], 'HEAD')
+        assert len(pool) == 2
+
+        # a failed session is not kept, and its start evicted another
+        with pytest.raises(CommandError):
+            pool.object_info(temp_dir_path, 'HEAD')
+
+        assert len(pool) == 1
+
+        pool.close_all()
+        assert len(pool) == 0
+
+
+def test_head_summary_through_pool():
+    with TemporaryDirectory() as temp_dir_path:
+        repo_path = os.path.join(temp_dir_path, 'repo')
+        git_dir_path = os.path.join(temp_dir_path, 'repo.git')
+
+        # a .git file cannot be read directly, so the pool is used
+        _git(temp_dir_path, 'init', '-q', '-b', 'master',
+             '--separate-git-dir', git_dir_path, repo_path)
+
+        for _ in range(3):
+            _git(repo_path, 'commit', '-q', '--allow-empty', '-m', 'commit')
+
+        head_hash = _git(repo_path, 'rev-parse', 'HEAD').strip()
+        head_time = int(_git(repo_path, 'log', '-1', '--format=%at'))
+
+        try:
+            assert git_head_summary(repo_path) == (head_hash, head_time, 3)
+
+            # one session answers both the HEAD lookup and the commits
+            assert len(cat_file_pool) == 1
+
+            _git(repo_path, 'commit', '-q', '--allow-empty', '-m', 'commit')
+
+            assert git_head_summary(repo_path)[2] == 4
+            assert len(cat_file_pool) == 1
+        finally:
+            cat_file_pool.close_all()
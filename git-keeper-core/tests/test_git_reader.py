@@ -0,0 +1,82 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepcore.git_reader, comparing its results to git's."""
+
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from gkeepcore.git_reader import GitReaderError, head_summary, \
+    read_head_hash
+
+_env = dict(os.environ, GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='t@t',
+            GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='t@t')
+
+
+def _git(repo_path, *args):
+    return subprocess.check_output(['git', '-C', repo_path] + list(args),
+                                   env=_env, universal_newlines=True)
+
+
+def _commit(repo_path, author_time):
+    env = dict(_env, GIT_AUTHOR_DATE='{0} +0000'.format(author_time))
+    subprocess.check_call(['git', '-C', repo_path, 'commit', '-q',
+                           '--allow-empty', '-m', 'commit'], env=env)
+
+
+def _git_summary(repo_path):
+    lines = _git(repo_path, 'log', '--format=%H %at').splitlines()
+    head_hash, head_time = lines[0].split()
+
+    return head_hash, int(head_time), len(lines)
+
+
+def test_loose_and_packed_repos():
+    with TemporaryDirectory() as temp_dir_path:
+        work_path = os.path.join(temp_dir_path, 'work')
+        bare_path = os.path.join(temp_dir_path, 'bare')
+
+        _git(temp_dir_path, 'init', '-q', '-b', 'master', work_path)
+
+        with pytest.raises(GitReaderError):
+            read_head_hash(work_path)
+
+        for author_time in range(1000000000, 1000000005):
+            _commit(work_path, author_time)
+
+        _git(temp_dir_path, 'clone', '-q', '--bare', work_path, bare_path)
+
+        for repo_path in (work_path, bare_path):
+            assert head_summary(repo_path) == _git_summary(repo_path)
+
+        # new commits are counted incrementally, and packed objects and
+        # refs are read
+        _commit(work_path, 1000000010)
+        _git(work_path, 'push', '-q', bare_path, 'master')
+        _git(bare_path, 'gc', '-q')
+
+        assert not os.path.exists(os.path.join(bare_path, 'refs', 'heads',
+                                               'master'))
+        assert head_summary(bare_path) == _git_summary(bare_path)
+
+        # rewritten history is counted from scratch
+        _git(work_path, 'reset', '-q', '--hard', 'HEAD~3')
+        _commit(work_path, 1000000020)
+
+        assert head_summary(work_path) == _git_summary(work_path)
@@ -0,0 +1,64 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepcore.info_delta."""
+
+import copy
+import json
+
+import pytest
+
+from gkeepcore.info_delta import info_delta, apply_info_delta, \
+    InfoDeltaError
+
+
+def test_delta_round_trip():
+    old_info = {
+        'cs1': {
+            'students': {'a': {'first': 'A'}, 'b': {'first': 'B'}},
+            'assignments': {
+                'hw1': {'published': True,
+                        'students_repos': {'a': {'hash': '1', 'time': 1}}},
+                'hw2': {'published': False, 'students_repos': None}
+            }
+        },
+        'cs2': {'students': {}, 'assignments': {}}
+    }
+
+    new_info = copy.deepcopy(old_info)
+    new_info['cs1']['assignments']['hw1']['students_repos']['a']['hash'] = '2'
+    new_info['cs1']['assignments']['hw2'] = {'published': True,
+                                             'students_repos': {}}
+    del new_info['cs1']['students']['b']
+    del new_info['cs2']
+    new_info['cs3'] = {'students': {}, 'assignments': {}}
+
+    # deltas are stored as JSON
+    delta = json.loads(json.dumps(info_delta(old_info, new_info)))
+
+    # only the changed hash is sent for the student repository
+    assert ['set', ['cs1', 'assignments', 'hw1', 'students_repos', 'a',
+                    'hash'], '2'] in delta
+
+    info = copy.deepcopy(old_info)
+    apply_info_delta(info, delta)
+
+    assert info == new_info
+    assert info_delta(new_info, new_info) == []
+
+    # the delta does not fit info without cs1
+    with pytest.raises(InfoDeltaError):
+        apply_info_delta({}, delta)
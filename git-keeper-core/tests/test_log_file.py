@@ -0,0 +1,233 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for reading and writing log lines with gkeepcore.log_file."""
+
+import os
+from tempfile import TemporaryDirectory
+
+from gkeepcore.log_file import compacted_log_header, format_log_line, \
+    log_append_command, log_timestamp, LogAppender, LogEvent, LogFileReader, \
+    MAX_LOG_LINE_LENGTH
+from gkeepcore.shell_command import run_command
+
+
+class FileReader(LogFileReader):
+    def get_byte_count(self):
+        return os.path.getsize(self._file_path)
+
+    def _read_bytes(self, file_position, max_byte_count=None):
+        with open(self._file_path, 'rb') as f:
+            f.seek(file_position)
+            return f.read(max_byte_count or -1)
+
+
+def test_timestamp_matches_shell():
+    timestamp = log_timestamp()
+    shell_timestamp = run_command('date +%s.%N | cut -c 1-15').strip()
+
+    assert len(timestamp) == len(shell_timestamp) == 15
+    assert abs(float(timestamp) - float(shell_timestamp)) < 5
+
+
+def test_format_matches_shell():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+        run_command(log_append_command(log_file_path, 'TEST',
+                                       'some text\nmore text'))
+
+        with open(log_file_path) as f:
+            shell_line = f.read()
+
+    timestamp = shell_line.split()[0]
+
+    assert format_log_line('TEST', 'some text\nmore text', timestamp) == \
+        shell_line
+
+    event = LogEvent(shell_line)
+    assert event.event_type == 'TEST'
+    assert event.payload == 'some text  more text'
+
+
+def test_long_line_is_truncated():
+    line = format_log_line('TEST', 'x' * 5000)
+
+    assert len(line.rstrip('\n').encode()) == MAX_LOG_LINE_LENGTH
+    assert line.endswith('...\n')
+
+    # multi-byte characters must not be split
+    line = format_log_line('TEST', 'é' * 5000)
+
+    assert len(line.rstrip('\n').encode()) <= MAX_LOG_LINE_LENGTH
+    assert line.endswith('...\n')
+
+
+def test_appender():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+
+        appender = LogAppender()
+        appender.append(log_file_path, 'FIRST', 'one')
+        appender.append_lines(log_file_path,
+                              [format_log_line('SECOND', 'two'),
+                               format_log_line('THIRD', 'three')],
+                              fsync=True)
+        appender.close()
+
+        with open(log_file_path) as f:
+            event_types = [LogEvent(line).event_type for line in f]
+
+    assert event_types == ['FIRST', 'SECOND', 'THIRD']
+
+
+def test_appender_reopens_replaced_file():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+        old_log_file_path = os.path.join(temp_dir_path, 'test.log.old')
+
+        appender = LogAppender(max_open_files=1)
+        appender.append(log_file_path, 'FIRST', 'one')
+
+        os.rename(log_file_path, old_log_file_path)
+
+        appender.append(log_file_path, 'SECOND', 'two')
+
+        # opening another file closes the first one
+        appender.append(old_log_file_path, 'THIRD', 'three')
+        appender.append(log_file_path, 'FOURTH', 'four')
+        appender.close()
+
+        with open(log_file_path) as f:
+            event_types = [LogEvent(line).event_type for line in f]
+
+        assert event_types == ['SECOND', 'FOURTH']
+
+        with open(old_log_file_path) as f:
+            event_types = [LogEvent(line).event_type for line in f]
+
+        assert event_types == ['FIRST', 'THIRD']
+
+
+def test_reader_follows_compaction():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+
+        appender = LogAppender()
+        appender.append(log_file_path, 'FIRST', 'one')
+
+        reader = FileReader(log_file_path, seek_position=0)
+        assert [LogEvent(line).event_type
+                for line in reader.get_new_lines()] == ['FIRST']
+
+        end_position = reader.get_seek_position()
+
+        # replace the log with a compacted one and keep appending
+        with open(log_file_path + '.new', 'w') as f:
+            f.write(compacted_log_header(end_position))
+        os.rename(log_file_path + '.new', log_file_path)
+
+        appender.append(log_file_path, 'SECOND', 'two')
+
+        assert [LogEvent(line).event_type
+                for line in reader.get_new_lines()] == ['SECOND']
+
+        # a reader created from the saved position continues from there
+        new_reader = FileReader(log_file_path, seek_position=end_position)
+        assert [LogEvent(line).event_type
+                for line in new_reader.get_new_lines()] == ['SECOND']
+        assert new_reader.get_seek_position() == reader.get_seek_position()
+
+        # a reader created at the end reads nothing old
+        end_reader = FileReader(log_file_path)
+        appender.append(log_file_path, 'THIRD', 'three')
+        appender.close()
+
+        assert [LogEvent(line).event_type
+                for line in end_reader.get_new_lines()] == ['THIRD']
+
+
+def _compact(log_file_path, compacted_from, lines):
+    with open(log_file_path + '.new', 'w') as f:
+        f.write(compacted_log_header(compacted_from))
+        f.writelines(lines)
+    os.rename(log_file_path + '.new', log_file_path)
+
+
+def test_reader_detects_same_size_compaction():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+
+        with open(log_file_path, 'w') as f:
+            f.write(format_log_line('FIRST', 'x' * 200))
+
+        reader = FileReader(log_file_path, seek_position=0)
+        assert [LogEvent(line).event_type
+                for line in reader.get_new_lines()] == ['FIRST']
+
+        end_position = reader.get_seek_position()
+        old_size = os.path.getsize(log_file_path)
+
+        # a compacted log with a new line that makes it the same size as
+        # before
+        header_length = len(compacted_log_header(end_position))
+        payload_length = (old_size - header_length -
+                          len(format_log_line('SECOND', '')))
+        line = format_log_line('SECOND', 'y' * payload_length)
+        _compact(log_file_path, end_position, [line])
+
+        assert os.path.getsize(log_file_path) == old_size
+
+        assert reader.has_new_lines()
+        assert reader.get_new_lines() == [line.strip()]
+
+
+class CompactingReader(FileReader):
+    before_read = None
+
+    def _read_bytes(self, file_position, max_byte_count=None):
+        # header reads pass a maximum, data reads do not
+        if max_byte_count is None and self.before_read is not None:
+            before_read = self.before_read
+            self.before_read = None
+            before_read()
+        return super()._read_bytes(file_position, max_byte_count)
+
+
+def test_reader_detects_compaction_during_read():
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'test.log')
+
+        first_line = format_log_line('FIRST', 'one')
+        second_line = format_log_line('SECOND', 'two')
+
+        with open(log_file_path, 'w') as f:
+            f.write(first_line)
+
+        reader = CompactingReader(log_file_path, seek_position=0)
+        assert reader.get_new_lines() == [first_line.strip()]
+
+        with open(log_file_path, 'a') as f:
+            f.write(second_line)
+
+        assert reader.has_new_lines()
+
+        # compact just before the new data is read
+        reader.before_read = lambda: _compact(log_file_path,
+                                              len(first_line.encode()),
+                                              [second_line])
+
+        assert reader.get_new_lines() == [second_line.strip()]
+        assert not reader.has_new_lines()
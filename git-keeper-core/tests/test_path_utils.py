@@ -17,7 +17,8 @@
 """Tests for gkeepcore.path_utils functions."""
 
 
-from gkeepcore.path_utils import path_to_list, user_from_log_path
+from gkeepcore.path_utils import path_to_list, user_from_log_path, \
+    info_generation_filename, parse_info_generation_filename
 
 
 def test_path_to_list():
@@ -42,3 +43,15 @@ def test_extract_username_from_log_path():
     # valid faculty relative path
     path = 'faculty/git-keeper-faculty.log'
     assert 'faculty' == user_from_log_path(path)
+
+
+def test_info_generation_filenames():
+    filenames = [info_generation_filename(generation)
+                 for generation in (1, 10, 9)]
+
+    # sorting the names sorts the generations
+    assert [parse_info_generation_filename(filename)
+            for filename in sorted(filenames)] == [1, 9, 10]
+
+    assert parse_info_generation_filename('latest.json') is None
+    assert parse_info_generation_filename('1500000000.123.json') is None
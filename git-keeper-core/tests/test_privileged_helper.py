@@ -0,0 +1,140 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the operations carried out by gkeepcore.privileged_helper."""
+
+import os
+from tempfile import TemporaryDirectory
+
+from gkeepcore.privileged_helper import OperationRunner
+
+
+def test_operations():
+    with TemporaryDirectory() as root:
+        runner = OperationRunner([root])
+
+        source_path = os.path.join(root, 'source')
+        dest_path = os.path.join(root, 'dest')
+        file_path = os.path.join(source_path, 'file')
+
+        results = runner.run_batch([
+            {'op': 'mkdir', 'path': os.path.join(source_path, 'sub')},
+            {'op': 'touch', 'path': file_path},
+            {'op': 'symbolic_link', 'source': file_path,
+             'dest': os.path.join(source_path, 'link')},
+            {'op': 'mkdir', 'path': dest_path},
+            # copying into an existing directory puts the copy inside it
+            {'op': 'cp', 'source': source_path, 'dest': dest_path,
+             'recursive': True},
+            {'op': 'chmod', 'path': dest_path, 'mode': '750',
+             'recursive': True},
+            {'op': 'rm', 'path': source_path, 'recursive': True},
+        ])
+
+        assert results == [{'ok': True}] * 7
+
+        copy_path = os.path.join(dest_path, 'source')
+
+        assert os.path.isfile(os.path.join(copy_path, 'file'))
+        assert os.path.islink(os.path.join(copy_path, 'link'))
+        assert os.stat(os.path.join(copy_path, 'sub')).st_mode & 0o777 == \
+            0o750
+        assert not os.path.exists(source_path)
+
+
+def test_batch_stops_at_failure():
+    with TemporaryDirectory() as root:
+        runner = OperationRunner([root])
+
+        dir_path = os.path.join(root, 'dir')
+
+        results = runner.run_batch([
+            {'op': 'mkdir', 'path': dir_path},
+            {'op': 'rm', 'path': dir_path},
+            {'op': 'touch', 'path': os.path.join(root, 'file')},
+        ])
+
+        assert results[0]['ok']
+        assert not results[1]['ok']
+        assert not results[2]['ok']
+        assert not os.path.exists(os.path.join(root, 'file'))
+
+
+def test_paths_outside_roots_are_rejected():
+    with TemporaryDirectory() as root, TemporaryDirectory() as other:
+        runner = OperationRunner([root])
+
+        link_path = os.path.join(root, 'link')
+        os.symlink(other, link_path)
+
+        bad_operations = [
+            {'op': 'touch', 'path': os.path.join(other, 'file')},
+            {'op': 'touch', 'path': os.path.join(root, '..', 'file')},
+            # links in parent directories are resolved
+            {'op': 'touch', 'path': os.path.join(link_path, 'file')},
+            {'op': 'rm', 'path': root, 'recursive': True},
+            {'op': 'touch', 'path': 'relative'},
+            {'op': 'unknown', 'path': os.path.join(root, 'file')},
+        ]
+
+        for operation in bad_operations:
+            assert not runner.run_batch([operation])[0]['ok']
+
+        assert os.listdir(other) == []
+        assert os.path.isdir(root)
+
+
+def test_links_are_not_followed():
+    with TemporaryDirectory() as root, TemporaryDirectory() as other:
+        runner = OperationRunner([root])
+
+        secret_path = os.path.join(other, 'secret')
+
+        with open(secret_path, 'w') as f:
+            f.write('secret')
+
+        secret_link_path = os.path.join(root, 'secret_link')
+        other_link_path = os.path.join(root, 'other_link')
+        os.symlink(secret_path, secret_link_path)
+        os.symlink(other, other_link_path)
+
+        bad_operations = [
+            {'op': 'touch', 'path': secret_link_path},
+            # reading through a link
+            {'op': 'cp', 'source': secret_link_path,
+             'dest': os.path.join(root, 'copy')},
+            # writing through a link
+            {'op': 'cp', 'source': secret_link_path, 'dest': other_link_path},
+            {'op': 'mv', 'source': secret_link_path, 'dest': other_link_path},
+        ]
+
+        for operation in bad_operations:
+            assert not runner.run_batch([operation])[0]['ok']
+
+        assert sorted(os.listdir(other)) == ['secret']
+        assert not os.path.exists(os.path.join(root, 'copy'))
+
+        with open(secret_path) as f:
+            assert f.read() == 'secret'
+
+        # only the link itself needs to be inside the roots, not its target
+        link_path = os.path.join(root, 'git')
+        results = runner.run_batch([{'op': 'symbolic_link',
+                                     'source': '/usr/bin/git',
+                                     'dest': link_path}])
+
+        assert results == [{'ok': True}]
+        assert os.readlink(link_path) == '/usr/bin/git'
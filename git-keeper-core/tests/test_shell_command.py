@@ -0,0 +1,66 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""Tests for running commands with gkeepcore.shell_command."""
+
+from time import perf_counter
+
+import pytest
+
+from gkeepcore.shell_command import CommandError, CommandTimeoutError, \
+    default_timeout, run_command, run_command_with_result
+
+
+def test_output_and_result():
+    lines = []
+    output = run_command(['bash', '-c', 'echo one; echo two >&2'],
+                         output_callback=lines.append)
+
+    assert output == 'one\ntwo\n'
+    assert lines == ['one', 'two']
+
+    result = run_command_with_result('echo three')
+
+    assert result.output == 'three\n'
+    assert result.returncode == 0
+    assert result.wall_time >= 0
+    assert result.max_rss > 0
+
+
+def test_errors():
+    with pytest.raises(CommandError):
+        run_command('exit 1')
+
+    with pytest.raises(CommandError):
+        run_command(['this-program-does-not-exist'])
+
+
+def test_timeout_kills_process_group():
+    start_time = perf_counter()
+
+    # the background sleep must be killed too or the output pipe would stay
+    # open
+    with pytest.raises(CommandTimeoutError):
+        run_command(['bash', '-c', 'sleep 30 & sleep 30'], timeout=0.2)
+
+    assert perf_counter() - start_time < 5
+
+
+def test_default_timeouts():
+    assert default_timeout(['git', 'status']) is not None
+    assert default_timeout('/bin/mkdir -p dir') is not None
+    assert default_timeout(['bash', 'action.sh']) is None
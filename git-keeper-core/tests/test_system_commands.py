@@ -0,0 +1,204 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for the filesystem operations in gkeepcore.system_commands."""
+
+import getpass
+import os
+from grp import getgrgid
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from gkeepcore.shell_command import CommandError
+from gkeepcore.system_commands import chmod, cp, default_group, \
+    make_hard_link, make_symbolic_link, mkdir, mode, mv, rm, touch
+
+
+def test_operations_without_sudo():
+    with TemporaryDirectory() as temp_dir_path:
+        source_path = os.path.join(temp_dir_path, 'source')
+        dest_path = os.path.join(temp_dir_path, 'dest')
+
+        mkdir(os.path.join(source_path, 'sub'))
+        touch(os.path.join(source_path, 'sub', 'file'))
+        chmod(source_path, '750', recursive=True)
+
+        assert mode(os.path.join(source_path, 'sub', 'file')) == '750'
+
+        # copying to a new path, then into the existing directory
+        cp(source_path, dest_path, recursive=True)
+        cp(source_path, dest_path, recursive=True)
+
+        assert os.path.isfile(os.path.join(dest_path, 'sub', 'file'))
+        assert os.path.isfile(os.path.join(dest_path, 'source', 'sub',
+                                           'file'))
+
+        mv(os.path.join(dest_path, 'sub'), os.path.join(dest_path, 'moved'))
+        rm(source_path, recursive=True)
+
+        assert sorted(os.listdir(dest_path)) == ['moved', 'source']
+        assert not os.path.exists(source_path)
+
+
+def test_errors_raise_command_error():
+    with TemporaryDirectory() as temp_dir_path:
+        dir_path = os.path.join(temp_dir_path, 'dir')
+        mkdir(dir_path)
+
+        with pytest.raises(CommandError):
+            cp(dir_path, os.path.join(temp_dir_path, 'copy'))
+
+        with pytest.raises(CommandError):
+            rm(dir_path)
+
+        with pytest.raises(CommandError):
+            mv(os.path.join(temp_dir_path, 'missing'), dir_path)
+
+        # a missing file is not an error for rm
+        rm(os.path.join(temp_dir_path, 'missing'))
+
+
+def test_cp_follows_source_link():
+    with TemporaryDirectory() as temp_dir_path:
+        file_path = os.path.join(temp_dir_path, 'file')
+        link_path = os.path.join(temp_dir_path, 'link')
+        copy_path = os.path.join(temp_dir_path, 'copy')
+
+        with open(file_path, 'w') as f:
+            f.write('contents')
+
+        make_symbolic_link(file_path, link_path)
+
+        # like cp, the copy is of the file the link points to
+        cp(link_path, copy_path)
+
+        assert not os.path.islink(copy_path)
+
+        with open(copy_path) as f:
+            assert f.read() == 'contents'
+
+        # like cp -r, a recursive copy copies the link itself
+        recursive_copy_path = os.path.join(temp_dir_path, 'recursive_copy')
+        cp(link_path, recursive_copy_path, recursive=True)
+
+        assert os.readlink(recursive_copy_path) == file_path
+
+
+def test_cp_recursive_merges_into_existing_directory():
+    with TemporaryDirectory() as temp_dir_path:
+        source_path = os.path.join(temp_dir_path, 'source')
+        dest_path = os.path.join(temp_dir_path, 'dest')
+
+        mkdir(os.path.join(source_path, 'sub'))
+        mkdir(os.path.join(dest_path, 'source', 'sub'))
+
+        with open(os.path.join(source_path, 'sub', 'file'), 'w') as f:
+            f.write('new')
+
+        with open(os.path.join(dest_path, 'source', 'sub', 'file'), 'w') as f:
+            f.write('old')
+
+        touch(os.path.join(dest_path, 'source', 'other'))
+
+        cp(source_path, dest_path, recursive=True)
+
+        with open(os.path.join(dest_path, 'source', 'sub', 'file')) as f:
+            assert f.read() == 'new'
+
+        assert os.path.isfile(os.path.join(dest_path, 'source', 'other'))
+
+
+def test_touch_directory():
+    with TemporaryDirectory() as temp_dir_path:
+        dir_path = os.path.join(temp_dir_path, 'dir')
+        mkdir(dir_path)
+        os.utime(dir_path, (0, 0))
+
+        touch(dir_path)
+
+        assert os.path.isdir(dir_path)
+        assert os.path.getmtime(dir_path) > 0
+
+        # a link is followed, and a missing file is created
+        link_path = os.path.join(temp_dir_path, 'link')
+        file_path = os.path.join(temp_dir_path, 'file')
+        make_symbolic_link(file_path, link_path)
+
+        touch(link_path)
+
+        assert os.path.isfile(file_path)
+
+
+def test_chmod_symbolic_modes():
+    with TemporaryDirectory() as temp_dir_path:
+        dir_path = os.path.join(temp_dir_path, 'dir')
+        file_path = os.path.join(dir_path, 'file')
+
+        mkdir(dir_path)
+        touch(file_path)
+        chmod(dir_path, '707')
+        chmod(file_path, '606')
+
+        # X only adds execute permission to the directory
+        chmod(dir_path, 'g+rX,o=', recursive=True)
+
+        assert mode(dir_path) == '750'
+        assert mode(file_path) == '640'
+
+        chmod(file_path, 'u-w,a+x')
+
+        assert mode(file_path) == '551'
+
+        # like chmod, set-group-ID stays on a directory unless it is changed
+        # explicitly
+        chmod(dir_path, 'g+s')
+        chmod(dir_path, '770')
+
+        assert os.stat(dir_path).st_mode & 0o7777 == 0o2770
+
+        chmod(dir_path, 'g-s')
+
+        assert os.stat(dir_path).st_mode & 0o7777 == 0o770
+
+        # modes that are not handled in-process are passed to chmod
+        chmod(file_path, '+w')
+        chmod(file_path, 'g=u')
+
+        assert mode(file_path) == '771'
+
+
+def test_hard_link_into_directory():
+    with TemporaryDirectory() as temp_dir_path:
+        file_path = os.path.join(temp_dir_path, 'file')
+        dir_path = os.path.join(temp_dir_path, 'dir')
+
+        touch(file_path)
+        mkdir(dir_path)
+
+        # like ln, a link made in an existing directory takes the source's
+        # name
+        make_hard_link(file_path, dir_path)
+
+        assert os.path.samefile(file_path, os.path.join(dir_path, 'file'))
+
+
+def test_default_group():
+    # the current user's default group, found independently
+    assert default_group(getpass.getuser()) == getgrgid(os.getgid()).gr_name
+
+    with pytest.raises(KeyError):
+        default_group('no-such-user-gkeep')
@@ -30,10 +30,10 @@ from gkeepcore.path_utils import parse_faculty_assignment_path, \
     user_home_dir, faculty_class_dir_path, student_assignment_repo_path, \
     student_class_dir_path
 from gkeepcore.shell_command import CommandError
-from gkeepcore.system_commands import cp, chmod, mkdir, sudo_chown, rm
+from gkeepcore.system_commands import cp, chmod, mkdir, rm, SudoBatch
 from gkeepserver.email_sender_thread import email_sender
 from gkeepserver.server_configuration import config
-from gkeepserver.server_email import Email, EmailException
+from gkeepserver.server_email import Email, EmailException, SharedEmailBody
 
 
 class StudentAssignmentError(GkeepException):
@@ -285,8 +285,30 @@ def remove_student_assignment(assignment_dir: AssignmentDirectory,
         raise StudentAssignmentError(e)
 
 
+def read_assignment_email_body(assignment_dir: AssignmentDirectory) \
+        -> SharedEmailBody:
+    """
+    Read email.txt for an assignment so that its contents can be shared by
+    the emails sent to all the students in the class.
+
+    Raises StudentAssignmentError if the file cannot be read.
+
+    :param assignment_dir: object representing the directory
+    :return: the contents of email.txt as a SharedEmailBody
+    """
+
+    try:
+        with open(assignment_dir.email_path) as f:
+            return SharedEmailBody(f.read())
+    except OSError as e:
+        error = 'error reading {0}: {1}'.format(assignment_dir.email_path,
+                                                str(e))
+        raise StudentAssignmentError(error)
+
+
 def setup_student_assignment(assignment_dir: AssignmentDirectory,
-                             student, faculty_username: str):
+                             student, faculty_username: str,
+                             email_body: SharedEmailBody=None):
     """
     Setup the bare repository that a student will clone and push to for an
     assignment and email the student.
@@ -296,6 +318,8 @@ def setup_student_assignment(assignment_dir: AssignmentDirectory,
     :param assignment_dir: object representing the directory
     :param student: Student object representing the student
     :param faculty_username: username of the faculty who owns the class
+    :param email_body: contents of the assignment's email.txt from
+     read_assignment_email_body(). If None, email.txt is read by this call.
     """
 
     home_dir = user_home_dir(student.username)
@@ -316,34 +340,29 @@ def setup_student_assignment(assignment_dir: AssignmentDirectory,
         error = '{0} already exists'.format(assignment_repo_path)
         raise StudentAssignmentError(error)
 
+    # all the operations that need root are run as one batch
+    batch = SudoBatch()
+
     # make the class directory if it does not exist
     if not os.path.isdir(class_path):
-        try:
-            mkdir(class_path, sudo=True)
-            sudo_chown(class_path, student.username, config.keeper_group)
-        except OSError as e:
-            error = 'error creating {0}: {1}'.format(assignment_repo_path,
-                                                     str(e))
-            raise StudentAssignmentError(error)
+        batch.mkdir(class_path)
+        batch.chown(class_path, student.username, config.keeper_group)
 
     # copy the base code repo from the faculty's home directory
-    try:
-        cp(assignment_dir.base_code_repo_path, assignment_repo_path,
-           recursive=True, sudo=True)
-    except GkeepException as e:
-        error = ('error copying {0} to {1}: {2}'
-                 .format(assignment_dir.base_code_repo_path,
-                         assignment_repo_path, str(e)))
-        raise StudentAssignmentError(error)
+    batch.cp(assignment_dir.base_code_repo_path, assignment_repo_path,
+             recursive=True)
 
     # set permissions on the assignment repo
+    batch.chmod(assignment_repo_path, '750')
+    batch.chown(assignment_repo_path, student.username, config.keeper_group,
+                recursive=True)
+
     try:
-        chmod(assignment_repo_path, '750', sudo=True)
-        sudo_chown(assignment_repo_path, student.username,
-                   config.keeper_group, recursive=True)
-    except CommandError as e:
-        error = ('error setting permissions on {0}: {1}'
-                 .format(assignment_repo_path, str(e)))
+        batch.run()
+    except GkeepException as e:
+        error = ('error creating {0} from {1}: {2}'
+                 .format(assignment_repo_path,
+                         assignment_dir.base_code_repo_path, str(e)))
         raise StudentAssignmentError(error)
 
     email_subject = ('[{0}] New assignment: {1}'
@@ -355,17 +374,12 @@ def setup_student_assignment(assignment_dir: AssignmentDirectory,
                                      config.hostname,
                                      assignment_repo_path)
 
-    # read email.txt to get the customizable part of the email body
-    try:
-        with open(assignment_dir.email_path) as f:
-            email_body = f.read()
-    except OSError as e:
-        error = 'error reading {0}: {1}'.format(assignment_dir.email_path,
-                                                str(e))
-        raise StudentAssignmentError(error)
+    # email.txt contains the customizable part of the email body
+    if email_body is None:
+        email_body = read_assignment_email_body(assignment_dir)
 
     # clone URL followed by email.txt contents
-    email_body = 'Clone URL:\n{0}\n\n{1}'.format(clone_url, email_body)
+    email_body = ['Clone URL:', clone_url, '', email_body]
 
     # build the email
     try:
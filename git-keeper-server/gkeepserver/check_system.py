@@ -36,7 +36,7 @@ from gkeepcore.gkeep_exception import GkeepException
 from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.system_commands import (CommandError, user_exists, group_exists,
                                        sudo_add_group, mode, chmod, touch,
-                                       this_user, this_group)
+                                       mkdir, this_user, this_group)
 from gkeepserver.create_user import create_user, UserType
 from gkeepserver.gkeepd_logger import gkeepd_logger as gkeepd_logger
 from gkeepserver.server_configuration import config
@@ -80,11 +80,13 @@ def check_keeper_paths_and_permissions():
         * the faculty log directory does not exist
         * the log snapshot file does not exist
         * run_action.sh does not exist
+        * the temporary directory does not exist
         * permissions are wrong on the following files/directories:
             * keeper user's home directory: 750
             * gkeepd.log: 600,
             * log snapshot file: 600
             * faculty.csv: 600
+            * temporary directory: 700
 
     Raises a CheckSystemError exception on fatal errors.
 
@@ -131,11 +133,17 @@ def check_keeper_paths_and_permissions():
     if not os.path.isfile(config.run_action_sh_file_path):
         write_run_action_sh()
 
+    if not os.path.isdir(config.temp_dir_path):
+        gkeepd_logger.log_info('{0} does not exist, creating it now'
+                               .format(config.temp_dir_path))
+        mkdir(config.temp_dir_path)
+
     required_modes = {
         config.home_dir: '750',
         config.log_file_path: '600',
         config.log_snapshot_file_path: '600',
         config.faculty_csv_path: '600',
+        config.temp_dir_path: '700',
     }
 
     for path, required_mode in required_modes.items():
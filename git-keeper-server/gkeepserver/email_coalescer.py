@@ -0,0 +1,135 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides coalescing of related emails into digests.
+
+An Email may be given a coalesce key, such as the class and assignment that a
+test results email is about. EmailCoalescer holds such emails for a window of
+time. All emails to the same address with the same key that arrive within
+the window are combined into a single digest email, with the newest message
+first.
+"""
+
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from time import time, strftime, localtime
+
+from gkeepserver.server_email import Email
+
+
+# email is the original Email, queued_email is what would have been put on the
+# queue in its place (such as a SpooledEmail), and queued_time is when it
+# arrived
+CoalescedEmail = namedtuple('CoalescedEmail',
+                            ['email', 'queued_email', 'queued_time'])
+
+
+def build_digest(coalesced_emails: list) -> Email:
+    """
+    Combine several emails to the same address into one.
+
+    The subject of the digest is the subject of the newest email along with
+    the number of messages. The body contains the body of each email, newest
+    first, under a heading with its subject and the time it was queued.
+
+    :param coalesced_emails: list of CoalescedEmail objects in the order they
+     were queued
+    :return: the digest email
+    """
+
+    newest_email = coalesced_emails[-1].email
+    message_count = len(coalesced_emails)
+
+    subject = '{0} ({1} messages)'.format(newest_email.subject, message_count)
+
+    body = ['{0} messages were combined into this email. The newest is first.'
+            .format(message_count)]
+
+    for coalesced_email in reversed(coalesced_emails):
+        timestamp = strftime('%Y-%m-%d %H:%M:%S',
+                             localtime(coalesced_email.queued_time))
+        body.append('')
+        body.append('===== {0} ({1}) ====='
+                    .format(coalesced_email.email.subject, timestamp))
+        body.append('')
+        body.append(coalesced_email.email.body)
+
+    return Email(newest_email.to_address, subject, body)
+
+
+class EmailCoalescer:
+    """
+    Holds emails with a coalesce key until their window has passed.
+
+    All methods are thread safe.
+    """
+    def __init__(self):
+        """Create an empty coalescer."""
+
+        self._lock = Lock()
+
+        # maps (address, coalesce key) tuples to [ready time, list of
+        # CoalescedEmail objects]. Ordered so that groups with the same ready
+        # time come out in the order they started.
+        self._groups = OrderedDict()
+
+    def add(self, email: Email, queued_email: Email, window: float):
+        """
+        Hold an email. The first email for an address and key starts a window
+        of window seconds, and the emails that arrive during that window are
+        released together.
+
+        :param email: the email, which must have a coalesce key
+        :param queued_email: the email to release in place of email if it
+         is not combined with any others
+        :param window: number of seconds to wait for related emails
+        """
+
+        key = (email.to_address.lower(), email.coalesce_key)
+        current_time = time()
+
+        with self._lock:
+            if key not in self._groups:
+                self._groups[key] = [current_time + window, []]
+
+            self._groups[key][1].append(CoalescedEmail(email, queued_email,
+                                                       current_time))
+
+    def pop_ready(self, force=False) -> list:
+        """
+        Remove and return the groups of emails whose windows have passed.
+
+        :param force: if True, return all groups regardless of their windows
+        :return: list of groups, each of which is a list of CoalescedEmail
+         objects in the order they were queued
+        """
+
+        current_time = time()
+        ready_groups = []
+
+        with self._lock:
+            for key, (ready_time, group) in list(self._groups.items()):
+                if force or ready_time <= current_time:
+                    del self._groups[key]
+                    ready_groups.append(group)
+
+        return ready_groups
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(group) for ready_time, group in
+                       self._groups.values())
@@ -0,0 +1,469 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides an on-disk outbox so that queued emails survive a restart of gkeepd.
+
+Each email is written to its own file in the outbox directory when it is
+queued, and the file is removed after the email has been sent. Emails that
+could not be sent after the maximum number of attempts are moved into the
+failed subdirectory.
+
+A spool file holds a JSON document with the recipient, the subject, the
+parts of the body, and the paths of any files to attach. The MIME message is
+not stored. It is built from the spool file when the email is sent. Parts of
+the body that are SharedEmailBody objects, such as the body of an assignment
+announcement sent to every student, are stored once in the bodies
+subdirectory, named by their digest, and the spool files refer to them. A
+shared body is removed when the last email that refers to it has been sent.
+
+Files are written under a temporary name and renamed into place, so a crash
+never leaves a partial file behind. The spool filenames sort in the order
+the emails were queued.
+
+Only the recipient and subject of a spooled email are kept in memory. The
+rest is read from the files when it is sent.
+"""
+
+import json
+import os
+from itertools import count
+from threading import Lock
+from time import time
+
+from gkeepcore.gkeep_exception import GkeepException
+from gkeepserver.gkeepd_logger import gkeepd_logger as logger
+from gkeepserver.server_email import Email, SharedEmailBody
+
+
+class OutboxError(GkeepException):
+    """Raised if anything goes wrong reading or writing the outbox."""
+    pass
+
+
+class SpooledEmail(Email):
+    """
+    An email that has been written to the outbox.
+
+    Behaves like an Email, but the body is read from the outbox each time the
+    message is built rather than being kept in memory. Email's constructor is
+    not called since the body has already been built.
+    """
+    def __init__(self, outbox, file_path: str, to_address: str, subject: str,
+                 shared_digests: list):
+        """
+        :param outbox: the EmailOutbox the email was written to
+        :param file_path: path to the spool file
+        :param to_address: the address to send the email to
+        :param subject: subject of the email
+        :param shared_digests: digests of the shared bodies the email refers
+         to
+        """
+
+        self._send_attempts = 0
+        self._max_send_attempts = 10
+        self.last_send_error = ''
+
+        self.file_path = file_path
+        self.to_address = to_address
+        self._subject = subject
+        self.coalesce_key = None
+
+        self.shared_digests = shared_digests
+        self._outbox = outbox
+
+    @property
+    def body(self) -> str:
+        """
+        Read the body from the outbox.
+
+        Raises OutboxError if the files cannot be read.
+        """
+
+        body, files_to_attach = self._outbox.read_message(self)
+
+        return body
+
+    @property
+    def message_string(self) -> str:
+        """
+        Build the full MIME message from the outbox.
+
+        Raises OutboxError if the files cannot be read.
+        """
+
+        body, files_to_attach = self._outbox.read_message(self)
+
+        return self._build_mime_message(body, files_to_attach)
+
+
+class EmailOutbox:
+    """
+    Manages the outbox directory.
+
+    All methods are thread safe.
+    """
+
+    spool_file_extension = '.email'
+    temp_file_extension = '.tmp'
+
+    def __init__(self, outbox_path: str):
+        """
+        Create the outbox directory and the failed and bodies directories
+        within it if they do not exist.
+
+        Raises OutboxError if the directories cannot be created.
+
+        :param outbox_path: path to the outbox directory
+        """
+
+        self.path = outbox_path
+        self.failed_path = os.path.join(outbox_path, 'failed')
+        self.bodies_path = os.path.join(outbox_path, 'bodies')
+
+        # the counter keeps filenames unique and ordered when several emails
+        # are spooled within the resolution of the clock
+        self._counter = count()
+        self._lock = Lock()
+
+        # maps the digest of each shared body to the number of emails in the
+        # outbox that refer to it. Emails in the failed directory keep their
+        # references so that their bodies are not removed.
+        self._shared_body_references = {}
+
+        try:
+            os.makedirs(self.failed_path, mode=0o700, exist_ok=True)
+            os.makedirs(self.bodies_path, mode=0o700, exist_ok=True)
+        except OSError as e:
+            raise OutboxError('Error creating {0}: {1}'.format(self.path, e))
+
+    def spool(self, email: Email) -> SpooledEmail:
+        """
+        Write an email to the outbox.
+
+        Raises OutboxError if the email cannot be written.
+
+        :param email: the email to write
+        :return: a SpooledEmail to enqueue in place of the email
+        """
+
+        with self._lock:
+            filename = '{0:.6f}-{1:06d}{2}'.format(time(), next(self._counter),
+                                                   self.spool_file_extension)
+
+        file_path = os.path.join(self.path, filename)
+
+        body_parts = []
+        shared_bodies = []
+
+        for part in email.body_parts:
+            if isinstance(part, SharedEmailBody):
+                body_parts.append({'shared': part.digest})
+                shared_bodies.append(part)
+            else:
+                body_parts.append(part)
+
+        envelope = {
+            'to_address': email.to_address,
+            'subject': email.subject,
+            'body_parts': body_parts,
+            'files_to_attach': email.files_to_attach,
+        }
+
+        shared_digests = [shared_body.digest for shared_body in shared_bodies]
+
+        self._add_shared_bodies(shared_bodies)
+
+        try:
+            self._write_file(file_path, json.dumps(envelope))
+        except OutboxError:
+            self._release_shared_bodies(shared_digests)
+            raise
+
+        return SpooledEmail(self, file_path, email.to_address, email.subject,
+                            shared_digests)
+
+    def read_message(self, email: SpooledEmail) -> tuple:
+        """
+        Read the body and attachments of a spooled email.
+
+        Raises OutboxError if the files cannot be read.
+
+        :param email: the spooled email
+        :return: tuple containing the body as a string and the list of
+         files to attach or None
+        """
+
+        envelope = self._read_envelope(email.file_path)
+
+        try:
+            body_texts = []
+
+            for part in envelope['body_parts']:
+                if isinstance(part, dict):
+                    body_texts.append(self._read_shared_body(part['shared']))
+                else:
+                    body_texts.append(part)
+
+            return '\r\n'.join(body_texts), envelope['files_to_attach']
+        except (KeyError, TypeError) as e:
+            raise OutboxError('Error reading {0}: {1}'
+                              .format(email.file_path, e))
+
+    def pending(self) -> list:
+        """
+        Scan the outbox for emails that were spooled but not yet sent, such as
+        those left behind when gkeepd was stopped.
+
+        Leftover temporary files from interrupted writes are removed, and
+        spool files that cannot be read are moved to the failed directory.
+        Shared bodies that no email refers to any more are removed.
+
+        Raises OutboxError if the directory cannot be read.
+
+        :return: list of SpooledEmail objects in the order they were queued
+        """
+
+        try:
+            filenames = sorted(os.listdir(self.path))
+        except OSError as e:
+            raise OutboxError('Error reading {0}: {1}'.format(self.path, e))
+
+        spooled_emails = []
+
+        for filename in filenames:
+            file_path = os.path.join(self.path, filename)
+
+            if filename.endswith(self.temp_file_extension):
+                self._remove_file(file_path)
+            elif filename.endswith(self.spool_file_extension):
+                try:
+                    spooled_emails.append(self._load(file_path))
+                except OutboxError as e:
+                    logger.log_warning('Moving unreadable spool file to {0}: '
+                                       '{1}'.format(self.failed_path, e))
+                    os.replace(file_path, os.path.join(self.failed_path,
+                                                       filename))
+
+        with self._lock:
+            for email in spooled_emails:
+                for digest in email.shared_digests:
+                    self._count_reference(digest)
+
+            for digest in self._failed_shared_digests():
+                self._count_reference(digest)
+
+            self._remove_unreferenced_bodies()
+
+        return spooled_emails
+
+    def remove(self, email: SpooledEmail):
+        """
+        Remove a spooled email from the outbox after it has been sent, along
+        with any shared bodies that no other email refers to.
+
+        :param email: the email to remove
+        """
+
+        self._remove_file(email.file_path)
+        self._release_shared_bodies(email.shared_digests)
+
+    def move_to_failed(self, email: SpooledEmail):
+        """
+        Move a spooled email that could not be sent into the failed directory
+        so that it is not sent again after a restart.
+
+        Raises OutboxError if the file cannot be moved.
+
+        :param email: the email to move
+        """
+
+        failed_file_path = os.path.join(self.failed_path,
+                                        os.path.basename(email.file_path))
+
+        try:
+            os.rename(email.file_path, failed_file_path)
+        except OSError as e:
+            raise OutboxError('Error moving {0} to {1}: {2}'
+                              .format(email.file_path, self.failed_path, e))
+
+        email.file_path = failed_file_path
+
+    def _load(self, file_path) -> SpooledEmail:
+        # Build a SpooledEmail from a spool file
+
+        envelope = self._read_envelope(file_path)
+
+        try:
+            shared_digests = [part['shared'] for part in
+                              envelope['body_parts'] if isinstance(part, dict)]
+
+            return SpooledEmail(self, file_path, envelope['to_address'],
+                                envelope['subject'], shared_digests)
+        except (KeyError, TypeError) as e:
+            raise OutboxError('Error reading {0}: {1}'.format(file_path, e))
+
+    def _read_envelope(self, file_path) -> dict:
+        # Read the JSON document from a spool file
+
+        try:
+            with open(file_path) as f:
+                envelope = json.load(f)
+        except (OSError, ValueError) as e:
+            raise OutboxError('Error reading {0}: {1}'.format(file_path, e))
+
+        if not isinstance(envelope, dict):
+            raise OutboxError('Error reading {0}: not a JSON object'
+                              .format(file_path))
+
+        return envelope
+
+    def _read_shared_body(self, digest) -> str:
+        # Read the text of a shared body
+
+        file_path = self._shared_body_path(digest)
+
+        try:
+            with open(file_path, newline='') as f:
+                return f.read()
+        except OSError as e:
+            raise OutboxError('Error reading {0}: {1}'.format(file_path, e))
+
+    def _shared_body_path(self, digest) -> str:
+        # digests come from spool files, so make sure they are only a name
+        if not isinstance(digest, str) or not digest.isalnum():
+            raise OutboxError('Invalid shared body digest: {0}'
+                              .format(digest))
+
+        return os.path.join(self.bodies_path, digest)
+
+    def _add_shared_bodies(self, shared_bodies):
+        # Count references to shared bodies, writing the ones that are not
+        # in the outbox yet
+
+        with self._lock:
+            for index, shared_body in enumerate(shared_bodies):
+                digest = shared_body.digest
+                file_path = self._shared_body_path(digest)
+
+                if (digest not in self._shared_body_references and
+                        not os.path.exists(file_path)):
+                    try:
+                        self._write_file(file_path, shared_body.text)
+                    except OutboxError:
+                        for added_body in shared_bodies[:index]:
+                            self._drop_reference(added_body.digest)
+                        raise
+
+                self._count_reference(digest)
+
+    def _release_shared_bodies(self, shared_digests):
+        # Drop references to shared bodies
+
+        with self._lock:
+            for digest in shared_digests:
+                self._drop_reference(digest)
+
+    def _count_reference(self, digest):
+        # Count a reference to a shared body. The lock must be held.
+
+        self._shared_body_references[digest] = \
+            self._shared_body_references.get(digest, 0) + 1
+
+    def _drop_reference(self, digest):
+        # Drop a reference to a shared body, removing it once nothing refers
+        # to it. The lock must be held.
+
+        reference_count = self._shared_body_references.get(digest, 0) - 1
+
+        if reference_count > 0:
+            self._shared_body_references[digest] = reference_count
+            return
+
+        self._shared_body_references.pop(digest, None)
+
+        try:
+            self._remove_file(self._shared_body_path(digest))
+        except OutboxError as e:
+            logger.log_warning(str(e))
+
+    def _failed_shared_digests(self) -> list:
+        # Get the digests of the shared bodies that failed emails refer to
+
+        digests = []
+
+        try:
+            filenames = os.listdir(self.failed_path)
+        except OSError as e:
+            raise OutboxError('Error reading {0}: {1}'
+                              .format(self.failed_path, e))
+
+        for filename in filenames:
+            if not filename.endswith(self.spool_file_extension):
+                continue
+
+            try:
+                email = self._load(os.path.join(self.failed_path, filename))
+            except OutboxError:
+                continue
+
+            digests.extend(email.shared_digests)
+
+        return digests
+
+    def _remove_unreferenced_bodies(self):
+        # Remove the shared bodies that no email refers to. The lock must be
+        # held.
+
+        try:
+            filenames = os.listdir(self.bodies_path)
+        except OSError as e:
+            raise OutboxError('Error reading {0}: {1}'
+                              .format(self.bodies_path, e))
+
+        for filename in filenames:
+            if filename not in self._shared_body_references:
+                self._remove_file(os.path.join(self.bodies_path, filename))
+
+    def _write_file(self, file_path, text):
+        # Write a file under a temporary name and rename it into place,
+        # raising OutboxError on failure
+
+        temp_file_path = file_path + self.temp_file_extension
+
+        try:
+            # emails may contain passwords, only the keeper user may read
+            # them
+            fd = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o600)
+            with open(fd, 'w', newline='') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(temp_file_path, file_path)
+        except OSError as e:
+            raise OutboxError('Error writing {0}: {1}'.format(file_path, e))
+
+    def _remove_file(self, file_path):
+        # Remove a file, raising OutboxError on failure
+
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise OutboxError('Error removing {0}: {1}'.format(file_path, e))
@@ -0,0 +1,246 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides token bucket rate limiting for sending emails.
+
+A token bucket holds up to burst tokens and gains rate tokens per second.
+Sending an email costs one token, so up to burst emails can go out at once,
+after which emails go out at rate per second.
+
+EmailRateLimiter combines a bucket for all emails with optional buckets for
+individual recipient domains. If the SMTP server responds with a 4xx
+throttling error, the limiter halves the rate of the buckets involved and
+then slowly recovers to the configured rates as emails succeed.
+"""
+
+from smtplib import SMTPRecipientsRefused, SMTPResponseException
+from threading import Lock
+from time import time, sleep
+
+
+class TokenBucket:
+    """
+    A token bucket with a rate that can be adjusted.
+
+    Not thread safe on its own, EmailRateLimiter does the locking.
+    """
+    def __init__(self, rate: float, burst: int):
+        """
+        Create a full bucket.
+
+        :param rate: tokens gained per second
+        :param burst: maximum number of tokens in the bucket
+        """
+
+        self.configured_rate = rate
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last_refill_time = time()
+
+    def time_until_available(self) -> float:
+        """
+        Get the number of seconds until a token is available.
+
+        :return: seconds until a token can be consumed, 0 if one is available
+         now
+        """
+
+        self._refill()
+
+        if self._tokens >= 1:
+            return 0
+
+        return (1 - self._tokens) / self.rate
+
+    def consume(self):
+        """Remove a token from the bucket."""
+
+        self._refill()
+        self._tokens -= 1
+
+    def drain_time(self, item_count: int) -> float:
+        """
+        Estimate how long it will take to consume item_count tokens at the
+        current rate.
+
+        :param item_count: number of tokens to consume
+        :return: estimated number of seconds
+        """
+
+        self._refill()
+
+        return max(0, item_count - self._tokens) / self.rate
+
+    def _refill(self):
+        # Add the tokens gained since the last refill
+
+        current_time = time()
+        elapsed_time = current_time - self._last_refill_time
+        self._last_refill_time = current_time
+
+        self._tokens = min(self.burst, self._tokens + elapsed_time * self.rate)
+
+
+def is_throttling_error(error: Exception) -> bool:
+    """
+    Determine if an exception raised by smtplib is a temporary (4xx) error,
+    which SMTP servers use to signal that the sender should slow down.
+
+    :param error: exception raised while sending
+    :return: True if the server responded with a 4xx code, False otherwise
+    """
+
+    if isinstance(error, SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+    elif isinstance(error, SMTPResponseException):
+        codes = [error.smtp_code]
+    else:
+        return False
+
+    return any(400 <= code < 500 for code in codes)
+
+
+def email_domain(email_address: str) -> str:
+    """
+    Get the lowercase domain of an email address.
+
+    :param email_address: the email address
+    :return: the domain, or an empty string if there is no @
+    """
+
+    return email_address.rpartition('@')[2].lower()
+
+
+class EmailRateLimiter:
+    """
+    Limits the rate of sending emails overall and per recipient domain.
+
+    All methods are thread safe.
+    """
+
+    # when throttled the rate is never reduced below this fraction of the
+    # configured rate
+    min_rate_fraction = 1 / 16
+
+    # each success raises a reduced rate by this fraction of the configured
+    # rate
+    recovery_fraction = 1 / 10
+
+    def __init__(self, rate: float, burst: int, domain_limits=None):
+        """
+        Create the buckets.
+
+        :param rate: maximum emails per second over all domains
+        :param burst: number of emails that may be sent at once
+        :param domain_limits: dictionary which maps domains to (rate, burst)
+         tuples for domains which need their own limits
+        """
+
+        self._lock = Lock()
+
+        self._bucket = TokenBucket(rate, burst)
+
+        self._buckets_by_domain = {}
+
+        for domain, (domain_rate, domain_burst) in (domain_limits or
+                                                    {}).items():
+            self._buckets_by_domain[domain.lower()] = \
+                TokenBucket(domain_rate, domain_burst)
+
+    def wait(self, to_address: str):
+        """
+        Block until an email can be sent to to_address, and then take a token
+        from each bucket involved.
+
+        :param to_address: address the email will be sent to
+        """
+
+        buckets = self._buckets_for(to_address)
+
+        while True:
+            with self._lock:
+                wait_time = max(bucket.time_until_available()
+                                for bucket in buckets)
+
+                if wait_time == 0:
+                    for bucket in buckets:
+                        bucket.consume()
+                    return
+
+            sleep(wait_time)
+
+    def throttled(self, to_address: str):
+        """
+        Halve the rate of the buckets involved in sending to to_address after
+        the server asked us to slow down.
+
+        :param to_address: address of the email that was throttled
+        """
+
+        with self._lock:
+            for bucket in self._buckets_for(to_address):
+                min_rate = bucket.configured_rate * self.min_rate_fraction
+                bucket.rate = max(min_rate, bucket.rate / 2)
+
+    def succeeded(self, to_address: str):
+        """
+        Move the rates of the buckets involved in sending to to_address back
+        towards their configured rates after a successful send.
+
+        :param to_address: address of the email that was sent
+        """
+
+        with self._lock:
+            for bucket in self._buckets_for(to_address):
+                increase = bucket.configured_rate * self.recovery_fraction
+                bucket.rate = min(bucket.configured_rate,
+                                  bucket.rate + increase)
+
+    def get_rate(self) -> float:
+        """
+        Get the current overall rate, which may be lower than the configured
+        rate after throttling.
+
+        :return: emails per second
+        """
+
+        with self._lock:
+            return self._bucket.rate
+
+    def drain_time(self, email_count: int) -> float:
+        """
+        Estimate how many seconds it will take to send email_count emails at
+        the current overall rate.
+
+        :param email_count: number of emails waiting to be sent
+        :return: estimated number of seconds
+        """
+
+        with self._lock:
+            return self._bucket.drain_time(email_count)
+
+    def _buckets_for(self, to_address):
+        # Get the overall bucket and the domain bucket, if there is one
+
+        domain_bucket = self._buckets_by_domain.get(email_domain(to_address))
+
+        if domain_bucket is None:
+            return [self._bucket]
+        else:
+            return [self._bucket, domain_bucket]
@@ -0,0 +1,313 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides retry scheduling for emails that could not be sent.
+
+An email that fails is held by a RetryScheduler until its backoff delay has
+passed rather than going straight back onto the queue. Delays grow
+exponentially with each attempt and are jittered so that emails which failed
+together are not all retried at the same moment.
+
+CircuitBreaker tracks consecutive failures to reach the SMTP server. After
+enough of them it opens and sending pauses for a cooldown period. After the
+cooldown a trial send is allowed through. If it succeeds the breaker closes
+and sending resumes, and if it fails the breaker opens again.
+
+EmailSendMetrics counts what happened to emails so that it can be logged.
+"""
+
+import heapq
+from collections import OrderedDict
+from itertools import count
+from random import uniform
+from smtplib import SMTPConnectError, SMTPRecipientsRefused, \
+    SMTPResponseException
+from threading import Lock, get_ident
+from time import time
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Get the number of seconds to wait before retrying an email.
+
+    The delay doubles with each attempt up to max_delay. A random amount of
+    up to half of the delay is subtracted so that retries spread out.
+
+    :param attempt: number of attempts made so far, starting at 1
+    :param base_delay: delay after the first attempt, before jitter
+    :param max_delay: maximum delay, before jitter
+    :return: number of seconds to wait
+    """
+
+    # cap the exponent so that huge attempt counts do not overflow
+    delay = min(max_delay, base_delay * 2 ** min(attempt - 1, 32))
+
+    return delay - uniform(0, delay / 2)
+
+
+def is_relay_error(error: Exception) -> bool:
+    """
+    Determine if an exception raised while sending means that the SMTP server
+    could not be reached or is not accepting mail at all, as opposed to a
+    problem with one particular email.
+
+    :param error: exception raised while sending
+    :return: True if the error is a connection level error
+    """
+
+    if isinstance(error, SMTPConnectError):
+        return True
+
+    if isinstance(error, SMTPRecipientsRefused):
+        return False
+
+    if isinstance(error, SMTPResponseException):
+        # 421 means the service is not available
+        return error.smtp_code == 421
+
+    # socket errors, timeouts, and SMTPServerDisconnected are all OSErrors
+    return isinstance(error, OSError)
+
+
+class RetryScheduler:
+    """
+    Holds emails until they are ready to be retried.
+
+    All methods are thread safe.
+    """
+    def __init__(self):
+        """Create an empty scheduler."""
+
+        self._lock = Lock()
+
+        # heap of (ready time, sequence number, email) tuples. The sequence
+        # number keeps emails with the same ready time in order and means
+        # emails never need to be compared.
+        self._heap = []
+        self._counter = count()
+
+    def schedule(self, email, delay: float):
+        """
+        Hold an email until delay seconds from now.
+
+        :param email: the email to retry
+        :param delay: number of seconds to wait
+        """
+
+        with self._lock:
+            heapq.heappush(self._heap, (time() + delay, next(self._counter),
+                                        email))
+
+    def pop_ready(self) -> list:
+        """
+        Remove and return the emails whose delay has passed.
+
+        :return: list of emails in the order they became ready
+        """
+
+        ready_emails = []
+        current_time = time()
+
+        with self._lock:
+            while len(self._heap) > 0 and self._heap[0][0] <= current_time:
+                ready_time, sequence_number, email = heapq.heappop(self._heap)
+                ready_emails.append(email)
+
+        return ready_emails
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+
+class CircuitBreaker:
+    """
+    Pauses sending after repeated failures to reach the SMTP server.
+
+    Once the cooldown has passed, a single thread is allowed to make a trial
+    send. Other threads are held back until record_success() or
+    record_failure() settles the trial, or until the thread that made it
+    calls end_trial() without having reached a conclusion.
+
+    All methods are thread safe.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        """
+        Create a closed breaker.
+
+        :param failure_threshold: number of consecutive failures that open
+         the breaker
+        :param cooldown: seconds to wait after opening before allowing a
+         trial send
+        """
+
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_time = 0
+
+        # thread identifier of the thread making the trial send, or None
+        self._trial_thread = None
+
+    def allow_send(self) -> bool:
+        """
+        Determine if the calling thread may send an email now. Once the
+        cooldown has passed the breaker moves to half-open and the first
+        caller is allowed a trial send.
+
+        :return: True if sending is allowed
+        """
+
+        with self._lock:
+            if self._state == self.OPEN:
+                if time() - self._open_time < self.cooldown:
+                    return False
+                self._state = self.HALF_OPEN
+
+            if self._state == self.HALF_OPEN:
+                if self._trial_thread is not None:
+                    return self._trial_thread == get_ident()
+                self._trial_thread = get_ident()
+
+            return True
+
+    def end_trial(self):
+        """
+        Called by a thread after it was allowed to send. If the thread was
+        making the trial send and neither record_success() nor
+        record_failure() settled it, for example because there was nothing
+        to send, another thread may make the trial.
+        """
+
+        with self._lock:
+            if self._trial_thread == get_ident():
+                self._trial_thread = None
+
+    def time_until_retry(self) -> float:
+        """
+        Get the number of seconds until sending will be allowed.
+
+        :return: seconds remaining in the cooldown, 0 if not open
+        """
+
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+
+            return max(0, self._open_time + self.cooldown - time())
+
+    def is_open(self) -> bool:
+        """
+        :return: True if sending is paused
+        """
+
+        with self._lock:
+            return self._state == self.OPEN
+
+    def record_success(self) -> bool:
+        """
+        Close the breaker after a successful send.
+
+        :return: True if the breaker was not already closed
+        """
+
+        with self._lock:
+            was_closed = (self._state == self.CLOSED)
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._trial_thread = None
+
+            return not was_closed
+
+    def record_failure(self) -> bool:
+        """
+        Count a failure to reach the SMTP server, opening the breaker if a
+        trial send failed or there have been too many failures in a row.
+
+        :return: True if this failure opened the breaker
+        """
+
+        with self._lock:
+            self._consecutive_failures += 1
+            self._trial_thread = None
+
+            if self._state == self.OPEN:
+                return False
+
+            if (self._state == self.HALF_OPEN or
+                    self._consecutive_failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._open_time = time()
+                return True
+
+            return False
+
+
+class EmailSendMetrics:
+    """
+    Counters describing what has happened to emails.
+
+    All methods are thread safe.
+    """
+
+    counter_names = [
+        'sent',
+        'failed_attempts',
+        'retries_scheduled',
+        'dead_letters',
+        'circuit_opened',
+        'coalesced',
+    ]
+
+    def __init__(self):
+        """Create the counters, all starting at 0."""
+
+        self._lock = Lock()
+        self._counters = OrderedDict((name, 0) for name in self.counter_names)
+
+    def increment(self, name: str, amount=1):
+        """
+        Add to a counter.
+
+        :param name: name of the counter, one of counter_names
+        :param amount: amount to add
+        """
+
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> OrderedDict:
+        """
+        Get the current values of the counters.
+
+        :return: OrderedDict which maps counter names to values
+        """
+
+        with self._lock:
+            return OrderedDict(self._counters)
+
+    def __str__(self):
+        return ', '.join('{0}: {1}'.format(name, value)
+                         for name, value in self.snapshot().items())
@@ -20,6 +20,35 @@ Provides a global interface for sending emails in a rate-limited fashion.
 The email sender runs in a separate thread so that other threads do not need
 to block when trying to send email due to rate limiting.
 
+Emails are rate limited with token buckets (see email_rate_limiter) using the
+email_send_rate, email_send_burst, and email_domain_limits configuration
+options. When a backlog builds up, an estimate of how long it will take to
+send is logged.
+
+The thread hands emails to a pool of email_sender_count worker threads which
+send them concurrently, so one slow SMTP transaction does not hold up every
+other email. All emails to the same address go to the same worker so that
+they are sent in the order they were queued. The workers share the rate
+limiter, so email_send_rate still limits the overall rate.
+
+Unless smtp_session_pooling is disabled in the configuration, each worker
+keeps its SMTP connection open between emails so that a burst of emails does
+not need a new connection, TLS handshake, and login for every message.
+
+An email that fails to send is retried after an exponentially growing delay
+(see email_retry) instead of going straight back onto the queue. If the SMTP
+server cannot be reached several times in a row, sending pauses for a cooldown
+period and then resumes automatically. Counts of sent, retried, and dead
+lettered emails are available from get_metrics() and are logged at shutdown.
+
+If email_coalesce_window is greater than 0, emails that were given a coalesce
+key are held for that many seconds, and emails to the same address with the
+same key are combined into one digest (see email_coalescer).
+
+Queued emails are written to the outbox directory given by the
+email_outbox_path configuration option (see email_outbox), so that emails
+which were still queued when gkeepd stopped are sent when it starts again.
+
 This module stores an EmailSenderThread instance in the module-level variable
 named email_sender. Call start() on this instance to start the thread.
 
@@ -41,13 +70,21 @@ Example usage:
 
 """
 
+import zlib
 from queue import Queue, Empty
-from threading import Thread
+from threading import Thread, Lock
 from time import time, sleep
 
 from gkeepcore.gkeep_exception import GkeepException
+from gkeepserver.email_rate_limiter import EmailRateLimiter, \
+    is_throttling_error
+from gkeepserver.email_coalescer import EmailCoalescer, build_digest
+from gkeepserver.email_outbox import EmailOutbox, OutboxError, SpooledEmail
+from gkeepserver.email_retry import CircuitBreaker, EmailSendMetrics, \
+    RetryScheduler, backoff_delay, is_relay_error
 from gkeepserver.gkeepd_logger import gkeepd_logger as logger
-from gkeepserver.server_email import Email, EmailException
+from gkeepserver.server_configuration import config
+from gkeepserver.server_email import Email, EmailException, SMTPSession
 
 
 class EmailSenderThread(Thread):
@@ -60,7 +97,8 @@ class EmailSenderThread(Thread):
     Call the inherited start() method to start the thread.
 
     Shutdown the thread by calling shutdown(). The sender will keep sending
-    emails until the queue is empty, and then shut down. Call join() after
+    emails until the queue is empty, and then shut down. Emails waiting to be
+    retried are not sent, but they remain in the outbox. Call join() after
     shutdown() in the main thread to allow all the enqueued emails to be sent
     before proceeding.
 
@@ -68,23 +106,40 @@ class EmailSenderThread(Thread):
     gkeepserver.email.Email objects.
 
     """
-    def __init__(self, min_send_interval=2):
+
+    # minimum number of seconds between logging drain time estimates
+    drain_estimate_log_interval = 60
+
+    # number of seconds waiting workers sleep between checks of the circuit
+    # breaker
+    circuit_poll_interval = 0.1
+
+    def __init__(self):
         """
         Construct the object.
 
         Constructing the object does not start the thread. Call start() to
         actually start the thread.
-
-        :param min_send_interval: number of seconds between calling send() on
-         each email
         """
 
         Thread.__init__(self)
 
         self._email_queue = Queue()
+        self._retry_scheduler = RetryScheduler()
+        self._coalescer = EmailCoalescer()
+        self._metrics = EmailSendMetrics()
 
-        self._min_send_interval = min_send_interval
-        self._last_send_time = 0
+        # created in run() since the configuration is not parsed yet
+        self._rate_limiter = None
+        self._circuit_breaker = None
+        self._workers = []
+
+        # created on first use since the configuration is not parsed yet and
+        # emails may be enqueued before the thread is started
+        self._outbox = None
+        self._outbox_lock = Lock()
+
+        self._last_drain_estimate_log_time = 0
 
         self._shutdown_flag = False
 
@@ -94,10 +149,24 @@ class EmailSenderThread(Thread):
 
         Sending is rate-limited so the email will not be sent immediately.
 
+        The email is written to the outbox before it is queued. If that fails
+        the email is still queued, but it will be lost if gkeepd stops before
+        it is sent.
+
         :param email: the email to send
         """
 
-        self._email_queue.put(email)
+        if not isinstance(email, Email):
+            self._email_queue.put(email)
+            return
+
+        queued_email = self._spool(email)
+
+        if config.email_coalesce_window > 0 and email.coalesce_key is not None:
+            self._coalescer.add(email, queued_email,
+                                config.email_coalesce_window)
+        else:
+            self._email_queue.put(queued_email)
 
     def shutdown(self):
         """
@@ -111,61 +180,417 @@ class EmailSenderThread(Thread):
         self._shutdown_flag = True
         self.join()
 
+    def get_metrics(self) -> dict:
+        """
+        Get counts of what has happened to emails since the thread started,
+        along with the number of emails currently waiting.
+
+        :return: dictionary which maps metric names to counts
+        """
+
+        metrics = dict(self._metrics.snapshot())
+        metrics['queued'] = self._waiting_count()
+        metrics['waiting_to_retry'] = len(self._retry_scheduler)
+        metrics['waiting_to_coalesce'] = len(self._coalescer)
+
+        return metrics
+
     def run(self):
         """
-        Send emails as they arrive in the queue.
+        Start the workers and hand emails to them as they arrive in the
+        queue.
 
         This method should not be called directly. Call the start() method
         instead.
 
-        Sends at most 1 email every _min_send_interval seconds.
-
         Loops until someone calls shutdown().
         """
 
-        while not self._shutdown_flag:
+        # recover emails left in the outbox if nothing has been enqueued yet
+        self._get_outbox()
+
+        self._rate_limiter = EmailRateLimiter(config.email_send_rate,
+                                              config.email_send_burst,
+                                              config.email_domain_limits)
+
+        self._circuit_breaker = \
+            CircuitBreaker(config.email_circuit_failure_threshold,
+                           config.email_circuit_cooldown)
+
+        self._workers = [EmailSenderWorker(self, number) for number in
+                         range(1, config.email_sender_count + 1)]
+
+        for worker in self._workers:
+            worker.start()
+
+        while not self._done():
             try:
-                while True:
-                    email = self._email_queue.get(block=True, timeout=0.1)
+                self._queue_ready_retries()
+                self._queue_coalesced_emails(force=self._shutdown_flag)
+
+                email = self._email_queue.get(block=True, timeout=0.1)
 
-                    if not isinstance(email, Email):
-                        warning = ('Item enqueued for emailing that is not an '
-                                   'email: {0}'.format(email))
-                        logger.log_warning(warning)
-                    else:
-                        self._send_email_with_rate_limiting(email)
+                if not isinstance(email, Email):
+                    warning = ('Item enqueued for emailing that is not an '
+                               'email: {0}'.format(email))
+                    logger.log_warning(warning)
+                else:
+                    self._worker_for(email.to_address).enqueue(email)
             except Empty:
                 pass
             except Exception as e:
                 logger.log_error('Error in email sender thread: {0}'
                                  .format(e))
 
-    def _send_email_with_rate_limiting(self, email: Email):
-        # Send the email. Sleep first if need be.
+        for worker in self._workers:
+            worker.shutdown()
+
+        logger.log_info('Email sender stopped. {0}'.format(self._metrics))
+
+        unsent_count = (self._waiting_count() + len(self._retry_scheduler) +
+                        len(self._coalescer))
+
+        if unsent_count > 0:
+            logger.log_warning('{0} emails were not sent before shutdown'
+                               .format(unsent_count))
+
+    def circuit_is_open(self) -> bool:
+        """
+        Determine if sending is paused because the SMTP server could not be
+        reached.
+
+        :return: True if sending is paused
+        """
+
+        return self._circuit_breaker.is_open()
+
+    def wait_for_circuit(self) -> bool:
+        """
+        Called by the workers before taking an email. If sending is paused,
+        sleep until the cooldown ends or for circuit_poll_interval seconds,
+        whichever is longer, so that workers waiting on another worker's
+        trial send do not spin. A worker that is allowed to send must call
+        end_circuit_trial() afterwards.
+
+        :return: True if sending is allowed, False if the caller slept
+        """
+
+        if self._circuit_breaker.allow_send():
+            return True
+
+        sleep(max(self.circuit_poll_interval,
+                  self._circuit_breaker.time_until_retry()))
+        return False
+
+    def end_circuit_trial(self):
+        """
+        Called by the workers after wait_for_circuit() allowed them to send,
+        whether or not they sent anything, so that an unsettled trial send
+        does not keep the other workers paused.
+        """
+
+        self._circuit_breaker.end_trial()
+
+    def send_email(self, email: Email, smtp_session: SMTPSession):
+        """
+        Called by the workers to send an email. Sleeps first if the rate
+        limiter requires it.
+
+        :param email: the email to send
+        :param smtp_session: the worker's SMTPSession, or None
+        """
+
+        self._send_email_with_rate_limiting(email, smtp_session)
+
+    def _worker_for(self, to_address: str):
+        # Choose the worker for an address. The same address always maps to
+        # the same worker.
+
+        key = zlib.crc32(to_address.lower().encode('utf-8'))
+
+        return self._workers[key % len(self._workers)]
+
+    def _waiting_count(self) -> int:
+        # Number of emails queued but not yet handed to the SMTP server
+
+        return (self._email_queue.qsize() +
+                sum(worker.queue_size() for worker in self._workers))
+
+    def _done(self) -> bool:
+        # The thread is done once shutdown() has been called and the queue is
+        # empty. If the SMTP server is down there is no point in waiting.
+        # Each worker finishes its own queue before it stops.
+
+        if not self._shutdown_flag:
+            return False
+
+        if self._circuit_breaker.is_open():
+            return True
+
+        return self._email_queue.empty() and len(self._coalescer) == 0
+
+    def _queue_ready_retries(self):
+        # Move emails whose retry delay has passed back onto the queue
+
+        for email in self._retry_scheduler.pop_ready():
+            self._email_queue.put(email)
+
+    def _send_email_with_rate_limiting(self, email: Email,
+                                       smtp_session: SMTPSession):
+        # Send the email. Sleep first if the rate limiter requires it.
         #
         # :param email: the email to send
+        # :param smtp_session: SMTPSession to send over, or None
 
-        # if _min_send_interval seconds have not elapsed since the last email
-        # was sent, sleep until _min_send_interval seconds have elapsed
-        current_time = time()
-        if current_time - self._last_send_time < self._min_send_interval:
-            elapsed_time = current_time - self._last_send_time
-            sleep_time = self._min_send_interval - elapsed_time
-            sleep(sleep_time)
-
-        self._last_send_time = current_time
+        self._rate_limiter.wait(email.to_address)
 
         try:
-            email.send()
-            logger.log_info('Sent email: {0}'.format(email))
+            email.send(smtp_session)
         except Exception as e:
-            if not email.max_send_attempts_reached():
-                logger.log_warning('Email sending failed, will retry')
-                self._email_queue.put(email)
-            else:
-                error = ('Failed to send email ({0}) after several '
-                         'attempts: {1}'.format(email, e))
-                logger.log_error(error)
+            self._handle_send_failure(email, e)
+        else:
+            self._rate_limiter.succeeded(email.to_address)
+            self._metrics.increment('sent')
+            logger.log_info('Sent email: {0}'.format(email))
+            self._remove_from_outbox(email)
+
+            if self._circuit_breaker.record_success():
+                logger.log_info('SMTP server is reachable again, resuming '
+                                'sending')
+
+        self._log_drain_estimate()
+
+    def _queue_coalesced_emails(self, force=False):
+        # Queue the emails whose coalescing windows have passed, combining
+        # each group of more than one email into a digest. The digest replaces
+        # the individual emails in the outbox.
+
+        for group in self._coalescer.pop_ready(force):
+            if len(group) == 1:
+                self._email_queue.put(group[0].queued_email)
+                continue
+
+            digest = self._spool(build_digest(group))
+
+            for coalesced_email in group:
+                self._remove_from_outbox(coalesced_email.queued_email)
+
+            self._email_queue.put(digest)
+
+            self._metrics.increment('coalesced', len(group))
+            logger.log_debug('Combined {0} emails into one: {1}'
+                             .format(len(group), digest))
+
+    def _handle_send_failure(self, email: Email, error: Exception):
+        # Slow down, pause, retry later, or give up on an email that could
+        # not be sent, depending on the error.
+
+        self._metrics.increment('failed_attempts')
+
+        if is_throttling_error(error):
+            self._rate_limiter.throttled(email.to_address)
+            logger.log_warning('SMTP server is throttling, reduced send '
+                               'rate to {0:.3f} emails per second: {1}'
+                               .format(self._rate_limiter.get_rate(), error))
+
+        if is_relay_error(error) and self._circuit_breaker.record_failure():
+            self._metrics.increment('circuit_opened')
+            logger.log_warning('Cannot reach the SMTP server, pausing sending '
+                               'for {0:.0f} seconds: {1}'
+                               .format(config.email_circuit_cooldown, error))
+
+        if not email.max_send_attempts_reached():
+            delay = backoff_delay(email.send_attempts,
+                                  config.email_retry_base_delay,
+                                  config.email_retry_max_delay)
+            self._retry_scheduler.schedule(email, delay)
+            self._metrics.increment('retries_scheduled')
+            logger.log_warning('Email sending failed, will retry in {0:.0f} '
+                               'seconds: {1}'.format(delay, error))
+        else:
+            self._metrics.increment('dead_letters')
+            logger.log_error('Failed to send email ({0}) after several '
+                             'attempts: {1}'.format(email, error))
+            self._move_to_failed(email)
+
+    def _spool(self, email: Email) -> Email:
+        # Write an email to the outbox and return the SpooledEmail to queue in
+        # its place. If the email cannot be written, return the email itself.
+
+        outbox = self._get_outbox()
+
+        if outbox is None:
+            return email
+
+        try:
+            return outbox.spool(email)
+        except OutboxError as e:
+            logger.log_warning('Could not write email to the outbox, queuing '
+                               'in memory only: {0}'.format(e))
+            return email
+
+    def _get_outbox(self):
+        # Get the outbox, creating it on first use and queuing any emails
+        # that were left in it the last time gkeepd ran. Returns None if the
+        # outbox cannot be used, in which case emails are only queued in
+        # memory.
+
+        with self._outbox_lock:
+            if self._outbox is None:
+                try:
+                    self._outbox = EmailOutbox(config.email_outbox_path)
+                    pending_emails = self._outbox.pending()
+                except OutboxError as e:
+                    logger.log_error('Emails will not be saved to the outbox: '
+                                     '{0}'.format(e))
+                    self._outbox = False
+                    return None
+
+                if len(pending_emails) > 0:
+                    logger.log_info('Queuing {0} unsent emails from the '
+                                    'outbox'.format(len(pending_emails)))
+
+                for email in pending_emails:
+                    self._email_queue.put(email)
+
+            return self._outbox or None
+
+    def _remove_from_outbox(self, email: Email):
+        # Remove a sent email from the outbox if it was spooled
+
+        if isinstance(email, SpooledEmail):
+            try:
+                self._outbox.remove(email)
+            except OutboxError as e:
+                logger.log_error('Sent email may be sent again after a '
+                                 'restart: {0}'.format(e))
+
+    def _move_to_failed(self, email: Email):
+        # Move a spooled email that could not be sent out of the outbox
+
+        if isinstance(email, SpooledEmail):
+            try:
+                self._outbox.move_to_failed(email)
+            except OutboxError as e:
+                logger.log_error('Failed email may be sent again after a '
+                                 'restart: {0}'.format(e))
+
+    def _log_drain_estimate(self):
+        # If emails are waiting, log how long it will take to send them.
+        # Logs at most once every drain_estimate_log_interval seconds.
+
+        email_count = self._waiting_count()
+
+        if email_count == 0:
+            return
+
+        current_time = time()
+        elapsed_time = current_time - self._last_drain_estimate_log_time
+
+        if elapsed_time < self.drain_estimate_log_interval:
+            return
+
+        self._last_drain_estimate_log_time = current_time
+
+        drain_time = self._rate_limiter.drain_time(email_count)
+        logger.log_info('{0} emails waiting to be sent, estimated time to '
+                        'send: {1:.0f} seconds'.format(email_count,
+                                                       drain_time))
+
+
+class EmailSenderWorker(Thread):
+    """
+    One of the threads that sends emails for an EmailSenderThread.
+
+    Each worker has its own queue and its own SMTP session. The rate limiter,
+    circuit breaker, retries, and metrics belong to the EmailSenderThread and
+    are shared by all of its workers.
+    """
+    def __init__(self, sender: EmailSenderThread, number: int):
+        """
+        Construct the object. Call start() to start the thread.
+
+        :param sender: the EmailSenderThread the worker belongs to
+        :param number: number of the worker, used in the thread name
+        """
+
+        Thread.__init__(self, name='EmailSenderWorker-{0}'.format(number))
+
+        self._sender = sender
+        self._email_queue = Queue()
+
+        if config.smtp_session_pooling:
+            self._smtp_session = \
+                SMTPSession(config.smtp_idle_timeout,
+                            config.smtp_max_messages_per_connection)
+        else:
+            self._smtp_session = None
+
+        self._shutdown_flag = False
+
+    def enqueue(self, email: Email):
+        """
+        Add an email to this worker's queue.
+
+        :param email: the email to send
+        """
+
+        self._email_queue.put(email)
+
+    def queue_size(self) -> int:
+        """
+        :return: the number of emails in this worker's queue
+        """
+
+        return self._email_queue.qsize()
+
+    def shutdown(self):
+        """
+        Shutdown the thread once its queue is empty, or right away if sending
+        is paused.
+
+        This method blocks until the thread has died.
+        """
+
+        self._shutdown_flag = True
+        self.join()
+
+    def run(self):
+        """
+        Send emails as they arrive in the queue.
+
+        This method should not be called directly. Call the start() method
+        instead.
+        """
+
+        while not self._done():
+            try:
+                if not self._sender.wait_for_circuit():
+                    continue
+
+                try:
+                    email = self._email_queue.get(block=True, timeout=0.1)
+                    self._sender.send_email(email, self._smtp_session)
+                finally:
+                    self._sender.end_circuit_trial()
+            except Empty:
+                if self._smtp_session is not None:
+                    self._smtp_session.close_if_idle()
+            except Exception as e:
+                logger.log_error('Error in email sender worker: {0}'
+                                 .format(e))
+
+        if self._smtp_session is not None:
+            self._smtp_session.close()
+
+    def _done(self) -> bool:
+        # Done once shutdown() has been called and the queue is empty, or
+        # the SMTP server is down
+
+        if not self._shutdown_flag:
+            return False
+
+        return self._email_queue.empty() or self._sender.circuit_is_open()
 
 
 # module-level instance for global email sending
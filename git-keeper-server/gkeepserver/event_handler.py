@@ -74,6 +74,16 @@ class EventHandler(metaclass=abc.ABCMeta):
         self._parse_log_path()
         self._parse_payload()
 
+    @property
+    def event_id(self) -> str:
+        """
+        An identifier for the event, made up of the user whose log it came
+        from, the event type, and the timestamp from the log.
+        """
+
+        return '{0}:{1}:{2}'.format(self._faculty_username, self._event_type,
+                                    self._timestamp)
+
     @abc.abstractmethod
     def _parse_payload(self):
         """Parse the payload."""
@@ -32,6 +32,7 @@ from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.info_refresh_thread import info_refresher
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
 
 
@@ -62,7 +63,8 @@ class ClassAddHandler(EventHandler):
             self._copy_csv_to_class_dir()
             self._add_students_class_dirs(students)
 
-            info_refresher.enqueue(self._faculty_username)
+            info_refresher.enqueue(self._faculty_username, self._class_name,
+                                   urgent=True)
 
             self._log_to_faculty('CLASS_ADD_SUCCESS', self._class_name)
         except Exception as e:
@@ -92,6 +94,7 @@ class ClassAddHandler(EventHandler):
             mkdir(faculty_class_path, sudo=True)
             final_csv_path = class_student_csv_path(self._class_name, home_dir)
             cp(self._uploaded_csv_path, final_csv_path, sudo=True)
+            roster.invalidate_class(self._faculty_username, self._class_name)
             chmod(faculty_class_path, '750', sudo=True)
             sudo_chown(faculty_class_path, self._faculty_username,
                        config.keeper_group, recursive=True)
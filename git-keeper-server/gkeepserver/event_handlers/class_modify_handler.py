@@ -34,6 +34,7 @@ from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.info_refresh_thread import info_refresher
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
 
 
@@ -76,7 +77,7 @@ class ClassModifyHandler(EventHandler):
             self._add_class_students(old_students_by_username,
                                      new_students_by_username)
 
-            info_refresher.enqueue(self._faculty_username)
+            info_refresher.enqueue(self._faculty_username, self._class_name)
 
             self._log_to_faculty('CLASS_MODIFY_SUCCESS', self._class_name)
         except Exception as e:
@@ -100,6 +101,7 @@ class ClassModifyHandler(EventHandler):
         try:
             final_csv_path = class_student_csv_path(self._class_name, home_dir)
             cp(self._uploaded_csv_path, final_csv_path, sudo=True)
+            roster.invalidate_class(self._faculty_username, self._class_name)
             chmod(faculty_class_path, '750', sudo=True)
             sudo_chown(faculty_class_path, self._faculty_username,
                        config.keeper_group, recursive=True)
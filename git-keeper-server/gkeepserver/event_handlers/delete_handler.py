@@ -21,12 +21,9 @@ Event type: DELETE
 
 import os
 
-from gkeepcore.faculty import faculty_from_username
 from gkeepcore.gkeep_exception import GkeepException
-from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.path_utils import user_from_log_path, \
-    faculty_assignment_dir_path, user_home_dir, class_student_csv_path
-from gkeepcore.student import students_from_csv
+    faculty_assignment_dir_path, user_home_dir
 from gkeepcore.system_commands import rm
 from gkeepserver.assignments import AssignmentDirectory, \
     remove_student_assignment
@@ -34,7 +31,7 @@ from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.info_refresh_thread import info_refresher
-from gkeepserver.server_configuration import config
+from gkeepserver.roster import roster
 
 
 class DeleteHandler(EventHandler):
@@ -66,7 +63,8 @@ class DeleteHandler(EventHandler):
 
             self._delete_assignment(assignment_dir)
 
-            info_refresher.enqueue(self._faculty_username)
+            info_refresher.enqueue(self._faculty_username, self._class_name,
+                                   self._assignment_name)
 
             log_gkeepd_to_faculty(self._faculty_username, 'DELETE_SUCCESS',
                                   '{0} {1}'.format(self._class_name,
@@ -85,22 +83,17 @@ class DeleteHandler(EventHandler):
         # Delete the assignment bare repos for the students and the faculty,
         # as well as the assignment directory itself.
 
-        home_dir = user_home_dir(self._faculty_username)
-
         assignment_name = assignment_dir.assignment_name
 
-        reader = LocalCSVReader(class_student_csv_path(self._class_name,
-                                                       home_dir))
         students_with_assignment = []
 
-        faculty = \
-            faculty_from_username(self._faculty_username,
-                                  LocalCSVReader(config.faculty_csv_path))
+        faculty = roster.faculty(self._faculty_username)
 
         students_with_assignment.append(faculty)
 
         if assignment_dir.is_published():
-            for student in students_from_csv(reader):
+            for student in roster.class_students(self._faculty_username,
+                                                 self._class_name):
                 students_with_assignment.append(student)
 
         # delete each student's repository and the faculty test repository
@@ -24,19 +24,21 @@ from tempfile import TemporaryDirectory
 
 from gkeepcore.csv_files import CSVError
 from gkeepcore.git_commands import git_init, git_push, git_add_all, git_commit
-from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.path_utils import user_from_log_path, \
-    faculty_assignment_dir_path, user_home_dir, class_student_csv_path
+    faculty_assignment_dir_path, user_home_dir
 from gkeepcore.shell_command import CommandError
-from gkeepcore.student import students_from_csv, StudentError, Student
+from gkeepcore.student import StudentError, Student
 from gkeepcore.system_commands import touch, sudo_chown, mkdir
 from gkeepserver.assignments import AssignmentDirectory, \
-    AssignmentDirectoryError, setup_student_assignment, StudentAssignmentError
+    AssignmentDirectoryError, setup_student_assignment, \
+    StudentAssignmentError, read_assignment_email_body
 from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.info_refresh_thread import info_refresher
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
+from gkeepserver.server_email import SharedEmailBody
 
 
 class PublishHandler(EventHandler):
@@ -70,7 +72,8 @@ class PublishHandler(EventHandler):
             self._populate_reports_repo(assignment_dir, students)
             self._create_published_flag(assignment_dir)
 
-            info_refresher.enqueue(self._faculty_username)
+            info_refresher.enqueue(self._faculty_username, self._class_name,
+                                   self._assignment_name, urgent=True)
 
             log_gkeepd_to_faculty(self._faculty_username, 'PUBLISH_SUCCESS',
                                   '{0} {1}'.format(self._class_name,
@@ -130,12 +133,9 @@ class PublishHandler(EventHandler):
         #
         # Return a list of Student objects
 
-        home_dir = user_home_dir(self._faculty_username)
-
-        student_csv_path = class_student_csv_path(self._class_name, home_dir)
-
         try:
-            students = students_from_csv(LocalCSVReader(student_csv_path))
+            students = roster.class_students(self._faculty_username,
+                                             self._class_name)
         except StudentError as e:
             error = 'Error in student CSV file: {0}'.format(e)
             raise HandlerException(error)
@@ -143,17 +143,25 @@ class PublishHandler(EventHandler):
             error = 'Error reading student CSV file: {0}'.format(e)
             raise HandlerException(error)
 
+        # read email.txt once rather than once per student
+        try:
+            email_body = read_assignment_email_body(assignment_dir)
+        except StudentAssignmentError as e:
+            raise HandlerException(e)
+
         for student in students:
-            self._setup_student_assignment_repo(student, assignment_dir)
+            self._setup_student_assignment_repo(student, assignment_dir,
+                                                email_body)
 
         return students
 
     def _setup_student_assignment_repo(self, student: Student,
-                                       assignment_dir: AssignmentDirectory):
+                                       assignment_dir: AssignmentDirectory,
+                                       email_body: SharedEmailBody):
         # Setup a bare repo for a student
         try:
             setup_student_assignment(assignment_dir, student,
-                                     self._faculty_username)
+                                     self._faculty_username, email_body)
         except StudentAssignmentError as e:
             warning = ('Error setting up student assignment repository for '
                        '{0} {1} {2}: {3}'.format(student, self._class_name,
@@ -24,14 +24,10 @@ from gkeepcore.path_utils import user_from_log_path, \
     parse_submission_repo_path
 from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.submission import Submission
-from gkeepcore.path_utils import user_home_dir, class_student_csv_path, \
-    faculty_assignment_dir_path
-from gkeepcore.student import student_from_username
+from gkeepcore.path_utils import user_home_dir, faculty_assignment_dir_path
 from gkeepserver.assignments import AssignmentDirectory
 from gkeepserver.new_submission_queue import new_submission_queue
-from gkeepcore.local_csv_files import LocalCSVReader
-from gkeepserver.server_configuration import config
-from gkeepcore.faculty import faculty_from_username
+from gkeepserver.roster import roster
 
 
 class SubmissionHandler(EventHandler):
@@ -55,8 +51,7 @@ class SubmissionHandler(EventHandler):
         # The AssignmentDirectory object can provide the paths we need
         faculty_home_dir = user_home_dir(self._faculty_username)
 
-        reader = LocalCSVReader(config.faculty_csv_path)
-        faculty = faculty_from_username(self._faculty_username, reader)
+        faculty = roster.faculty(self._faculty_username)
         faculty_email = faculty.email_address
 
         assignment_path = faculty_assignment_dir_path(self._class_name,
@@ -67,16 +62,15 @@ class SubmissionHandler(EventHandler):
         tests_path = assignment_directory.tests_path
         reports_repo_path = assignment_directory.reports_repo_path
 
-        reader = LocalCSVReader(class_student_csv_path(self._class_name,
-                                                       faculty_home_dir))
-
         # if the student is the facutly testing the assignment, use the
         # faculty as the student
         if self._student_username == self._faculty_username:
             student = faculty
         # otherwise build the Student from the csv for the class
         else:
-            student = student_from_username(self._student_username, reader)
+            student = roster.student(self._faculty_username,
+                                     self._class_name,
+                                     self._student_username)
 
         submission = Submission(student, self._submission_repo_path,
                                 tests_path, reports_repo_path,
@@ -18,8 +18,6 @@ Provides TriggerHandler, the handler for triggering assignment tests
 
 Event type: TRIGGER
 """
-from gkeepcore.faculty import faculty_from_username
-from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.log_file import log_append_command
 from gkeepcore.path_utils import user_home_dir, faculty_assignment_dir_path, \
     user_log_path, student_assignment_repo_path
@@ -29,8 +27,7 @@ from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.new_submission_queue import new_submission_queue
-from gkeepserver.server_configuration import config
-from gkeepserver.students_and_classes import get_class_students
+from gkeepserver.roster import roster
 from gkeepserver.submission import Submission
 
 
@@ -59,8 +56,8 @@ class TriggerHandler(EventHandler):
         try:
             assignment_dir = AssignmentDirectory(assignment_path)
             self._ensure_published(assignment_dir)
-            students = get_class_students(self._faculty_username,
-                                          self._class_name)
+            students = roster.class_students(self._faculty_username,
+                                             self._class_name)
 
             students = [s for s in students
                         if s.username in self._student_usernames]
@@ -86,8 +83,7 @@ class TriggerHandler(EventHandler):
             raise HandlerException('Assignment is not published')
 
     def _trigger_tests(self, students, assignment_dir: AssignmentDirectory):
-        reader = LocalCSVReader(config.faculty_csv_path)
-        faculty = faculty_from_username(self._faculty_username, reader)
+        faculty = roster.faculty(self._faculty_username)
         faculty_email = faculty.email_address
 
         # trigger tests for all requested students
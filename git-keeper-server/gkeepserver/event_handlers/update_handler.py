@@ -21,9 +21,7 @@ Event type: UPDATE
 
 import os
 
-from gkeepcore.faculty import faculty_from_username
 from gkeepcore.gkeep_exception import GkeepException
-from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.path_utils import user_from_log_path, \
     faculty_assignment_dir_path, user_home_dir
 from gkeepcore.system_commands import sudo_chown, rm
@@ -35,6 +33,7 @@ from gkeepserver.assignments import AssignmentDirectory, \
 from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
 
 
@@ -104,8 +103,7 @@ class UpdateHandler(EventHandler):
         # Remove and re-setup the bare repository so the faculty can test the
         # assignment, and email the faculty.
 
-        reader = LocalCSVReader(config.faculty_csv_path)
-        faculty = faculty_from_username(self._faculty_username, reader)
+        faculty = roster.faculty(self._faculty_username)
 
         # remove existing test assignment and setup the new test assignment
         try:
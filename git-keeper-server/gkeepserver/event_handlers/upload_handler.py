@@ -21,10 +21,8 @@ Event type: UPLOAD
 
 import os
 
-from gkeepcore.faculty import faculty_from_username
 from gkeepcore.git_commands import git_init_bare
 from gkeepcore.gkeep_exception import GkeepException
-from gkeepcore.local_csv_files import LocalCSVReader
 from gkeepcore.path_utils import user_from_log_path, \
     faculty_assignment_dir_path, user_home_dir
 from gkeepcore.shell_command import CommandError
@@ -38,6 +36,7 @@ from gkeepserver.event_handler import EventHandler, HandlerException
 from gkeepserver.gkeepd_logger import gkeepd_logger
 from gkeepserver.handler_utils import log_gkeepd_to_faculty
 from gkeepserver.info_refresh_thread import info_refresher
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
 
 
@@ -74,7 +73,8 @@ class UploadHandler(EventHandler):
             self._setup_assignment_dir(assignment_dir)
             self._setup_faculty_test_assignment(assignment_dir)
 
-            info_refresher.enqueue(self._faculty_username)
+            info_refresher.enqueue(self._faculty_username, self._class_name,
+                                   self._assignment_name)
 
             log_gkeepd_to_faculty(self._faculty_username, 'UPLOAD_SUCCESS',
                                   self._upload_path)
@@ -106,8 +106,7 @@ class UploadHandler(EventHandler):
         # Setup a bare repository so the faculty can test the assignment,
         # and email the faculty.
 
-        reader = LocalCSVReader(config.faculty_csv_path)
-        faculty = faculty_from_username(self._faculty_username, reader)
+        faculty = roster.faculty(self._faculty_username)
 
         # set up the faculty's test assignment and send email
         try:
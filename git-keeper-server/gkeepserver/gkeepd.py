@@ -28,13 +28,17 @@ submission_test_threads - list of SubmissionTestThread objects which run tests
 """
 
 import sys
+import tempfile
 from queue import Queue, Empty
 from signal import signal, SIGINT, SIGTERM
+from time import perf_counter
 from traceback import extract_tb
 
 from gkeepcore.faculty import faculty_from_csv_file
 from gkeepcore.gkeep_exception import GkeepException
+from gkeepcore.git_commands import cat_file_pool
 from gkeepcore.local_csv_files import LocalCSVReader
+from gkeepcore.privileged_helper import privileged_helper
 from gkeepserver.check_system import check_system, CheckSystemError
 from gkeepserver.email_sender_thread import email_sender
 from gkeepserver.event_handlers.handler_registry import event_handlers_by_type
@@ -42,7 +46,9 @@ from gkeepserver.gkeepd_logger import gkeepd_logger as logger
 from gkeepserver.info_refresh_thread import info_refresher
 from gkeepserver.local_log_file_reader import LocalLogFileReader
 from gkeepserver.event_handler_assigner import EventHandlerAssignerThread
+from gkeepserver.log_compaction import compact_gkeepd_to_faculty_logs
 from gkeepserver.log_polling import log_poller
+from gkeepserver.log_rotation import LogRotator
 from gkeepserver.server_configuration import config, ServerConfigurationError
 from gkeepserver.submission_test_thread import SubmissionTestThread
 
@@ -85,7 +91,15 @@ def main():
         sys.exit(e)
 
     # initialize and start system logger
-    logger.initialize(config.log_file_path, log_level=config.log_level)
+    rotator = LogRotator(config.log_file_path, config.log_max_bytes,
+                         config.log_rotate_interval, config.log_backup_count)
+
+    if not rotator.is_enabled():
+        rotator = None
+
+    logger.initialize(config.log_file_path, log_level=config.log_level,
+                      fsync=config.log_fsync, log_format=config.log_format,
+                      rotator=rotator)
     logger.start()
 
     logger.log_info('--- Starting gkeepd ---')
@@ -100,6 +114,10 @@ def main():
         logger.shutdown()
         sys.exit(1)
 
+    # keep temporary files out of the world-writable system temporary
+    # directory, which the privileged helper may not operate in
+    tempfile.tempdir = config.temp_dir_path
+
     # start the info refresher thread and refresh the info for each faculty
     info_refresher.start()
 
@@ -122,7 +140,10 @@ def main():
 
     # the log poller detects new events and passes them to the handler assigner
     log_poller.initialize(new_log_event_queue, LocalLogFileReader,
-                          config.log_snapshot_file_path, logger)
+                          config.log_snapshot_file_path, logger,
+                          compaction_interval=config.log_compaction_interval,
+                          compaction_min_bytes=config.log_compaction_min_bytes,
+                          replay_missed_events=config.log_replay_missed_events)
 
     # start the rest of the threads
     email_sender.start()
@@ -137,6 +158,8 @@ def main():
 
     logger.log_info('Server is running')
 
+    last_compaction_time = perf_counter()
+
     # main loop
     while not shutdown_flag:
         try:
@@ -144,14 +167,27 @@ def main():
             # regularly
             handler = event_handler_queue.get(block=True, timeout=0.1)
 
-            logger.log_debug('New task: ' + str(handler))
+            logger.log_debug('New task: ' + str(handler),
+                             event_id=handler.event_id)
+
+            start_time = perf_counter()
 
             # all of the main thread's actions are carried out by handlers
             handler.handle()
 
+            logger.log_debug('Finished task: ' + str(handler),
+                             event_id=handler.event_id,
+                             duration=perf_counter() - start_time)
+
         # get() raises Empty after blocking for timeout seconds
         except Empty:
-            pass
+            # compact the gkeepd.log files while there is nothing else to do,
+            # since only this thread writes to them
+            if (config.log_compaction_interval > 0 and
+                    perf_counter() - last_compaction_time >=
+                    config.log_compaction_interval):
+                compact_gkeepd_to_faculty_logs(config.log_compaction_min_bytes)
+                last_compaction_time = perf_counter()
         except (GkeepException, Exception) as e:
             # A handler's handle() method should catch all exceptions. If we
             # get here there is likely an issue with the handler.
@@ -181,6 +217,10 @@ def main():
 
     email_sender.shutdown()
 
+    privileged_helper.shutdown()
+
+    cat_file_pool.close_all()
+
     logger.log_info('Shutting down gkeepd')
 
     logger.shutdown()
@@ -43,14 +43,36 @@ There is a method for logging a message at each level:
     log_info()
     log_debug()
 
+Each of these also accepts an optional event_id, identifying the event that
+the message is about, and duration, the number of seconds something took.
+
+Lines are appended by a gkeepcore.log_file.LogAppender. All the messages
+waiting in the queue are written with a single write, and the fsync policy
+passed to initialize() controls how often the log is flushed to disk.
+
+The log format is 'text' by default, which is the same format that
+log_append_command() uses:
+
+    <timestamp> <level> <message>
+
+The 'json' format writes one JSON object per line with the keys timestamp,
+level, thread, and message, along with event_id and duration when they are
+given. This makes the log easy to analyze, for example to find slow handlers.
+In both formats the first line of the file is a comment starting with #.
+
+A LogRotator may be passed to initialize() to rotate and compress the log.
+
 """
+import json
 import os
 from enum import IntEnum
 from queue import Queue, Empty
-from threading import Thread
+from threading import Thread, current_thread
+from time import time
 
-from gkeepcore.log_file import log_append_command
-from gkeepcore.shell_command import run_command, CommandError
+from gkeepcore.log_file import LogAppender, LogFileException, \
+    format_log_line, log_timestamp
+from gkeepserver.log_rotation import LogRotationError
 
 
 class LogLevel(IntEnum):
@@ -85,6 +107,10 @@ class GkeepdLoggerThread(Thread):
         log_debug()
 
     """
+
+    # maximum number of messages to write at once
+    max_batch_size = 1000
+
     def __init__(self):
         """
         Construct the object.
@@ -101,27 +127,43 @@ class GkeepdLoggerThread(Thread):
 
         self._log_file_path = None
         self._log_level = None
+        self._fsync = None
+        self._log_format = None
+        self._rotator = None
         self._new_line_queue = None
         self._shutdown_flag = None
+        self._appender = None
+        self._last_fsync_time = 0
 
-    def initialize(self, log_file_path: str, log_level=LogLevel.DEBUG):
+    def initialize(self, log_file_path: str, log_level=LogLevel.DEBUG,
+                   fsync='never', log_format='text', rotator=None):
         """
         Initialize the attributes.
 
         log_level is the maximum log level to log. LogLevel.DEBUG will log
         everything, LogLevel.INFO will log everything but debug messages, etc.
 
+        fsync is 'never' to leave flushing the log to disk up to the operating
+        system, 'always' to flush after every write, or a number of seconds to
+        wait between flushes.
+
         Call start() after calling this method.
 
         :param log_file_path: path to the log file
-        :param log_level:
-        :return: the maximum log level to log
+        :param log_level: the maximum log level to log
+        :param fsync: when to flush the log to disk
+        :param log_format: 'text' or 'json'
+        :param rotator: LogRotator for the log file, or None to never rotate
         """
 
         self._log_file_path = log_file_path
         self._log_level = log_level
+        self._fsync = fsync
+        self._log_format = log_format
+        self._rotator = rotator
         self._new_line_queue = Queue()
         self._shutdown_flag = False
+        self._appender = LogAppender()
 
         # if the file does not exist, create it with an edit warning header
         if not os.path.isfile(self._log_file_path):
@@ -152,69 +194,170 @@ class GkeepdLoggerThread(Thread):
                 while True:
                     # We can't fully block because we need to check
                     # _shutdown_flag regularly
-                    log_level, text = self._new_line_queue.get(block=True,
-                                                               timeout=0.1)
-                    self._cleanup_and_log(log_level, text)
-            # git() raises Empty after blocking for timeout seconds and the
+                    item = self._new_line_queue.get(block=True, timeout=0.1)
+                    self._log_batch(self._drain_queue(item))
+            # get() raises Empty after blocking for timeout seconds and the
             # queue is still empty
             except Empty:
                 pass
 
-    def _cleanup_and_log(self, log_level, text: str):
-        # Replace newlines with spaces and log the message
+        self._appender.close()
 
-        # Only log if we're logging this log level
-        if self._log_level >= log_level:
-            # Replace newlines in text with spaces so the entire log text is on
-            # one line
-            text = text.replace('\n', ' ')
-            command = log_append_command(self._log_file_path,
-                                         log_level.name, text)
-            try:
-                run_command(command)
-            except CommandError as e:
-                # bad news. raising an exception would only kill the thread
-                print('ERROR LOGGING: {0}'.format(e))
-                print('Command that raised error: {0}'.format(command))
+        if self._rotator is not None:
+            self._rotator.wait()
+
+    def _drain_queue(self, first_item) -> list:
+        # Return first_item along with everything else currently in the
+        # queue, up to max_batch_size items
+
+        items = [first_item]
+
+        try:
+            while len(items) < self.max_batch_size:
+                items.append(self._new_line_queue.get_nowait())
+        except Empty:
+            pass
+
+        return items
+
+    def _log_batch(self, items: list):
+        # Format the messages that should be logged at the current log level
+        # and append them to the log with one write
+
+        lines = []
+
+        for item in items:
+            # Only log if we're logging this log level
+            if self._log_level >= item[0]:
+                lines.append(self._format_line(*item))
+
+        if len(lines) == 0:
+            return
+
+        if self._rotator is not None:
+            self._rotate_if_due(lines)
+
+        try:
+            self._appender.append_lines(self._log_file_path, lines,
+                                        fsync=self._fsync_is_due())
+        except LogFileException as e:
+            # bad news. raising an exception would only kill the thread
+            print('ERROR LOGGING: {0}'.format(e))
+
+    def _format_line(self, log_level, text, timestamp, thread_name, event_id,
+                     duration) -> str:
+        # Build a log line in the configured format
 
-    def log_debug(self, text: str):
+        if self._log_format == 'json':
+            record = {
+                'timestamp': timestamp,
+                'level': log_level.name,
+                'thread': thread_name,
+                'message': text,
+            }
+
+            if event_id is not None:
+                record['event_id'] = event_id
+
+            if duration is not None:
+                record['duration'] = round(duration, 6)
+
+            return json.dumps(record) + '\n'
+
+        # Replace newlines in text with spaces so the entire log text is on
+        # one line
+        text = text.replace('\n', ' ')
+
+        if event_id is not None:
+            text += ' [event {0}]'.format(event_id)
+
+        if duration is not None:
+            text += ' [{0:.3f}s]'.format(duration)
+
+        return format_log_line(log_level.name, text, log_timestamp(timestamp))
+
+    def _rotate_if_due(self, lines: list):
+        # Rotate the log before writing lines if it has grown too large or
+        # too old
+
+        byte_count = sum(len(line.encode()) for line in lines)
+
+        if not self._rotator.rotation_is_due(byte_count):
+            return
+
+        try:
+            self._rotator.rotate()
+        except LogRotationError as e:
+            print('ERROR LOGGING: {0}'.format(e))
+
+    def _fsync_is_due(self) -> bool:
+        # Determine if the log should be flushed to disk after this write
+        # according to the fsync policy
+
+        if self._fsync == 'never':
+            return False
+
+        if self._fsync == 'always':
+            return True
+
+        current_time = time()
+
+        if current_time - self._last_fsync_time < self._fsync:
+            return False
+
+        self._last_fsync_time = current_time
+        return True
+
+    def log_debug(self, text: str, event_id=None, duration=None):
         """
         Log a debugging message.
 
         :param text: text to log
+        :param event_id: identifier of the event the message is about
+        :param duration: number of seconds something took
         """
 
-        self._new_line_queue.put((LogLevel.DEBUG, text))
+        self._enqueue(LogLevel.DEBUG, text, event_id, duration)
 
-    def log_info(self, text: str):
+    def log_info(self, text: str, event_id=None, duration=None):
         """
         Log an informative message.
 
         :param text: text to log
-        :return:
+        :param event_id: identifier of the event the message is about
+        :param duration: number of seconds something took
         """
 
-        self._new_line_queue.put((LogLevel.INFO, text))
+        self._enqueue(LogLevel.INFO, text, event_id, duration)
 
-    def log_warning(self, text: str):
+    def log_warning(self, text: str, event_id=None, duration=None):
         """
         Log a warning message.
 
         :param text: text to log
-        :return:
+        :param event_id: identifier of the event the message is about
+        :param duration: number of seconds something took
         """
 
-        self._new_line_queue.put((LogLevel.WARNING, text))
+        self._enqueue(LogLevel.WARNING, text, event_id, duration)
 
-    def log_error(self, text: str):
+    def log_error(self, text: str, event_id=None, duration=None):
         """
         Log an error message.
 
         :param text: text to log
-        :return:
+        :param event_id: identifier of the event the message is about
+        :param duration: number of seconds something took
         """
 
-        self._new_line_queue.put((LogLevel.ERROR, text))
+        self._enqueue(LogLevel.ERROR, text, event_id, duration)
+
+    def _enqueue(self, log_level, text, event_id, duration):
+        # Queue a message along with the time it was logged and the name of
+        # the thread that logged it
+
+        self._new_line_queue.put((log_level, text, time(),
+                                  current_thread().name, event_id, duration))
 
 
 # module-level instance for global access.
@@ -16,9 +16,13 @@
 
 """Provides utility functions used by EventHandler classes."""
 
-from gkeepcore.log_file import log_append_command
+from gkeepcore.log_file import LogAppender
 from gkeepcore.path_utils import user_home_dir, gkeepd_to_faculty_log_path
-from gkeepcore.shell_command import run_command
+
+
+# appends to the logs that gkeepd uses to communicate with faculty clients.
+# Shared by all the handler threads, it keeps each faculty log open.
+faculty_log_appender = LogAppender()
 
 
 def log_gkeepd_to_faculty(faculty_username: str, event_type: str,
@@ -26,6 +30,12 @@ def log_gkeepd_to_faculty(faculty_username: str, event_type: str,
     """
     Append to the log that gkeepd uses to communicate with a faculty client.
 
+    The line is written in the same format as log_append_command() would
+    write it, with a single write so that lines from concurrent handlers do
+    not interleave.
+
+    Raises LogFileException if the log cannot be written.
+
     :param faculty_username: username of the faculty
     :param event_type: type of the event
     :param payload: event information
@@ -34,5 +44,4 @@ def log_gkeepd_to_faculty(faculty_username: str, event_type: str,
     faculty_home_dir = user_home_dir(faculty_username)
     log_path = gkeepd_to_faculty_log_path(faculty_home_dir)
 
-    command = log_append_command(log_path, event_type, payload)
-    run_command(command)
+    faculty_log_appender.append(log_path, event_type, payload)
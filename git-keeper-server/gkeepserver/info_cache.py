@@ -0,0 +1,165 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides FingerprintCache, which the info refresher uses to avoid
+recomputing information about files and repositories that have not changed.
+
+A fingerprint is the inode, size, and modification time of each of a list of
+files. A cached value is reused as long as the fingerprint of its files is
+the same as when the value was computed.
+"""
+
+import os
+from threading import Lock
+
+
+def file_fingerprint(path: str):
+    """
+    Get the fingerprint of a single file.
+
+    :param path: path to the file
+    :return: tuple of the inode, size, and modification time in nanoseconds,
+     or None if the file cannot be accessed
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def git_ref_paths(repo_path: str) -> list:
+    """
+    Get the paths of the files that change when the branch HEAD refers to
+    changes: HEAD, the branch's loose ref file, and packed-refs.
+
+    The branch is read from HEAD rather than assumed to be master, since
+    repositories created with a different init.defaultBranch use another
+    name. If HEAD cannot be read, refs/heads/master is used.
+
+    :param repo_path: path to a bare repository, or to a working copy
+    :return: list of paths
+    """
+
+    git_dir_path = os.path.join(repo_path, '.git')
+
+    if not os.path.isdir(git_dir_path):
+        git_dir_path = repo_path
+
+    head_path = os.path.join(git_dir_path, 'HEAD')
+    ref_name = 'refs/heads/master'
+
+    try:
+        with open(head_path) as f:
+            head = f.read().strip()
+    except (OSError, UnicodeDecodeError):
+        head = ''
+
+    if head.startswith('ref: '):
+        head_ref_name = head[len('ref: '):]
+
+        if '..' not in head_ref_name.split('/'):
+            ref_name = head_ref_name
+
+    return [head_path,
+            os.path.join(git_dir_path, *ref_name.split('/')),
+            os.path.join(git_dir_path, 'packed-refs')]
+
+
+class FingerprintCache:
+    """
+    Caches values computed from files, keyed by arbitrary hashable keys.
+
+    Entries that have not been used since the last call to prune_unused()
+    are removed by it, so that the cache does not keep entries for files
+    that are no longer of interest.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self):
+        """Create an empty cache."""
+
+        self._lock = Lock()
+
+        # maps keys to (fingerprint, value) tuples
+        self._entries = {}
+
+        # keys that have been used since the last prune
+        self._used_keys = set()
+
+    def get(self, key, paths: list, compute):
+        """
+        Get the value for a key, computing it if it is not cached or if any
+        of the files have changed since it was computed.
+
+        The fingerprint is taken before computing the value, so a change made
+        while the value is being computed is picked up next time.
+
+        Any exception raised by compute is passed on, and nothing is cached.
+
+        :param key: key identifying the value
+        :param paths: paths of the files the value is computed from
+        :param compute: function that takes no arguments and computes the
+         value
+        :return: the value
+        """
+
+        fingerprint = tuple(file_fingerprint(path) for path in paths)
+
+        with self._lock:
+            self._used_keys.add(key)
+            entry = self._entries.get(key)
+
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = (fingerprint, value)
+
+        return value
+
+    def invalidate(self, key):
+        """
+        Remove the entry for a key, so that its value is computed again the
+        next time it is requested.
+
+        :param key: key identifying the value
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def prune_unused(self):
+        """
+        Remove the entries that have not been used since the last call.
+        """
+
+        with self._lock:
+            for key in list(self._entries):
+                if key not in self._used_keys:
+                    del self._entries[key]
+
+            self._used_keys = set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -15,42 +15,61 @@
 
 """
 Provides a thread which updates the info for a faculty member's classes. Other
-threads request an update by enqueuing a faculty username.
+threads request an update by enqueuing a faculty username, optionally with the
+class, assignment, and student that changed. A request for part of the info
+patches that part of the info computed by the last refresh, rather than
+refreshing everything.
+
+Requests are coalesced. A faculty member is refreshed once no further
+requests for them have arrived for config.info_refresh_debounce seconds, or
+once config.info_refresh_max_staleness seconds have passed since the first
+pending request, whichever comes first. Urgent requests are refreshed right
+away.
+
+Repositories are read concurrently by config.info_refresh_thread_count threads.
+
+The info is written to the faculty's info directory by
+gkeepserver.info_store.
+
+The results of querying repositories are cached. On each refresh they are
+only read again if the files they came from have changed, see
+gkeepserver.info_cache. Class students come from gkeepserver.roster.
 """
-import json
 import os
-from queue import Queue, Empty
-from tempfile import TemporaryDirectory
-from threading import Thread
-from time import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition
+from time import monotonic
 
 from gkeepcore.git_commands import git_head_hash, git_head_hash_date, \
-    git_hashes_and_times
+    git_head_summary
 from gkeepcore.gkeep_exception import GkeepException
 from gkeepcore.path_utils import user_home_dir, student_assignment_repo_path, \
-    faculty_info_path
-from gkeepcore.system_commands import sudo_chown, chmod, mv, mkdir, rm
+    class_student_csv_path, faculty_assignment_dir_path
 from gkeepserver.assignments import get_class_assignment_dirs, \
-    AssignmentDirectory
+    AssignmentDirectory, AssignmentDirectoryError
 from gkeepserver.gkeepd_logger import gkeepd_logger as logger
+from gkeepserver.info_cache import FingerprintCache, git_ref_paths
+from gkeepserver.info_store import info_store
+from gkeepserver.roster import roster
 from gkeepserver.server_configuration import config
-from gkeepserver.students_and_classes import get_faculty_class_names, \
-    get_class_students
+from gkeepserver.students_and_classes import get_faculty_class_names
 
 
 class InfoRefreshThread(Thread):
     """
-    Provides a Thread which waits for the name of a faculty member to show up
-    in its queue, and then updates the info for that faculty's classes.
+    Provides a Thread which waits for the name of a faculty member to be
+    enqueued, and then updates the info for that faculty's classes.
 
     Usage:
 
     Call the inherited start() method to start the thread.
 
-    Shutdown the thread by calling shutdown(). All items in the queue will be
+    Shutdown the thread by calling shutdown(). All pending requests will be
     processed before fully shutting down.
 
-    Add faculty usernames to the thread by calling enqueue(username).
+    Request a refresh by calling enqueue(username), optionally passing the
+    class, assignment, and student that changed. Requests for a faculty
+    member that is already pending are combined into one refresh.
     """
     def __init__(self):
         """
@@ -62,36 +81,105 @@ class InfoRefreshThread(Thread):
 
         Thread.__init__(self)
 
-        self._username_queue = Queue()
+        # guards _pending and _shutdown_flag, and is notified when either
+        # changes
+        self._condition = Condition()
+
+        # maps faculty usernames with pending requests to
+        # (time of the first pending request, time the refresh is due,
+        # scopes), where scopes is None if everything is to be refreshed and
+        # otherwise a set of scope tuples, see _make_scope()
+        self._pending = {}
+
+        # maps faculty usernames to FingerprintCache objects
+        self._caches = {}
+
+        # maps faculty usernames to the info last computed for them
+        self._info = {}
+
+        # reads repositories concurrently, created when first needed
+        self._executor = None
 
         self._shutdown_flag = False
 
-    def enqueue(self, faculty_username: str):
+    def enqueue(self, faculty_username: str, class_name=None,
+                assignment_name=None, student_username=None, urgent=False):
         """
-        Add a new faculty username to the queue.
+        Request a refresh of a faculty member's info.
+
+        The class, assignment, and student narrow down what has changed. With
+        none of them everything is refreshed. With only a class name the
+        class is refreshed, with a class and an assignment name the
+        assignment is refreshed, and with all three only the student's
+        repository for the assignment and the assignment's reports
+        repository are refreshed. A name is ignored if the names before it
+        are not given.
 
         :param faculty_username: the username of the faculty
+        :param class_name: name of the class that changed
+        :param assignment_name: name of the assignment that changed
+        :param student_username: username of the student whose assignment
+         repository changed
+        :param urgent: if True, refresh as soon as possible rather than
+         waiting for further requests
         """
 
-        self._username_queue.put(faculty_username)
+        if not isinstance(faculty_username, str):
+            warning = ('Item enqueued for info refresh that is not a string: '
+                       '{0}'.format(faculty_username))
+            logger.log_warning(warning)
+            return
+
+        scope = _make_scope(class_name, assignment_name, student_username)
+
+        now = monotonic()
+
+        with self._condition:
+            if faculty_username in self._pending:
+                first_request_time, due_time, scopes = \
+                    self._pending[faculty_username]
+            else:
+                first_request_time, due_time, scopes = now, now, set()
+
+            if scope is None:
+                scopes = None
+            elif scopes is not None:
+                scopes.add(scope)
+
+            if urgent:
+                due_time = now
+            else:
+                # each request pushes the refresh back, but not past the
+                # staleness bound
+                latest_due_time = (first_request_time +
+                                   config.info_refresh_max_staleness)
+                due_time = min(max(due_time,
+                                   now + config.info_refresh_debounce),
+                               latest_due_time)
+
+            self._pending[faculty_username] = (first_request_time, due_time,
+                                               scopes)
+            self._condition.notify()
 
     def shutdown(self):
         """
         Shutdown the thread.
 
-        The run loop will not exit until all queued usernames have been
-        processed.
+        The run loop will not exit until all pending requests have been
+        processed, without waiting for them to become due.
 
         This method blocks until the thread has died.
         """
 
-        self._shutdown_flag = True
+        with self._condition:
+            self._shutdown_flag = True
+            self._condition.notify()
+
         self.join()
 
     def run(self):
         """
-        Refresh info for a faculty's classes as their usernames arrive in the
-        queue.
+        Refresh info for a faculty's classes as their requests become due.
 
         This method should not be called directly. Call the start() method
         instead.
@@ -99,85 +187,177 @@ class InfoRefreshThread(Thread):
         Loops until someone calls shutdown().
         """
 
-        while not self._shutdown_flag:
-            try:
-                while True:
-                    faculty_username = self._username_queue.get(block=True,
-                                                                timeout=0.1)
-
-                    if not isinstance(faculty_username, str):
-                        warning = ('Item enqueued for info refresh that is ' 
-                                   ' not a string: {0}'
-                                   .format(faculty_username))
-                        logger.log_warning(warning)
-                    else:
-                        self._refresh_info(faculty_username)
-            except Empty:
-                pass
-            except Exception as e:
-                logger.log_error('Error in info refresh thread: {0}'
-                                 .format(e))
-
-    def _refresh_info(self, faculty_username):
-        logger.log_info('Refreshing info for {0}'.format(faculty_username))
-
-        # Refresh the info for a faculty member
-        info = {}
+        while True:
+            due_requests = self._wait_for_due_requests()
+
+            if due_requests is None:
+                break
+
+            for faculty_username, scopes in due_requests:
+                try:
+                    self._refresh_info(faculty_username, scopes)
+                except Exception as e:
+                    logger.log_error('Error in info refresh thread: {0}'
+                                     .format(e))
+
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _wait_for_due_requests(self):
+        # Wait until at least one refresh is due and remove the due requests
+        # from _pending. Returns a list of (username, scopes) tuples, or None
+        # if the thread has been shut down and there is nothing left to do.
+
+        with self._condition:
+            while True:
+                now = monotonic()
+
+                if self._shutdown_flag:
+                    if len(self._pending) == 0:
+                        return None
+
+                    due_usernames = list(self._pending)
+                else:
+                    due_usernames = [username for username, pending
+                                     in self._pending.items()
+                                     if pending[1] <= now]
+
+                if len(due_usernames) > 0:
+                    return [(username, self._pending.pop(username)[2])
+                            for username in due_usernames]
+
+                if len(self._pending) == 0:
+                    timeout = None
+                else:
+                    timeout = min(pending[1] for pending
+                                  in self._pending.values()) - now
+
+                self._condition.wait(timeout)
+
+    def _refresh_info(self, faculty_username, scopes=None):
+        # Refresh the info for a faculty member, either everything if scopes
+        # is None, or by patching the parts described by the scopes into the
+        # info from the last refresh
+
+        if faculty_username not in self._caches:
+            self._caches[faculty_username] = FingerprintCache()
+
+        cache = self._caches[faculty_username]
+
+        # patching requires a complete refresh to patch
+        if faculty_username not in self._info:
+            scopes = None
+
+        if scopes is None:
+            logger.log_info('Refreshing info for {0}'
+                            .format(faculty_username))
+        else:
+            logger.log_info('Refreshing info for {0}: {1}'
+                            .format(faculty_username,
+                                    ', '.join('/'.join(scope)
+                                              for scope in sorted(scopes))))
 
         try:
-            class_names = get_faculty_class_names(faculty_username)
+            if scopes is None:
+                info = {}
+
+                class_names = get_faculty_class_names(faculty_username)
+
+                for class_name in class_names:
+                    self._refresh_class_info(faculty_username, class_name,
+                                             info, cache)
 
-            for class_name in class_names:
-                self._refresh_class_info(faculty_username, class_name, info)
+                # forget about classes, assignments, and students that are
+                # gone
+                cache.prune_unused()
+            else:
+                info = self._info[faculty_username]
 
-            self._write_hashes(faculty_username, info)
+                for scope in _minimal_scopes(scopes):
+                    self._patch_info(faculty_username, scope, info, cache)
+
+            self._info[faculty_username] = info
+
+            info_store.write(faculty_username, info)
 
             info = 'Info refreshed for {0}'.format(faculty_username)
             logger.log_info(info)
         except Exception as e:
+            # the patched info may be incomplete, start over next time
+            self._info.pop(faculty_username, None)
+
             error = 'Refresh info failed: {0}'.format(e)
             logger.log_error(error)
 
-    def _write_hashes(self, faculty_username, info):
-        # Write the info to the info file
+    def _patch_info(self, faculty_username, scope, info,
+                    cache: FingerprintCache):
+        # Refresh the part of the info described by a scope, falling back to
+        # refreshing the class or the assignment if the info does not yet
+        # contain what the scope refers to
 
+        class_name = scope[0]
         home_dir = user_home_dir(faculty_username)
-        info_path = faculty_info_path(home_dir)
 
-        if not os.path.isdir(info_path):
-            mkdir(info_path, sudo=True)
-            sudo_chown(info_path, faculty_username, config.keeper_group,
-                       recursive=True)
+        if not os.path.isfile(class_student_csv_path(class_name, home_dir)):
+            info.pop(class_name, None)
+            return
+
+        if len(scope) == 1 or class_name not in info:
+            self._refresh_class_info(faculty_username, class_name, info,
+                                     cache)
+            return
+
+        assignment_name = scope[1]
+        assignments_info = info[class_name]['assignments']
 
-        json_filename = '{0}.json'.format(str(time()))
+        assignment_path = faculty_assignment_dir_path(class_name,
+                                                      assignment_name,
+                                                      home_dir)
 
-        info_json_path = os.path.join(info_path, json_filename)
+        try:
+            assignment_dir = AssignmentDirectory(assignment_path)
+        except AssignmentDirectoryError:
+            # the assignment was deleted
+            assignments_info.pop(assignment_name, None)
+            return
 
-        with TemporaryDirectory() as temp_dir_path:
-            temp_info_json_path = os.path.join(temp_dir_path, 'info.json')
+        students = roster.class_students(faculty_username, class_name)
 
-            with open(temp_info_json_path, 'w') as f:
-                json.dump(info, f)
+        assignment_info = assignments_info.get(assignment_name)
 
-            sudo_chown(temp_info_json_path, faculty_username,
-                       config.keeper_group)
-            chmod(temp_info_json_path, '640', sudo=True)
-            mv(temp_info_json_path, info_json_path, sudo=True)
+        if (len(scope) == 2 or assignment_info is None or
+                not assignment_info['published']):
+            self._refresh_assignment_info(faculty_username, assignment_dir,
+                                          students, info, cache)
+            return
 
-        info_files = [f for f in os.listdir(info_path) if f.endswith('.json')]
-        info_files.sort()
+        student_username = scope[2]
 
-        while len(info_files) > 10:
-            delete_filename = info_files.pop(0)
-            delete_path = os.path.join(info_path, delete_filename)
-            rm(delete_path, sudo=True)
+        # testing a submission pushes a report
+        assignment_info['reports_repo'] = \
+            self._reports_repo_info(assignment_dir, cache)
 
-    def _refresh_class_info(self, faculty_username, class_name, info):
+        students_repos = assignment_info['students_repos']
+
+        for student in students:
+            if student.username == student_username:
+                student_info = self._student_repo_info(faculty_username,
+                                                       class_name,
+                                                       assignment_name,
+                                                       student, cache)
+
+                if student_info is None:
+                    students_repos.pop(student_username, None)
+                else:
+                    students_repos[student_username] = student_info
+
+    def _refresh_class_info(self, faculty_username, class_name, info,
+                            cache: FingerprintCache):
         # Refresh the info for a single class
 
         info[class_name] = {}
 
-        students = get_class_students(faculty_username, class_name)
+        students = roster.class_students(faculty_username, class_name)
 
         students_info = {}
 
@@ -203,11 +383,11 @@ class InfoRefreshThread(Thread):
 
         for assignment_dir in assignment_dirs:
             self._refresh_assignment_info(faculty_username, assignment_dir,
-                                          students, info)
+                                          students, info, cache)
 
     def _refresh_assignment_info(self, faculty_username,
                                  assignment_dir: AssignmentDirectory,
-                                 students, info):
+                                 students, info, cache: FingerprintCache):
         # Refresh the hashes for a single assignment
 
         class_name = assignment_dir.class_name
@@ -227,42 +407,20 @@ class InfoRefreshThread(Thread):
 
             return
 
-        reports_repo_path = assignment_dir.reports_repo_path
-        reports_repo_hash = git_head_hash(assignment_dir.reports_repo_path)
+        reports_repo_info = self._reports_repo_info(assignment_dir, cache)
 
-        reports_repo_info = {
-            'path': reports_repo_path,
-            'hash': reports_repo_hash
-        }
+        student_infos = self._map(
+            lambda student: self._student_repo_info(faculty_username,
+                                                    class_name,
+                                                    assignment_name, student,
+                                                    cache),
+            students)
 
         students_info = {}
 
-        for student in students:
-            student_home_dir = user_home_dir(student.username)
-
-            assignment_repo_path = \
-                student_assignment_repo_path(faculty_username,
-                                             class_name, assignment_name,
-                                             student_home_dir)
-
-            try:
-                hashes_and_times = git_hashes_and_times(assignment_repo_path)
-            except GkeepException as e:
-                warning = ('Could not get hashes for {0}: {1}'
-                           .format(assignment_repo_path, e))
-                logger.log_warning(warning)
-                continue
-
-            student_info = {
-                'first': student.first_name,
-                'last': student.last_name,
-                'path': assignment_repo_path,
-                'hash': hashes_and_times[0][0],
-                'time': hashes_and_times[0][1],
-                'submission_count': len(hashes_and_times) - 1
-            }
-
-            students_info[student.username] = student_info
+        for student, student_info in zip(students, student_infos):
+            if student_info is not None:
+                students_info[student.username] = student_info
 
         assignment_info = {
             'name': assignment_name,
@@ -274,6 +432,105 @@ class InfoRefreshThread(Thread):
         info[class_name]['assignments'][assignment_name] = \
             assignment_info
 
+    def _map(self, function, items) -> list:
+        # Call a function on each item using the thread pool and return the
+        # results in the same order as the items
+
+        if config.info_refresh_thread_count == 1 or len(items) <= 1:
+            return [function(item) for item in items]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=config.info_refresh_thread_count)
+
+        return list(self._executor.map(function, items))
+
+    def _reports_repo_info(self, assignment_dir: AssignmentDirectory,
+                           cache: FingerprintCache):
+        # Get the info for an assignment's reports repository
+
+        reports_repo_path = assignment_dir.reports_repo_path
+        reports_repo_hash = cache.get(('reports', reports_repo_path),
+                                      git_ref_paths(reports_repo_path),
+                                      lambda: git_head_hash(reports_repo_path))
+
+        return {
+            'path': reports_repo_path,
+            'hash': reports_repo_hash
+        }
+
+    def _student_repo_info(self, faculty_username, class_name,
+                           assignment_name, student, cache: FingerprintCache):
+        # Get the info for a student's assignment repository, or None if the
+        # repository cannot be read
+
+        student_home_dir = user_home_dir(student.username)
+
+        assignment_repo_path = \
+            student_assignment_repo_path(faculty_username, class_name,
+                                         assignment_name, student_home_dir)
+
+        try:
+            head_hash, head_time, submission_count = \
+                cache.get(('repo', assignment_repo_path),
+                          git_ref_paths(assignment_repo_path),
+                          lambda: _summarize_repo(assignment_repo_path))
+        except GkeepException as e:
+            warning = ('Could not get hashes for {0}: {1}'
+                       .format(assignment_repo_path, e))
+            logger.log_warning(warning)
+            return None
+
+        return {
+            'first': student.first_name,
+            'last': student.last_name,
+            'path': assignment_repo_path,
+            'hash': head_hash,
+            'time': head_time,
+            'submission_count': submission_count
+        }
+
+
+def _make_scope(class_name, assignment_name, student_username):
+    # Build a scope tuple from the names, stopping at the first name that is
+    # None. Returns None if there is no class name, meaning everything.
+
+    scope = []
+
+    for name in (class_name, assignment_name, student_username):
+        if name is None:
+            break
+
+        scope.append(name)
+
+    if len(scope) == 0:
+        return None
+
+    return tuple(scope)
+
+
+def _minimal_scopes(scopes):
+    # Get the scopes sorted from broadest to narrowest, without the scopes
+    # that are contained in a broader scope
+
+    minimal_scopes = []
+
+    for scope in sorted(scopes, key=lambda scope: (len(scope), scope)):
+        if not any(scope[:len(broader)] == broader
+                   for broader in minimal_scopes):
+            minimal_scopes.append(scope)
+
+    return minimal_scopes
+
+
+def _summarize_repo(repo_path):
+    # Get the hash and time of the head commit of a student's repository,
+    # and the number of submissions, which is every commit except the first
+
+    head_hash, head_time, commit_count = git_head_summary(repo_path)
+
+    return head_hash, head_time, commit_count - 1
+
 
 # module-level instance for global access
 info_refresher = InfoRefreshThread()
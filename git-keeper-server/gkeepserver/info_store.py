@@ -0,0 +1,431 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides InfoStore, which writes the info computed by the info refresher to
+faculty members' info directories.
+
+Each write is a new generation of the info. Generations are numbered from 1
+and stored in files named by gkeepcore.path_utils.info_generation_filename().
+The link latest.json points to the file for the latest generation and is
+replaced atomically, so clients can always read it without seeing a
+partially written file. A few older generations are kept so that a client
+that has just read the link can still open the file it pointed to.
+
+Each class is also written to its own partition file, so that clients that
+only need some classes do not have to download the info for all of them.
+A partition is only written when the info for its class has changed, and is
+compressed with gzip if config.info_compression is gzip. The index file for
+each generation lists the partition file of every class:
+
+    {"generation": <generation>,
+     "classes": {<class name>: {"path": <partition path>,
+                                "digest": <SHA-1 of the class JSON>}}}
+
+Partition paths are relative to the info directory. The link index.json
+points to the index of the latest generation.
+
+For each generation there is also a delta from the previous generation, see
+gkeepcore.info_delta, so that clients that have a recent generation can
+catch up without downloading everything:
+
+    {"generation": <generation>, "operations": <list of operations>}
+
+Deltas are kept for the last DELTAS_KEPT generations. There is no delta for
+a generation if the previous generation could not be read.
+
+The info directory is owned by the keeper user and the faculty member's
+default group, with the setgid bit set so that new files get that group.
+This lets gkeepd write the info without sudo. Directories created by older
+versions, which were owned by the faculty member, are converted the first
+time they are written to.
+"""
+
+import gzip
+import json
+import os
+import stat
+from hashlib import sha1
+from tempfile import mkstemp
+
+from gkeepcore.gkeep_exception import GkeepException
+from gkeepcore.info_delta import info_delta
+from gkeepcore.path_utils import user_home_dir, faculty_info_path, \
+    faculty_info_latest_path, info_generation_filename, \
+    parse_info_generation_filename, faculty_info_index_path, \
+    info_index_dir_path, info_partitions_dir_path, info_partition_path, \
+    info_deltas_dir_path, info_delta_path
+from gkeepcore.system_commands import default_group, mkdir, sudo_chown, \
+    chmod
+from gkeepserver.server_configuration import config
+
+# number of generations of the info to keep
+GENERATIONS_KEPT = 10
+
+# number of deltas between generations to keep
+DELTAS_KEPT = 50
+
+INFO_DIR_MODE = '2750'
+INFO_FILE_MODE = 0o640
+
+GZIP_SUFFIX = '.gz'
+
+
+class InfoStoreError(GkeepException):
+    """Raised if the info cannot be written."""
+    pass
+
+
+class InfoStore:
+    """
+    Writes generations of faculty members' info.
+
+    Not thread safe, only the info refresh thread writes info.
+    """
+
+    def __init__(self):
+        """Create the object."""
+
+        # maps faculty usernames to the latest generation written for them
+        self._generations = {}
+
+        # maps faculty usernames to the latest index written for them
+        self._indexes = {}
+
+        # maps faculty usernames to copies of the latest info written for
+        # them, to compute the next delta from
+        self._infos = {}
+
+    def write(self, faculty_username: str, info: dict) -> int:
+        """
+        Write a new generation of a faculty member's info.
+
+        Raises InfoStoreError if the info cannot be written.
+
+        :param faculty_username: username of the faculty member
+        :param info: the info
+        :return: the generation number of the info
+        """
+
+        home_dir = user_home_dir(faculty_username)
+        info_path = faculty_info_path(home_dir)
+
+        try:
+            self._prepare_directory(faculty_username, info_path)
+
+            generation = self.latest_generation(faculty_username) + 1
+            generation_filename = info_generation_filename(generation)
+
+            info_json = json.dumps(info)
+
+            _write_file(info_path,
+                        os.path.join(info_path, generation_filename),
+                        info_json.encode())
+
+            self._write_delta(faculty_username, info, generation)
+
+            index = self._write_partitions(faculty_username, info_path, info,
+                                           generation)
+
+            index_dir_path = info_index_dir_path(home_dir)
+            _make_directory(index_dir_path)
+            _write_file(index_dir_path,
+                        os.path.join(index_dir_path, generation_filename),
+                        json.dumps(index).encode())
+
+            _replace_link(faculty_info_latest_path(home_dir),
+                          generation_filename)
+            _replace_link(faculty_info_index_path(home_dir),
+                          os.path.join(os.path.basename(index_dir_path),
+                                       generation_filename))
+
+            self._generations[faculty_username] = generation
+            self._indexes[faculty_username] = index
+
+            # the caller may modify info after this, so keep a copy
+            self._infos[faculty_username] = json.loads(info_json)
+
+            _remove_old_generations(home_dir, generation)
+        except (GkeepException, OSError) as e:
+            raise InfoStoreError('Error writing info for {0}: {1}'
+                                 .format(faculty_username, e))
+
+        return generation
+
+    def latest_generation(self, faculty_username: str) -> int:
+        """
+        Get the latest generation of a faculty member's info, reading it from
+        the latest.json link if nothing has been written since gkeepd
+        started.
+
+        :param faculty_username: username of the faculty member
+        :return: the generation number, 0 if there is no info
+        """
+
+        if faculty_username not in self._generations:
+            latest_path = \
+                faculty_info_latest_path(user_home_dir(faculty_username))
+
+            try:
+                generation = \
+                    parse_info_generation_filename(os.readlink(latest_path))
+            except OSError:
+                generation = None
+
+            self._generations[faculty_username] = generation or 0
+
+        return self._generations[faculty_username]
+
+    def _latest_index(self, faculty_username):
+        # Get the latest index, reading it if nothing has been written since
+        # gkeepd started. Returns an empty index if it cannot be read.
+
+        if faculty_username not in self._indexes:
+            index_path = \
+                faculty_info_index_path(user_home_dir(faculty_username))
+
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+                index['classes'].items()
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                index = {'classes': {}}
+
+            self._indexes[faculty_username] = index
+
+        return self._indexes[faculty_username]
+
+    def _write_delta(self, faculty_username, info, generation):
+        # Write the delta from the previous generation, if it is known
+
+        home_dir = user_home_dir(faculty_username)
+        previous_info = self._infos.get(faculty_username)
+
+        # after a restart, read the previous generation
+        if previous_info is None:
+            previous_path = os.path.join(faculty_info_path(home_dir),
+                                         info_generation_filename(
+                                             generation - 1))
+
+            try:
+                with open(previous_path) as f:
+                    previous_info = json.load(f)
+            except (OSError, ValueError):
+                return
+
+            if not isinstance(previous_info, dict):
+                return
+
+        delta = {
+            'generation': generation,
+            'operations': info_delta(previous_info, info)
+        }
+
+        deltas_dir_path = info_deltas_dir_path(home_dir)
+        _make_directory(deltas_dir_path)
+        _write_file(deltas_dir_path, info_delta_path(home_dir, generation),
+                    json.dumps(delta).encode())
+
+    def _write_partitions(self, faculty_username, info_path, info,
+                          generation):
+        # Write the partitions of the classes that have changed since the
+        # latest index and return the index for the new generation
+
+        home_dir = user_home_dir(faculty_username)
+        previous_entries = self._latest_index(faculty_username)['classes']
+        compress = (config.info_compression == 'gzip')
+
+        index = {
+            'generation': generation,
+            'classes': {}
+        }
+
+        for class_name, class_info in info.items():
+            data = json.dumps(class_info).encode()
+            digest = sha1(data).hexdigest()
+
+            previous_entry = previous_entries.get(class_name)
+
+            # an unchanged class keeps its partition, as long as it still
+            # exists and is compressed the way it should be
+            if (isinstance(previous_entry, dict) and
+                    previous_entry.get('digest') == digest and
+                    previous_entry.get('path', '').endswith(GZIP_SUFFIX) ==
+                    compress and
+                    os.path.isfile(os.path.join(info_path,
+                                                previous_entry['path']))):
+                index['classes'][class_name] = previous_entry
+                continue
+
+            partition_path = info_partition_path(home_dir, class_name,
+                                                 generation)
+
+            if compress:
+                partition_path += GZIP_SUFFIX
+                # mtime=0 so that the same info gives the same file
+                data = gzip.compress(data, mtime=0)
+
+            partition_dir_path = os.path.dirname(partition_path)
+            _make_directory(info_partitions_dir_path(home_dir))
+            _make_directory(partition_dir_path)
+            _write_file(partition_dir_path, partition_path, data)
+
+            index['classes'][class_name] = {
+                'path': os.path.relpath(partition_path, info_path),
+                'digest': digest
+            }
+
+        return index
+
+    def _prepare_directory(self, faculty_username, info_path):
+        # Create the info directory, or convert a directory created by an
+        # older version, so that keeper can write to it without sudo
+
+        if not os.path.isdir(info_path):
+            mkdir(info_path, sudo=True)
+
+        info_stat = os.stat(info_path)
+
+        if (info_stat.st_uid == os.getuid() and
+                stat.S_IMODE(info_stat.st_mode) == int(INFO_DIR_MODE, 8)):
+            return
+
+        try:
+            faculty_group = default_group(faculty_username)
+        except KeyError:
+            raise InfoStoreError('Cannot find the default group of {0}'
+                                 .format(faculty_username))
+
+        sudo_chown(info_path, config.keeper_user, faculty_group)
+        chmod(info_path, INFO_DIR_MODE, sudo=True)
+
+        # older versions named the files by the time they were written, and
+        # those files are no longer updated
+        for filename in os.listdir(info_path):
+            path = os.path.join(info_path, filename)
+
+            if (filename.endswith('.json') and not os.path.islink(path) and
+                    parse_info_generation_filename(filename) is None):
+                os.remove(path)
+
+
+def _write_file(dir_path, path, data: bytes):
+    # Write a file atomically by writing a temporary file in the same
+    # directory and renaming it. The temporary file is hidden from ls.
+
+    fd, temp_path = mkstemp(dir=dir_path, prefix='.', suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(f.fileno(), INFO_FILE_MODE)
+            f.write(data)
+
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _make_directory(path):
+    # Create a directory inside the info directory if it does not exist.
+    # It gets the info directory's group and setgid bit.
+
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        return
+
+    os.chmod(path, int(INFO_DIR_MODE, 8))
+
+
+def _replace_link(link_path, target):
+    # Point a symbolic link at a new target atomically
+
+    temp_link_path = os.path.join(os.path.dirname(link_path),
+                                  '.' + os.path.basename(link_path) + '.tmp')
+
+    try:
+        os.remove(temp_link_path)
+    except FileNotFoundError:
+        pass
+
+    os.symlink(target, temp_link_path)
+    os.replace(temp_link_path, link_path)
+
+
+def _remove_old_generations(home_dir, latest_generation):
+    # Remove the info and index files for all but the last GENERATIONS_KEPT
+    # generations, the deltas for all but the last DELTAS_KEPT generations,
+    # and the partitions that none of the remaining indexes refer to
+
+    info_path = faculty_info_path(home_dir)
+    index_dir_path = info_index_dir_path(home_dir)
+    deltas_dir_path = info_deltas_dir_path(home_dir)
+
+    for dir_path, kept_count in ((info_path, GENERATIONS_KEPT),
+                                 (index_dir_path, GENERATIONS_KEPT),
+                                 (deltas_dir_path, DELTAS_KEPT)):
+        if not os.path.isdir(dir_path):
+            continue
+
+        oldest_kept = latest_generation - kept_count + 1
+
+        for filename in os.listdir(dir_path):
+            generation = parse_info_generation_filename(filename)
+
+            if generation is not None and generation < oldest_kept:
+                os.remove(os.path.join(dir_path, filename))
+
+    kept_partition_paths = set()
+
+    for filename in os.listdir(index_dir_path):
+        if parse_info_generation_filename(filename) is None:
+            continue
+
+        try:
+            with open(os.path.join(index_dir_path, filename)) as f:
+                index = json.load(f)
+
+            for entry in index['classes'].values():
+                kept_partition_paths.add(os.path.join(info_path,
+                                                      entry['path']))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # cannot tell what it refers to, so leave everything
+            return
+
+    partitions_path = info_partitions_dir_path(home_dir)
+
+    if not os.path.isdir(partitions_path):
+        return
+
+    for class_name in os.listdir(partitions_path):
+        class_path = os.path.join(partitions_path, class_name)
+
+        for filename in os.listdir(class_path):
+            path = os.path.join(class_path, filename)
+
+            if path not in kept_partition_paths:
+                os.remove(path)
+
+        if len(os.listdir(class_path)) == 0:
+            os.rmdir(class_path)
+
+
+# module-level instance for global access
+info_store = InfoStore()
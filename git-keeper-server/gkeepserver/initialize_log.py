@@ -22,10 +22,12 @@ that warns against editing the file.
 import os
 from tempfile import TemporaryDirectory
 
-from gkeepcore.system_commands import mv, sudo_chown, chmod
+from gkeepcore.log_file import compacted_log_header
+from gkeepcore.system_commands import SudoBatch
 
 
-def initialize_log(log_path, user_owner, group_owner, mode):
+def initialize_log(log_path, user_owner, group_owner, mode,
+                   compacted_from=None):
     """
     Create a log file with a header that warns against editing the file.
 
@@ -36,10 +38,15 @@ def initialize_log(log_path, user_owner, group_owner, mode):
     :param user_owner: user that owns the file
     :param group_owner: group that owns the file
     :param mode: permissions for the file
+    :param compacted_from: if the log replaces a compacted log, the number of
+     bytes that were written to the old log
     """
 
     # the starting contents of the log file
-    log_notice = '# THIS FILE WAS AUTO-GENERATED, DO NOT EDIT!\n'
+    if compacted_from is None:
+        log_notice = '# THIS FILE WAS AUTO-GENERATED, DO NOT EDIT!\n'
+    else:
+        log_notice = compacted_log_header(compacted_from)
 
     # create the log file in a temporary directory since we don't have
     # permission to write directly to the user's log.
@@ -49,9 +56,10 @@ def initialize_log(log_path, user_owner, group_owner, mode):
         with open(temp_log_path, 'w+') as f:
             f.write(log_notice)
 
-        # move the log into place after writing
-        mv(temp_log_path, log_path, sudo=True)
-
-    # fix permissions and ownership
-    sudo_chown(log_path, user_owner, group_owner)
-    chmod(log_path, mode, sudo=True)
+        # move the log into place after writing, and fix permissions and
+        # ownership
+        batch = SudoBatch()
+        batch.mv(temp_log_path, log_path)
+        batch.chown(log_path, user_owner, group_owner)
+        batch.chmod(log_path, mode)
+        batch.run()
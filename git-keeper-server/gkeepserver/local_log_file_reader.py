@@ -44,17 +44,23 @@ class LocalLogFileReader(LogFileReader):
 
         return byte_count
 
-    def _read_bytes(self) -> bytes:
+    def _read_bytes(self, file_position: int, max_byte_count=None) -> bytes:
         """
-        Retrieve data as bytes from the file from _seek_position to the end
+        Retrieve data as bytes from the file starting at file_position
 
+        :param file_position: offset into the file to start reading from
+        :param max_byte_count: maximum number of bytes to read, None to read
+         to the end
         :return: data from the file as bytes
         """
 
+        if max_byte_count is None:
+            max_byte_count = -1
+
         try:
             with open(self._file_path, 'rb') as f:
-                f.seek(self._seek_position)
-                data_bytes = f.read()
+                f.seek(file_position)
+                data_bytes = f.read(max_byte_count)
         except OSError as e:
             raise LogFileException(e)
 
@@ -0,0 +1,166 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides compaction of the event logs that students and faculty write to,
+and of the gkeepd.log files that gkeepd writes responses to.
+
+These logs are only ever appended to. Once everything in a log has been read,
+the log can be replaced by one containing only a header that records how many
+bytes came before it (see gkeepcore.log_file.compacted_log_header()). Log
+readers track positions relative to everything ever written to a log, so
+their positions remain valid and no event is read twice.
+
+Event logs are compacted by the log poller, since it knows how much of each
+log has been read. A client may still be appending to the old log when it is
+replaced, so the old log is kept as a segment at <log path>.segment, which
+the poller keeps reading until it has been quiet for a while.
+
+gkeepd.log files are only written by the main thread, which compacts them
+while it is idle. Clients read these logs while waiting for a response, so a
+log is only compacted if it has not been written to for longer than a client
+would wait.
+"""
+
+import os
+from time import time
+
+from gkeepcore.faculty import faculty_from_csv_file
+from gkeepcore.gkeep_exception import GkeepException
+from gkeepcore.local_csv_files import LocalCSVReader
+from gkeepcore.log_file import LogFileException
+from gkeepcore.path_utils import gkeepd_to_faculty_log_path, user_home_dir
+from gkeepcore.shell_command import CommandError
+from gkeepcore.system_commands import group_owner, make_hard_link, mode, mv, \
+    rm, user_owner
+from gkeepserver.gkeepd_logger import gkeepd_logger as logger
+from gkeepserver.initialize_log import initialize_log
+from gkeepserver.local_log_file_reader import LocalLogFileReader
+from gkeepserver.server_configuration import config
+
+# appended to the path of a log to get the path of its old segment
+SEGMENT_SUFFIX = '.segment'
+
+# a gkeepd.log file must not have been written to for this many seconds
+# before it is compacted, which is much longer than clients wait for a
+# response
+GKEEPD_TO_FACULTY_QUIET_TIME = 600
+
+
+class LogCompactionError(GkeepException):
+    """Raised if a log cannot be compacted."""
+    pass
+
+
+def segment_path(log_path: str) -> str:
+    """
+    Get the path that the old segment of a compacted log is kept at.
+
+    :param log_path: path to the log
+    :return: path to the segment
+    """
+
+    return log_path + SEGMENT_SUFFIX
+
+
+def compact_log(log_path: str, compacted_from: int, keep_segment=False):
+    """
+    Replace a log with a new log that contains only a compacted log header.
+
+    The new log has the same owner, group, and permissions as the old one. It
+    is moved over the old log, so the log always exists.
+
+    Raises LogCompactionError on failure.
+
+    :param log_path: path to the log
+    :param compacted_from: seek position of the end of the old log, from a
+     LogFileReader
+    :param keep_segment: if True, the old log is kept at segment_path()
+    """
+
+    new_log_path = log_path + '.new'
+
+    try:
+        initialize_log(new_log_path, user_owner(log_path),
+                       group_owner(log_path), mode(log_path),
+                       compacted_from=compacted_from)
+
+        if keep_segment:
+            # remove any segment left behind if gkeepd stopped part way
+            # through a previous compaction
+            rm(segment_path(log_path), sudo=True)
+            make_hard_link(log_path, segment_path(log_path), sudo=True)
+
+        mv(new_log_path, log_path, sudo=True)
+    except (OSError, KeyError, CommandError) as e:
+        raise LogCompactionError('Error compacting {0}: {1}'
+                                 .format(log_path, e))
+
+
+def remove_segment(log_segment_path: str):
+    """
+    Remove the old segment of a compacted log.
+
+    Raises LogCompactionError on failure.
+
+    :param log_segment_path: path to the segment
+    """
+
+    try:
+        rm(log_segment_path, sudo=True)
+    except CommandError as e:
+        raise LogCompactionError('Error removing {0}: {1}'
+                                 .format(log_segment_path, e))
+
+
+def compact_gkeepd_to_faculty_logs(min_bytes: int):
+    """
+    Compact the gkeepd.log file of each faculty member if it is at least
+    min_bytes and has not been written to recently.
+
+    Must only be called from the main thread, which is the only thread that
+    writes to these logs. Errors are logged rather than raised.
+
+    :param min_bytes: minimum size of a log to compact
+    """
+
+    try:
+        faculty_list = faculty_from_csv_file(
+            LocalCSVReader(config.faculty_csv_path))
+    except GkeepException as e:
+        logger.log_warning('Not compacting faculty logs: {0}'.format(e))
+        return
+
+    for faculty in faculty_list:
+        log_path = gkeepd_to_faculty_log_path(user_home_dir(faculty.username))
+
+        try:
+            stat = os.stat(log_path)
+
+            if (stat.st_size < min_bytes or
+                    time() - stat.st_mtime < GKEEPD_TO_FACULTY_QUIET_TIME):
+                continue
+
+            # a new reader starts at the end of the log
+            compacted_from = LocalLogFileReader(log_path).get_seek_position()
+            compact_log(log_path, compacted_from)
+        except (OSError, LogFileException, LogCompactionError) as e:
+            logger.log_warning('Error compacting {0}: {1}'
+                               .format(log_path, e))
+            continue
+
+        logger.log_info('Compacted {0}, dropping {1} bytes'
+                        .format(log_path, stat.st_size))
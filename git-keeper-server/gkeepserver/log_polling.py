@@ -26,9 +26,16 @@ log are passed on to a parser and then an appropriate handler.
 It is possible to add files to be watched before calling initialize(), but no
 actions can be taken until the thread is initialized and started.
 
-A snapshot of the sizes of the log files is stored after every log
-modification. This allows the poller to start where it left off if the process
-is restarted.
+A snapshot of the seek positions of the log files is stored after every log
+modification. When the process is restarted, the poller watches the same files
+again. By default it starts at the end of each file, so events written while
+the process was not running are ignored, as they always have been. If
+replay_missed_events is passed to initialize(), it starts where it left off
+and those events are handled.
+
+If a compaction interval is given, logs that have been completely read and
+have grown to at least the minimum size are compacted. See the
+gkeepserver.log_compaction module for details.
 
 Example usage::
 
@@ -63,6 +70,8 @@ from time import time, sleep
 from gkeepcore.gkeep_exception import GkeepException
 from gkeepcore.log_file import LogFileReader, LogFileException
 from gkeepserver.gkeepd_logger import GkeepdLoggerThread
+from gkeepserver.log_compaction import compact_log, LogCompactionError, \
+    remove_segment, segment_path, SEGMENT_SUFFIX
 
 
 class LogPollingThreadError(GkeepException):
@@ -80,6 +89,15 @@ class LogPollingThread(Thread):
     See the module-level documentation for usage.
 
     """
+
+    # version of the snapshot file format. Snapshots without a version only
+    # recorded which files to watch.
+    snapshot_version = 2
+
+    # the segment of a compacted log is removed once nothing has been
+    # written to it for this many seconds
+    segment_quiet_time = 60
+
     def __init__(self):
         """
         Constructor.
@@ -104,11 +122,17 @@ class LogPollingThread(Thread):
         self._last_poll_time = None
         self._logger = None
         self._log_file_readers = None
+        self._segment_last_read_times = None
+        self._compaction_interval = None
+        self._compaction_min_bytes = None
+        self._last_compaction_time = None
+        self._replay_missed_events = None
         self._shutdown_flag = None
 
     def initialize(self, new_log_event_queue: Queue, reader_class,
                    snapshot_file_path: str, logger: GkeepdLoggerThread,
-                   polling_interval=0.5):
+                   polling_interval=0.5, compaction_interval=0,
+                   compaction_min_bytes=0, replay_missed_events=False):
         """
         Initialize the attributes.
 
@@ -118,6 +142,11 @@ class LogPollingThread(Thread):
         :param snapshot_file_path: path to the snapshot file
         :param logger: the system logger, used to log runtime information
         :param polling_interval: number of seconds between polling files
+        :param compaction_interval: number of seconds between checking for
+         logs to compact, 0 to never compact logs
+        :param compaction_min_bytes: only compact logs of at least this size
+        :param replay_missed_events: if True, resume reading from the
+         positions in the snapshot rather than from the end of each file
 
         """
 
@@ -135,6 +164,16 @@ class LogPollingThread(Thread):
         # maps log file paths to log readers
         self._log_file_readers = {}
 
+        # maps the paths of segments of compacted logs that are still being
+        # read to the last time data was read from them
+        self._segment_last_read_times = {}
+
+        self._compaction_interval = compaction_interval
+        self._compaction_min_bytes = compaction_min_bytes
+        self._last_compaction_time = time()
+
+        self._replay_missed_events = replay_missed_events
+
         self._load_snapshot()
 
         self._shutdown_flag = False
@@ -196,22 +235,37 @@ class LogPollingThread(Thread):
         try:
             with open(self._snapshot_file_path, 'r') as f:
                 json_data = f.read()
-                log_byte_counts = json.loads(json_data)
-        except OSError as e:
+                snapshot = json.loads(json_data)
+        except (OSError, ValueError) as e:
             raise LogPollingThreadError('Error reading {0}: {1}'
                                         .format(self._snapshot_file_path, e))
 
-        if not isinstance(log_byte_counts, dict):
+        if not isinstance(snapshot, dict):
             error = ('{0} is not a valid snapshot file'
                      .format(self._snapshot_file_path))
             raise LogPollingThreadError(error)
 
         self._logger.log_debug('Loaded ' + self._snapshot_file_path)
 
+        if snapshot.get('version') == self.snapshot_version:
+            seek_positions = snapshot['seek_positions']
+        else:
+            # the seek positions in older snapshots were only written when
+            # files were added, so reading from them would replay old events
+            seek_positions = dict.fromkeys(snapshot)
+
+        # a position of None starts at the end of the file
+        if not self._replay_missed_events:
+            seek_positions = dict.fromkeys(seek_positions)
+
         # start watching all the files from the snapshot file
-        for log_file_path, byte_count in log_byte_counts.items():
+        for log_file_path, seek_position in seek_positions.items():
             self._logger.log_debug('Watching ' + log_file_path)
-            self._create_and_add_reader(log_file_path)
+            self._create_and_add_reader(log_file_path, seek_position)
+
+            if (log_file_path.endswith(SEGMENT_SUFFIX) and
+                    log_file_path in self._log_file_readers):
+                self._segment_last_read_times[log_file_path] = time()
 
     def _write_snapshot(self):
         # Writes the current file byte counts to the snapshot file.
@@ -220,16 +274,31 @@ class LogPollingThread(Thread):
         if self._snapshot_file_path is None:
             return
 
-        byte_counts_by_file_path = {}
+        seek_positions = {}
 
         for file_path, reader in self._log_file_readers.items():
-            byte_counts_by_file_path[file_path] = reader.get_seek_position()
+            seek_positions[file_path] = reader.get_seek_position()
+
+        snapshot = {
+            'version': self.snapshot_version,
+            'seek_positions': seek_positions,
+        }
+
+        # write to a temporary file and move it into place so that the
+        # snapshot is never left half written
+        temp_path = self._snapshot_file_path + '.tmp'
 
         try:
-            with open(self._snapshot_file_path, 'w') as f:
-                json_data = json.dumps(byte_counts_by_file_path)
+            # only the keeper user may read the snapshot
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            os.fchmod(fd, 0o600)
+
+            with open(fd, 'w') as f:
+                json_data = json.dumps(snapshot)
                 f.write(json_data)
-                self._logger.log_debug('Wrote ' + self._snapshot_file_path)
+
+            os.replace(temp_path, self._snapshot_file_path)
         except OSError as e:
             raise LogPollingThreadError('Error writing to {0}: {1}'
                                         .format(self._snapshot_file_path, e))
@@ -255,33 +324,131 @@ class LogPollingThread(Thread):
             self._logger.log_warning(warning)
             return
 
-        reader = self._reader_class(file_path, seek_position=seek_position)
+        reader = self._reader_class(file_path)
+
+        # never start past the end of the file, since the file may have been
+        # replaced since the position was saved
+        if (seek_position is not None and
+                seek_position < reader.get_seek_position()):
+            reader = self._reader_class(file_path, seek_position=seek_position)
+
         self._log_file_readers[file_path] = reader
 
     def _stop_watching_log_file(self, log_file: LogFileReader):
         # Simply remove the file reader from the dictionary
 
         del self._log_file_readers[log_file.get_file_path()]
+        self._segment_last_read_times.pop(log_file.get_file_path(), None)
         self._write_snapshot()
 
+    def _event_log_path(self, file_path: str) -> str:
+        # Events read from the segment of a compacted log are reported as
+        # coming from the log itself
+
+        if file_path in self._segment_last_read_times:
+            return file_path[:-len(SEGMENT_SUFFIX)]
+
+        return file_path
+
+    def _compact_logs(self):
+        # Compact every log that has been read to the end and is at least
+        # _compaction_min_bytes. The old log is kept as a segment that
+        # continues to be read, in case a client was still appending to it.
+
+        compacted = False
+
+        for file_path, reader in list(self._log_file_readers.items()):
+            if (file_path in self._segment_last_read_times or
+                    segment_path(file_path) in self._log_file_readers):
+                continue
+
+            try:
+                if (reader.get_byte_count() < self._compaction_min_bytes or
+                        reader.has_new_lines()):
+                    continue
+
+                compacted_from = reader.get_seek_position()
+                compact_log(file_path, compacted_from, keep_segment=True)
+            except (LogFileException, LogCompactionError) as e:
+                self._logger.log_warning(str(e))
+                continue
+
+            # the segment and the new log continue from the same position
+            log_segment_path = segment_path(file_path)
+
+            self._create_and_add_reader(log_segment_path, compacted_from)
+            self._segment_last_read_times[log_segment_path] = time()
+            self._create_and_add_reader(file_path, compacted_from)
+
+            self._logger.log_info('Compacted {0}'.format(file_path))
+            compacted = True
+
+        if compacted:
+            self._write_snapshot()
+
+    def _remove_quiet_segments(self):
+        # Stop reading and remove the segments of compacted logs that have
+        # not been written to for segment_quiet_time seconds
+
+        for log_segment_path, last_read_time in \
+                list(self._segment_last_read_times.items()):
+            if time() - last_read_time < self.segment_quiet_time:
+                continue
+
+            try:
+                remove_segment(log_segment_path)
+            except LogCompactionError as e:
+                self._logger.log_warning(str(e))
+
+            self._stop_watching_log_file(
+                self._log_file_readers[log_segment_path])
+
     def _poll(self):
         # Poll once for changes in files, and check the queue for new files
         # to watch.
 
         self._last_poll_time = time()
 
-        readers = list(self._log_file_readers.values())
+        # read segments of compacted logs first, since their events came
+        # before any events in the new logs
+        readers = sorted(self._log_file_readers.values(),
+                         key=lambda r: (r.get_file_path() not in
+                                        self._segment_last_read_times))
+
+        read_events = False
 
         # for each file reader, add any new events to the queue
         for reader in readers:
+            file_path = reader.get_file_path()
+
             try:
-                for event in reader.get_new_events():
-                    self._new_log_event_queue.put((reader.get_file_path(),
-                                                   event))
+                events = reader.get_new_events()
             except LogFileException as e:
                 self._logger.log_warning(str(e))
                 # if something goes wrong we should not keep watching this file
                 self._stop_watching_log_file(reader)
+                continue
+
+            for event in events:
+                self._new_log_event_queue.put((self._event_log_path(file_path),
+                                               event))
+
+            if len(events) > 0:
+                read_events = True
+
+                if file_path in self._segment_last_read_times:
+                    self._segment_last_read_times[file_path] = time()
+
+        if read_events:
+            self._write_snapshot()
+
+        self._remove_quiet_segments()
+
+        if (self._compaction_interval > 0 and
+                time() - self._last_compaction_time >=
+                self._compaction_interval):
+            self._compact_logs()
+            self._last_compaction_time = time()
 
         # consume all new log files until the queue is empty
         try:
@@ -0,0 +1,195 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides rotation of the gkeepd system log.
+
+When the log grows past a maximum size, or has been written to for longer
+than a rotation interval, it is renamed to <log path>.<timestamp> and a new
+log is started in its place. Rotated segments are compressed with gzip in a
+background thread, and only the newest backup_count compressed segments are
+kept.
+
+LogRotator does not write the log itself. The thread that writes the log
+asks it whether a rotation is due before each write.
+"""
+
+import gzip
+import os
+import shutil
+from datetime import datetime
+from threading import Thread
+from time import time
+
+from gkeepcore.gkeep_exception import GkeepException
+
+
+class LogRotationError(GkeepException):
+    """Raised if a log file cannot be rotated."""
+    pass
+
+
+class LogRotator:
+    """
+    Decides when to rotate a log file and rotates it.
+
+    Not thread safe, only the thread that writes the log should use it.
+    """
+
+    # first line of each new log segment
+    header = '# THIS FILE WAS AUTO-GENERATED, DO NOT EDIT\n'
+
+    def __init__(self, log_file_path: str, max_bytes=0, interval=0,
+                 backup_count=5):
+        """
+        :param log_file_path: path to the log file
+        :param max_bytes: rotate once the log would grow past this many bytes,
+         0 to never rotate based on size
+        :param interval: rotate after writing to the same segment for this
+         many seconds, 0 to never rotate based on time
+        :param backup_count: number of compressed segments to keep
+        """
+
+        self.log_file_path = log_file_path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+
+        self._segment_start_time = time()
+        self._compress_threads = []
+
+    def is_enabled(self) -> bool:
+        """
+        :return: True if the log will ever be rotated
+        """
+
+        return self.max_bytes > 0 or self.interval > 0
+
+    def rotation_is_due(self, byte_count: int) -> bool:
+        """
+        Determine if the log should be rotated before byte_count more bytes
+        are written to it.
+
+        :param byte_count: number of bytes about to be written
+        :return: True if the log should be rotated first
+        """
+
+        if self.interval > 0:
+            if time() - self._segment_start_time >= self.interval:
+                return True
+
+        if self.max_bytes > 0:
+            try:
+                size = os.path.getsize(self.log_file_path)
+            except OSError:
+                return False
+
+            # never rotate a segment that contains only the header
+            if size > len(self.header) and size + byte_count > self.max_bytes:
+                return True
+
+        return False
+
+    def rotate(self):
+        """
+        Rename the log to a timestamped segment, start a new log with the same
+        permissions, and compress the segment in the background.
+
+        Raises LogRotationError if the log cannot be renamed or recreated.
+        """
+
+        # the microseconds keep the names unique and in order
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        segment_path = '{0}.{1}'.format(self.log_file_path, timestamp)
+
+        try:
+            mode = os.stat(self.log_file_path).st_mode & 0o777
+            os.rename(self.log_file_path, segment_path)
+
+            fd = os.open(self.log_file_path,
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+            os.fchmod(fd, mode)
+
+            with open(fd, 'w') as f:
+                f.write(self.header)
+        except OSError as e:
+            raise LogRotationError('Error rotating {0}: {1}'
+                                   .format(self.log_file_path, e))
+
+        self._segment_start_time = time()
+
+        thread = Thread(target=self._compress_and_prune, args=(segment_path,))
+        thread.start()
+
+        self._compress_threads = [t for t in self._compress_threads
+                                  if t.is_alive()]
+        self._compress_threads.append(thread)
+
+    def wait(self):
+        """Wait for any background compression to finish."""
+
+        for thread in self._compress_threads:
+            thread.join()
+
+        self._compress_threads = []
+
+    def _compress_and_prune(self, segment_path):
+        # Compress a rotated segment, then remove the oldest compressed
+        # segments beyond backup_count. Runs in a background thread, so
+        # errors are printed rather than raised, the same as logging errors.
+
+        compressed_path = segment_path + '.gz'
+        temp_path = compressed_path + '.tmp'
+
+        try:
+            mode = os.stat(segment_path).st_mode & 0o777
+
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         mode)
+
+            with open(segment_path, 'rb') as source, \
+                    open(fd, 'wb') as raw_dest, \
+                    gzip.GzipFile(fileobj=raw_dest, mode='wb') as dest:
+                shutil.copyfileobj(source, dest)
+
+            os.rename(temp_path, compressed_path)
+            os.remove(segment_path)
+        except OSError as e:
+            print('ERROR COMPRESSING LOG {0}: {1}'.format(segment_path, e))
+            return
+
+        self._prune()
+
+    def _prune(self):
+        # Remove the oldest compressed segments so that at most backup_count
+        # remain
+
+        log_dir_path, log_filename = os.path.split(self.log_file_path)
+        prefix = log_filename + '.'
+
+        try:
+            segment_filenames = sorted(
+                filename for filename in os.listdir(log_dir_path or '.')
+                if filename.startswith(prefix) and filename.endswith('.gz')
+            )
+
+            # timestamped names sort oldest first
+            excess_count = len(segment_filenames) - self.backup_count
+
+            for filename in segment_filenames[:max(0, excess_count)]:
+                os.remove(os.path.join(log_dir_path, filename))
+        except OSError as e:
+            print('ERROR PRUNING LOGS {0}: {1}'.format(self.log_file_path, e))
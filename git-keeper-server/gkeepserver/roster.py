@@ -0,0 +1,175 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Provides a globally accessible cache of the faculty members and of the
+students in each class, so that event handlers and threads do not parse the
+CSV files every time they need to look someone up.
+
+The faculty CSV file and each class's student CSV file are parsed the first
+time they are needed, and again whenever the file's fingerprint (see
+gkeepserver.info_cache) changes. Handlers that replace a class's CSV file
+also invalidate the class explicitly.
+
+Usage:
+
+    from gkeepserver.roster import roster
+
+    faculty = roster.faculty(faculty_username)
+    students = roster.class_students(faculty_username, class_name)
+
+All methods are thread safe.
+"""
+
+from gkeepcore.faculty import FacultyError, faculty_from_csv_file
+from gkeepcore.local_csv_files import LocalCSVReader
+from gkeepcore.path_utils import class_student_csv_path, user_home_dir
+from gkeepcore.student import StudentError
+from gkeepserver.info_cache import FingerprintCache
+from gkeepserver.server_configuration import config
+from gkeepserver.students_and_classes import get_class_students
+
+
+class Roster:
+    """
+    Caches Faculty objects by username and Student objects by class and
+    username.
+
+    Errors reading or parsing the CSV files are raised as CSVError,
+    FacultyError, or StudentError, just as when reading the files directly,
+    and nothing is cached.
+    """
+
+    def __init__(self):
+        """Create an empty cache."""
+
+        # values are dictionaries mapping usernames to Faculty or Student
+        # objects, keyed by 'faculty' or by ('class', faculty username,
+        # class name)
+        self._cache = FingerprintCache()
+
+    def faculty(self, username: str):
+        """
+        Get the faculty member with the given username.
+
+        Raises FacultyError if there is no such faculty member.
+
+        :param username: username of the faculty member
+        :return: Faculty object
+        """
+
+        faculty_by_username = self._faculty_by_username()
+
+        try:
+            return faculty_by_username[username]
+        except KeyError:
+            raise FacultyError('{0} not found'.format(username))
+
+    def all_faculty(self) -> list:
+        """
+        Get all the faculty members.
+
+        :return: list of Faculty objects
+        """
+
+        return list(self._faculty_by_username().values())
+
+    def class_students(self, faculty_username: str, class_name: str) -> list:
+        """
+        Get the students in a class, in the order of the class's CSV file.
+
+        :param faculty_username: username of the faculty member who owns the
+         class
+        :param class_name: name of the class
+        :return: list of Student objects
+        """
+
+        return list(self._students_by_username(faculty_username,
+                                               class_name).values())
+
+    def student(self, faculty_username: str, class_name: str,
+                username: str):
+        """
+        Get a student in a class.
+
+        Raises StudentError if the student is not in the class.
+
+        :param faculty_username: username of the faculty member who owns the
+         class
+        :param class_name: name of the class
+        :param username: username of the student
+        :return: Student object
+        """
+
+        students_by_username = self._students_by_username(faculty_username,
+                                                          class_name)
+
+        try:
+            return students_by_username[username]
+        except KeyError:
+            raise StudentError('{0} not found'.format(username))
+
+    def invalidate_faculty(self):
+        """
+        Discard the cached faculty members, for use after the faculty CSV
+        file is replaced.
+        """
+
+        self._cache.invalidate('faculty')
+
+    def invalidate_class(self, faculty_username: str, class_name: str):
+        """
+        Discard the cached students of a class, for use after the class's
+        CSV file is replaced.
+
+        :param faculty_username: username of the faculty member who owns the
+         class
+        :param class_name: name of the class
+        """
+
+        self._cache.invalidate(('class', faculty_username, class_name))
+
+    def _faculty_by_username(self):
+        # Get the dictionary of faculty members, parsing the CSV file if it
+        # has changed
+
+        def compute():
+            reader = LocalCSVReader(config.faculty_csv_path)
+
+            return {faculty.username: faculty
+                    for faculty in faculty_from_csv_file(reader)}
+
+        return self._cache.get('faculty', [config.faculty_csv_path],
+                               compute)
+
+    def _students_by_username(self, faculty_username, class_name):
+        # Get the dictionary of students in a class, parsing the CSV file if
+        # it has changed
+
+        csv_path = class_student_csv_path(class_name,
+                                          user_home_dir(faculty_username))
+
+        def compute():
+            students = get_class_students(faculty_username, class_name)
+
+            return {student.username: student for student in students}
+
+        return self._cache.get(('class', faculty_username, class_name),
+                               [csv_path], compute)
+
+
+# module-level instance for global access
+roster = Roster()
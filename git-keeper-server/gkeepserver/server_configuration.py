@@ -56,9 +56,39 @@ Attributes:
     faculty_group - group that all faculty accounts belong to
     student_group - group that all student accounts belong to
 
+    temp_dir_path - directory for temporary files, kept in the home
+     directory because the privileged helper may not touch the system
+     temporary directory
+
     log_file_path - path to system log
     log_snapshot_file_path - path to file containing current log file sizes
     log_level - how detailed the log messages should be
+    log_fsync - when to flush the system log to disk: never (leave it to the
+     operating system), always (after every write), or a number of seconds
+     to wait between flushes
+    log_format - text for the traditional log format or json for one JSON
+     object per line
+    log_max_bytes - rotate the system log when it grows past this many bytes,
+     0 to never rotate based on size
+    log_rotate_interval - rotate the system log after this many seconds, 0 to
+     never rotate based on time
+    log_backup_count - number of rotated, compressed system logs to keep
+    log_compaction_interval - seconds between checks for event logs and
+     gkeepd.log files to compact, 0 to never compact logs
+    log_compaction_min_bytes - only compact logs that are at least this many
+     bytes
+    log_replay_missed_events - if true, resume reading event logs where the
+     previous run of gkeepd stopped, so that events written while gkeepd was
+     not running are handled. If false (the default), reading starts at the
+     end of each log and those events are ignored
+    info_refresh_debounce - seconds to wait for further changes before
+     refreshing a faculty member's info, 0 to refresh right away
+    info_refresh_max_staleness - maximum seconds that further changes can
+     delay a refresh
+    info_refresh_thread_count - number of threads that read repositories
+     concurrently while refreshing info
+    info_compression - gzip to compress the per-class partitions of the info,
+     or none
 
     faculty_csv_path - path to file containing faculty members
     faculty_log_dir_path - path to directory containing faculty event logs
@@ -72,6 +102,28 @@ Attributes:
     smtp_port - SMTP server port
     email_username - username for the SMTP server
     email_password - password for the SMTP server
+    smtp_session_pooling - if True, send many emails over one SMTP connection
+    smtp_idle_timeout - seconds before an unused SMTP connection is closed
+    smtp_max_messages_per_connection - messages sent before reconnecting
+    email_send_rate - maximum emails sent per second
+    email_send_burst - number of emails that may be sent at once before the
+     rate limit applies
+    email_domain_limits - per recipient domain rate limits, as a comma
+     separated list of domain:rate:burst entries, parsed into a dictionary
+     which maps domains to (rate, burst) tuples
+    email_outbox_path - path to directory where queued emails are stored until
+     they are sent, created if it does not exist. ~ is expanded, and the
+     directory containing it must exist
+    email_retry_base_delay - seconds to wait before retrying a failed email,
+     doubled for each further attempt
+    email_retry_max_delay - maximum seconds to wait before retrying an email
+    email_circuit_failure_threshold - consecutive failures to reach the SMTP
+     server before sending is paused
+    email_circuit_cooldown - seconds to pause sending before trying the SMTP
+     server again
+    email_sender_count - number of threads sending emails concurrently
+    email_coalesce_window - seconds to hold related emails to the same address
+     so they can be combined into one digest, 0 to disable
 
 """
 
@@ -161,6 +213,9 @@ class ServerConfiguration:
         self.run_action_sh_file_path = os.path.join(self.home_dir,
                                                     'run_action.sh')
 
+        # temporary files
+        self.temp_dir_path = os.path.join(self.home_dir, 'tmp')
+
         # logging
         self.log_file_path = os.path.join(self.home_dir, 'gkeepd.log')
 
@@ -168,6 +223,20 @@ class ServerConfiguration:
         self.log_snapshot_file_path = os.path.join(self.home_dir,
                                                    log_snapshot_filename)
         self.log_level = LogLevel.DEBUG
+        self.log_fsync = 'never'
+        self.log_format = 'text'
+        self.log_max_bytes = 0
+        self.log_rotate_interval = 0
+        self.log_backup_count = 5
+        self.log_compaction_interval = 0
+        self.log_compaction_min_bytes = 1048576
+        self.log_replay_missed_events = False
+
+        # info refresh
+        self.info_refresh_debounce = 2
+        self.info_refresh_max_staleness = 10
+        self.info_refresh_thread_count = 4
+        self.info_compression = 'gzip'
 
         # faculty info locations
         self.faculty_csv_path = os.path.join(self.home_dir, 'faculty.csv')
@@ -182,9 +251,22 @@ class ServerConfiguration:
         self.student_group = 'student'
 
         # email
+        self.email_outbox_path = os.path.join(self.home_dir, 'outbox')
         self.use_tls = True
         self.email_username = None
         self.email_password = None
+        self.smtp_session_pooling = True
+        self.smtp_idle_timeout = 60
+        self.smtp_max_messages_per_connection = 100
+        self.email_send_rate = 0.5
+        self.email_send_burst = 1
+        self.email_domain_limits = {}
+        self.email_retry_base_delay = 30
+        self.email_retry_max_delay = 3600
+        self.email_circuit_failure_threshold = 5
+        self.email_circuit_cooldown = 60
+        self.email_coalesce_window = 0
+        self.email_sender_count = 1
 
     def _parse_config_file(self):
         # Use a ConfigParser object to parse the configuration file and store
@@ -225,7 +307,20 @@ class ServerConfiguration:
         optional_options = [
             'use_tls',
             'email_username',
-            'email_password'
+            'email_password',
+            'smtp_session_pooling',
+            'smtp_idle_timeout',
+            'smtp_max_messages_per_connection',
+            'email_send_rate',
+            'email_send_burst',
+            'email_domain_limits',
+            'email_retry_base_delay',
+            'email_retry_max_delay',
+            'email_circuit_failure_threshold',
+            'email_circuit_cooldown',
+            'email_coalesce_window',
+            'email_sender_count',
+            'email_outbox_path'
         ]
 
         for name in optional_options:
@@ -236,18 +331,70 @@ class ServerConfiguration:
                 value = self._parser.get('email', name)
                 setattr(self, name, value)
 
-        # use_tls must be true or false
-        if isinstance(self.use_tls, str):
-            if self.use_tls.lower() == 'true':
-                self.use_tls = True
-            elif self.use_tls.lower() == 'false':
-                self.use_tls = False
-            else:
-                error = 'use_tls must be true or false'
-                raise ServerConfigurationError(error)
+        # use_tls and smtp_session_pooling must be true or false
+        for name in ('use_tls', 'smtp_session_pooling'):
+            self._convert_boolean_option(name)
+
+        try:
+            self.smtp_idle_timeout = float(self.smtp_idle_timeout)
+        except ValueError:
+            error = 'smtp_idle_timeout must be a number'
+            raise ServerConfigurationError(error)
+
+        self._convert_positive_integer_option(
+            'smtp_max_messages_per_connection')
+
+        self._convert_positive_number_option('email_send_rate')
+        self._convert_positive_integer_option('email_send_burst')
+
+        if isinstance(self.email_domain_limits, str):
+            self.email_domain_limits = \
+                self._parse_email_domain_limits(self.email_domain_limits)
+
+        self._convert_positive_number_option('email_retry_base_delay')
+        self._convert_positive_number_option('email_retry_max_delay')
+        self._convert_positive_integer_option(
+            'email_circuit_failure_threshold')
+        self._convert_positive_number_option('email_circuit_cooldown')
+
+        self._convert_positive_integer_option('email_sender_count')
+
+        self._convert_non_negative_number_option('email_coalesce_window')
+
+        self._convert_path_option('email_outbox_path')
 
         self._ensure_options_are_valid('email')
 
+    def _parse_email_domain_limits(self, value):
+        # Parse a string of the form domain:rate:burst, domain:rate:burst
+        # into a dictionary mapping domains to (rate, burst) tuples
+
+        limits = {}
+
+        for entry in value.split(','):
+            entry = entry.strip()
+
+            if entry == '':
+                continue
+
+            try:
+                domain, rate, burst = entry.split(':')
+                rate = float(rate)
+                burst = int(burst)
+            except ValueError:
+                error = ('email_domain_limits entries must look like '
+                         'domain:rate:burst, not {0}'.format(entry))
+                raise ServerConfigurationError(error)
+
+            if rate <= 0 or burst < 1:
+                error = ('email_domain_limits rate and burst must be greater '
+                         'than 0: {0}'.format(entry))
+                raise ServerConfigurationError(error)
+
+            limits[domain.lower()] = (rate, burst)
+
+        return limits
+
     def _set_server_options(self):
         self._ensure_section_is_present('server')
 
@@ -268,7 +415,19 @@ class ServerConfiguration:
             'keeper_user',
             'keeper_group',
             'faculty_group',
-            'student_group'
+            'student_group',
+            'log_fsync',
+            'log_format',
+            'log_max_bytes',
+            'log_rotate_interval',
+            'log_backup_count',
+            'log_compaction_interval',
+            'log_compaction_min_bytes',
+            'log_replay_missed_events',
+            'info_refresh_debounce',
+            'info_refresh_max_staleness',
+            'info_refresh_thread_count',
+            'info_compression'
         ]
 
         for name in optional_options:
@@ -286,8 +445,119 @@ class ServerConfiguration:
             error = 'test_thread_count must be an integer'
             raise ServerConfigurationError(error)
 
+        if self.log_fsync not in ('never', 'always'):
+            try:
+                self._convert_positive_number_option('log_fsync')
+            except ServerConfigurationError:
+                error = ('log_fsync must be never, always, or a number of '
+                         'seconds')
+                raise ServerConfigurationError(error)
+
+        if self.log_format not in ('text', 'json'):
+            error = 'log_format must be text or json'
+            raise ServerConfigurationError(error)
+
+        if self.info_compression not in ('none', 'gzip'):
+            error = 'info_compression must be none or gzip'
+            raise ServerConfigurationError(error)
+
+        for name in ('log_max_bytes', 'log_rotate_interval',
+                     'log_compaction_interval', 'log_compaction_min_bytes',
+                     'info_refresh_debounce', 'info_refresh_max_staleness'):
+            self._convert_non_negative_number_option(name)
+
+        self.log_max_bytes = int(self.log_max_bytes)
+        self.log_compaction_min_bytes = int(self.log_compaction_min_bytes)
+
+        self._convert_positive_integer_option('log_backup_count')
+        self._convert_positive_integer_option('info_refresh_thread_count')
+
+        self._convert_boolean_option('log_replay_missed_events')
+
         self._ensure_options_are_valid('gkeepd')
 
+    def _convert_boolean_option(self, name):
+        # Convert an option that was read as a string to a boolean. The string
+        # must be true or false, in any case.
+
+        value = getattr(self, name)
+
+        if isinstance(value, str):
+            if value.lower() == 'true':
+                setattr(self, name, True)
+            elif value.lower() == 'false':
+                setattr(self, name, False)
+            else:
+                error = '{0} must be true or false'.format(name)
+                raise ServerConfigurationError(error)
+
+    def _convert_path_option(self, name):
+        # Expand ~ in a path option and make sure the path is absolute and
+        # that the directory containing it exists
+
+        path = os.path.expanduser(getattr(self, name))
+
+        if not os.path.isabs(path):
+            error = '{0} must be an absolute path'.format(name)
+            raise ServerConfigurationError(error)
+
+        parent_path = os.path.dirname(os.path.normpath(path))
+
+        if not os.path.isdir(parent_path):
+            error = ('{0}: directory {1} does not exist'
+                     .format(name, parent_path))
+            raise ServerConfigurationError(error)
+
+        setattr(self, name, path)
+
+    def _convert_positive_number_option(self, name):
+        # Convert an option that was read as a string to a float greater than
+        # 0
+
+        try:
+            value = float(getattr(self, name))
+        except ValueError:
+            error = '{0} must be a number'.format(name)
+            raise ServerConfigurationError(error)
+
+        if value <= 0:
+            error = '{0} must be greater than 0'.format(name)
+            raise ServerConfigurationError(error)
+
+        setattr(self, name, value)
+
+    def _convert_non_negative_number_option(self, name):
+        # Convert an option that was read as a string to a float that is 0 or
+        # greater
+
+        try:
+            value = float(getattr(self, name))
+        except ValueError:
+            error = '{0} must be a number'.format(name)
+            raise ServerConfigurationError(error)
+
+        if value < 0:
+            error = '{0} must not be negative'.format(name)
+            raise ServerConfigurationError(error)
+
+        setattr(self, name, value)
+
+    def _convert_positive_integer_option(self, name):
+        # Convert an option that was read as a string to an integer greater
+        # than 0
+
+        try:
+            value = int(getattr(self, name))
+        except ValueError:
+            error = '{0} must be an integer'.format(name)
+            raise ServerConfigurationError(error)
+
+        if value < 1:
+            error = '{0} must be greater than 0'.format(name)
+            raise ServerConfigurationError(error)
+
+        setattr(self, name, value)
+
     def _ensure_options_are_valid(self, section):
         # all section's options must exist as attributes
 
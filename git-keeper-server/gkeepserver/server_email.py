@@ -19,9 +19,17 @@ Provides an Email class for storing and sending emails.
 
 Supports file attachments and truncating long messages.
 
+The MIME message is not built until the email is sent, so a queued email only
+holds its body text. Emails sent to many recipients with the same body, such
+as new assignment announcements, can share one SharedEmailBody so that the
+body is read and normalized once rather than copied for every recipient.
+
 Emails should not be sent directly, but rather enqueued in the global
 EmailSenderThread which provides rate limiting.
 
+Also provides SMTPSession, which keeps a connection to the SMTP server open so
+that many emails can be sent over a single connection.
+
 """
 
 import os
@@ -29,7 +37,9 @@ from email.header import Header
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from smtplib import SMTP
+from hashlib import sha256
+from smtplib import SMTP, SMTPServerDisconnected
+from time import time
 
 from gkeepcore.gkeep_exception import GkeepException
 from gkeepserver.server_configuration import config
@@ -40,26 +50,196 @@ class EmailException(GkeepException):
     pass
 
 
+def connect_to_smtp_server() -> SMTP:
+    """
+    Connect and log in to the SMTP server.
+
+    Uses the global ServerConfiguration object to obtain SMTP server
+    information.
+
+    :return: a connected SMTP object
+    """
+
+    server = SMTP(config.smtp_server, config.smtp_port)
+    server.ehlo()
+
+    if config.use_tls:
+        server.starttls()
+
+    if config.email_username and config.email_password:
+        server.login(config.email_username, config.email_password)
+
+    return server
+
+
+class SMTPSession:
+    """
+    Keeps a connection to the SMTP server open so that many emails can be sent
+    without connecting, starting TLS, and logging in for each one.
+
+    The connection is opened when the first message is sent. It is closed and
+    reopened after max_messages messages have been sent over it, and it is
+    closed if it sits idle for idle_timeout seconds. If the server has dropped
+    the connection, sending reconnects and tries once more.
+
+    A session is not thread safe. Each thread that sends email should use its
+    own session.
+    """
+    def __init__(self, idle_timeout=60, max_messages=100):
+        """
+        Create the session without connecting.
+
+        :param idle_timeout: number of seconds a connection may sit unused
+         before close_if_idle() closes it
+        :param max_messages: maximum number of messages to send over a single
+         connection
+        """
+
+        self._idle_timeout = idle_timeout
+        self._max_messages = max_messages
+
+        self._server = None
+        self._message_count = 0
+        self._last_used_time = 0
+
+    def is_connected(self) -> bool:
+        """
+        Determine if the session currently has an open connection.
+
+        :return: True if connected, False otherwise
+        """
+
+        return self._server is not None
+
+    def send(self, to_address: str, message_string: str):
+        """
+        Send a message, connecting first if need be.
+
+        Raises any exceptions raised by smtplib. The connection is closed
+        after any error so that the next message starts with a fresh one.
+
+        :param to_address: the address to send the message to
+        :param message_string: the full message as a string
+        """
+
+        if self._message_count >= self._max_messages:
+            self.close()
+
+        try:
+            try:
+                self._sendmail(to_address, message_string)
+            except SMTPServerDisconnected:
+                # the server may have timed out an old connection
+                self.close()
+                self._sendmail(to_address, message_string)
+        except Exception:
+            self.close()
+            raise
+
+        self._message_count += 1
+        self._last_used_time = time()
+
+    def close_if_idle(self):
+        """
+        Close the connection if it has not been used for idle_timeout seconds.
+        """
+
+        if (self._server is not None and
+                time() - self._last_used_time >= self._idle_timeout):
+            self.close()
+
+    def close(self):
+        """Close the connection if it is open."""
+
+        if self._server is None:
+            return
+
+        try:
+            self._server.quit()
+        except Exception:
+            # the connection may already be gone, which is fine
+            pass
+
+        self._server = None
+        self._message_count = 0
+
+    def _sendmail(self, to_address, message_string):
+        # Connect if need be and send the message
+
+        if self._server is None:
+            self._server = connect_to_smtp_server()
+            self._message_count = 0
+
+        self._server.sendmail(config.from_address, to_address, message_string)
+
+
+def _normalize_body(body) -> str:
+    # Represent a body given as a string or list of strings as a single string
+    # with trailing whitespace removed from each line and \r\n newlines
+
+    if isinstance(body, list):
+        body_lines = []
+
+        for line in body:
+            if not isinstance(line, str):
+                raise EmailException('Email body lines must be strings')
+
+            body_lines.append(line.rstrip())
+    elif isinstance(body, str):
+        body_lines = [line.rstrip() for line in body.split('\n')]
+    else:
+        error = 'Email body must be a string or a list of strings'
+        raise EmailException(error)
+
+    return '\r\n'.join(body_lines)
+
+
+class SharedEmailBody:
+    """
+    Body text that is shared by many emails.
+
+    The text is normalized once when the object is created, and each Email
+    that includes it stores a reference rather than a copy. The digest
+    identifies the text, so that the outbox can store it once for all of
+    the emails.
+    """
+    def __init__(self, body):
+        """
+        :param body: the body as a string or list of strings
+        """
+
+        self.text = _normalize_body(body)
+        self.digest = sha256(self.text.encode()).hexdigest()
+
+    def __len__(self):
+        return len(self.text)
+
+
 class Email:
     """
     Builds an email that can be sent using smtplib and provides a method
     to send the email.
     """
     def __init__(self, to_address, subject, body, files_to_attach=None,
-                 max_character_count=1000000):
+                 max_character_count=1000000, coalesce_key=None):
         """
         Construct an email object.
 
         The body may be a single string or a list of strings. If the body is a
         list of strings, the final email message body will be each of those
-        strings joined together by newlines.
+        strings joined together by newlines. A SharedEmailBody may be used in
+        place of a string, either on its own or as an element of the list.
 
         :param to_address: the email address to send the email to
         :param subject: the subject of the email
-        :param body: the body of the email as a string or list of strings
+        :param body: the body of the email as a string, SharedEmailBody, or
+         list of strings and SharedEmailBody objects
         :param files_to_attach: a list of file paths to attach to the email
         :param max_character_count: if the email is longer than this number of
          characters it will be truncated
+        :param coalesce_key: if not None, emails to the same address with the
+         same key may be combined into one digest email (see email_coalescer).
+         Ignored for emails with attachments.
         """
 
         self._send_attempts = 0
@@ -69,46 +249,98 @@ class Email:
         self.to_address = to_address
 
         self._subject = subject
-        self._files_to_attach = files_to_attach
 
-        # regardless of how the body is passed in, represent it by a list of
-        # lines that have trailing whitespace removed
-        if isinstance(body, list):
-            body_lines = []
+        # attachments are read when the message is built, but make sure they
+        # exist now so that errors are raised by the constructor
+        for file_path in files_to_attach or []:
+            if not os.path.isfile(file_path):
+                raise EmailException('{0} is not a file'.format(file_path))
 
-            for line in body:
-                if not isinstance(line, str):
-                    raise EmailException('Email body lines must be strings')
+        self._files_to_attach = files_to_attach
+
+        if files_to_attach:
+            self.coalesce_key = None
+        else:
+            self.coalesce_key = coalesce_key
 
-                body_lines.append(line.rstrip())
-        elif isinstance(body, str):
-            body_lines = [line.rstrip() for line in body.split('\n')]
+        # regardless of how the body is passed in, represent it by a list of
+        # parts which are joined by newlines when the message is built. Each
+        # part is a normalized string or a SharedEmailBody.
+        if isinstance(body, SharedEmailBody):
+            self._body_parts = [body]
+        elif isinstance(body, list):
+            self._body_parts = []
+
+            for part in body:
+                if isinstance(part, SharedEmailBody):
+                    self._body_parts.append(part)
+                else:
+                    self._body_parts.append(_normalize_body([part]))
         else:
-            error = 'Email body must be a string or a list of strings'
-            raise EmailException(error)
+            self._body_parts = [_normalize_body(body)]
 
-        # the final message body needs to have \r\n newlines
-        self._body = '\r\n'.join(body_lines)
+        body_length = (sum(len(part) for part in self._body_parts) +
+                       2 * (len(self._body_parts) - 1))
 
         # truncate the email with a message if need be
-        if len(self._body) > max_character_count:
-            self._body = self._body[:max_character_count].rstrip()
-            self._body += '\r\n\r\n'
+        if body_length > max_character_count:
+            truncated_body = self.body[:max_character_count].rstrip()
+            truncated_body += '\r\n\r\n'
 
-            self._body += ('ATTENTION: This email was truncated due to its '
-                           'long length. If important information seems '
-                           'missing, contact your instructor.\r\n')
+            truncated_body += ('ATTENTION: This email was truncated due to '
+                               'its long length. If important information '
+                               'seems missing, contact your instructor.\r\n')
 
-        self._build_mime_message(files_to_attach)
+            self._body_parts = [truncated_body]
 
     def __repr__(self):
         repr_string = 'To: {0}, Subject: {1}'.format(self.to_address,
                                                      self._subject)
         return repr_string
 
-    def _build_mime_message(self, files_to_attach):
+    @property
+    def subject(self) -> str:
+        """The subject of the email."""
+        return self._subject
+
+    @property
+    def body(self) -> str:
+        """The body of the email, with CRLF newlines."""
+        return '\r\n'.join(part.text if isinstance(part, SharedEmailBody)
+                            else part for part in self._body_parts)
+
+    @property
+    def body_parts(self) -> list:
+        """
+        The parts of the body, which are joined by newlines. Each part is a
+        string or a SharedEmailBody.
+        """
+        return self._body_parts
+
+    @property
+    def files_to_attach(self) -> list:
+        """Paths of the files to attach, or None."""
+        return self._files_to_attach
+
+    @property
+    def send_attempts(self) -> int:
+        """The number of times sending has been attempted."""
+        return self._send_attempts
+
+    @property
+    def message_string(self) -> str:
+        """
+        The full MIME message as a string.
+
+        The message is built each time this is accessed, so it should only be
+        accessed when sending.
+        """
+
+        return self._build_mime_message(self.body, self._files_to_attach)
+
+    def _build_mime_message(self, body, files_to_attach):
         # Create the final message by building up a MIMEMultipart object and
-        # then storing the final message as a string in _message_string
+        # then return the final message as a string
 
         # encode headers
         from_header = Header('{0}'.format(config.from_name), 'utf-8')
@@ -125,13 +357,10 @@ class Email:
         message['reply-to'] = reply_to_header
 
         # attach the body
-        message.attach(MIMEText(self._body, _charset='utf-8'))
+        message.attach(MIMEText(body, _charset='utf-8'))
 
         # attach any files
         for file_path in files_to_attach or []:
-            if not os.path.isfile(file_path):
-                raise EmailException('{0} is not a file'.format(file_path))
-
             filename = os.path.basename(file_path)
             content_disposition = 'attachment; filename="{0}"'.format(filename)
 
@@ -145,8 +374,8 @@ class Email:
             except OSError as e:
                 raise EmailException('Error reading {0}: {1}'.format(file_path,
                                                                      e))
-        # the final message is stored as a single string
-        self.message_string = message.as_string()
+
+        return message.as_string()
 
     def max_send_attempts_reached(self) -> bool:
         """
@@ -159,7 +388,7 @@ class Email:
 
         return self._send_attempts >= self._max_send_attempts
 
-    def send(self):
+    def send(self, smtp_session=None):
         """
         Send the email right now.
 
@@ -169,19 +398,18 @@ class Email:
         Uses the global ServerConfiguration object to obtain SMTP server
         information.
 
+        :param smtp_session: SMTPSession to send the email over, or None to
+         open a connection just for this email
         """
 
         self._send_attempts += 1
 
-        server = SMTP(config.smtp_server, config.smtp_port)
-        server.ehlo()
-
-        if config.use_tls:
-            server.starttls()
+        message_string = self.message_string
 
-        if config.email_username and config.email_password:
-            server.login(config.email_username, config.email_password)
+        if smtp_session is not None:
+            smtp_session.send(self.to_address, message_string)
+            return
 
-        server.sendmail(config.from_address, self.to_address,
-                        self.message_string)
+        server = connect_to_smtp_server()
+        server.sendmail(config.from_address, self.to_address, message_string)
         server.quit()
@@ -17,23 +17,71 @@
 """
 Provides a class for storing student submission information and running tests
 on the submission.
+
+A tests directory may opt in to running its tests in parallel shards by
+containing a file named shards which holds the number of shards. Each shard
+runs in its own workspace and action.sh is called with two extra arguments:
+
+    action.sh <assignment path> --shard <shard number>/<shard count>
+
+Shard numbers start at 1. The outputs of the shards are joined in shard order
+to build the report and the email sent to the student.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from time import strftime
 from tempfile import TemporaryDirectory
 
+from gkeepcore.gkeep_exception import GkeepException
 from gkeepcore.student import Student
 from gkeepserver.gkeepd_logger import gkeepd_logger as logger
 from gkeepcore.git_commands import git_clone, git_add_all, git_commit, git_push
 from gkeepcore.system_commands import cp, sudo_chown
-from gkeepcore.shell_command import run_command_in_directory
+from gkeepcore.shell_command import run_command_with_result
 from gkeepserver.email_sender_thread import email_sender
 from gkeepserver.server_configuration import config
 from gkeepserver.server_email import Email
 from gkeepcore.path_utils import parse_submission_repo_path
 
 
+class ShardCountError(GkeepException):
+    """Raised if the shards file in a tests directory is not valid."""
+    pass
+
+
+def tests_shard_count(tests_path: str) -> int:
+    """
+    Get the number of shards that a tests directory declares.
+
+    A tests directory that does not contain a shards file has 1 shard.
+
+    Raises ShardCountError if the shards file does not contain a positive
+    integer.
+
+    :param tests_path: path to the tests directory
+    :return: number of shards
+    """
+
+    shards_file_path = os.path.join(tests_path, 'shards')
+
+    if not os.path.isfile(shards_file_path):
+        return 1
+
+    try:
+        with open(shards_file_path) as f:
+            shard_count = int(f.read().strip())
+    except (OSError, ValueError) as e:
+        raise ShardCountError('Error reading {0}: {1}'
+                              .format(shards_file_path, e))
+
+    if shard_count < 1:
+        raise ShardCountError('{0} must contain a positive integer'
+                              .format(shards_file_path))
+
+    return shard_count
+
+
 class Submission:
     """
     Stores student submission information and allows test running.
@@ -74,23 +122,18 @@ class Submission:
         working_dir = TemporaryDirectory()
         temp_path = working_dir.name
 
-        # check out the student repo in the temp dir
-        git_clone(self.student_repo_path, temp_path)
-
-        # copy the tests - this creates a test folder inside the temp dir...
-        cp(self.tests_path, temp_path, recursive=True)
-        temp_tests_path = os.path.join(temp_path, 'tests')
-
         faculty_username, class_name, assignment_name = \
             parse_submission_repo_path(self.student_repo_path)
 
-        temp_assignment_path = os.path.join(temp_path, assignment_name)
-
         # execute action.sh and capture the output
         try:
-            cmd = ['bash', config.run_action_sh_file_path,
-                   temp_assignment_path]
-            body = run_command_in_directory(temp_tests_path, cmd)
+            shard_count = tests_shard_count(self.tests_path)
+
+            if shard_count == 1:
+                body = self._run_action_sh(temp_path, assignment_name)
+            else:
+                body = self._run_action_sh_shards(assignment_name,
+                                                  shard_count)
 
             # The following version of running action.sh uses docker
             # cmd = 'docker run -it -v '
@@ -101,8 +144,10 @@ class Submission:
             # send output as email
             subject = ('[{0}] {1} submission test results'
                        .format(class_name, assignment_name))
+            coalesce_key = 'results {0} {1}'.format(class_name,
+                                                     assignment_name)
             email_sender.enqueue(Email(self.student.email_address, subject,
-                                       body))
+                                       body, coalesce_key=coalesce_key))
 
             if self.student.username != faculty_username:
                 # put the report file into the reports repo
@@ -131,14 +176,69 @@ class Submission:
                 sudo_chown(self.reports_repo_path, faculty_username,
                            config.keeper_group, recursive=True)
         except Exception as e:
-            report_failure(assignment_name, self.student,
+            report_failure(class_name, assignment_name, self.student,
                            self.faculty_email, str(e))
 
         logger.log_debug('Done running tests on {0}'
                          .format(self.student_repo_path))
 
+    def _run_action_sh(self, temp_path, assignment_name, shard=None):
+        # Check out the student repo and copy the tests into temp_path, run
+        # action.sh, and return its output.
+        #
+        # shard is None or a (shard number, shard count) tuple
+
+        # check out the student repo in the temp dir
+        git_clone(self.student_repo_path, temp_path)
+
+        # copy the tests - this creates a test folder inside the temp dir...
+        cp(self.tests_path, temp_path, recursive=True)
+        temp_tests_path = os.path.join(temp_path, 'tests')
+
+        temp_assignment_path = os.path.join(temp_path, assignment_name)
+
+        cmd = ['bash', config.run_action_sh_file_path, temp_assignment_path]
 
-def report_failure(assignment, student, faculty_email, message):
+        if shard is not None:
+            cmd += ['--shard', '{0}/{1}'.format(*shard)]
+
+        # tests may legitimately take a long time, so there is no timeout
+        result = run_command_with_result(cmd, cwd=temp_tests_path,
+                                         timeout=None)
+
+        logger.log_debug('action.sh for {0} took {1:.2f}s, {2:.2f}s user CPU, '
+                         '{3:.2f}s system CPU, {4} KB max RSS'
+                         .format(self.student_repo_path, result.wall_time,
+                                 result.user_time, result.system_time,
+                                 result.max_rss))
+
+        return result.output
+
+    def _run_action_sh_shards(self, assignment_name, shard_count):
+        # Run each shard of action.sh in its own workspace, in parallel, and
+        # return the outputs joined in shard order.
+
+        def run_shard(shard_number):
+            with TemporaryDirectory() as shard_temp_path:
+                return self._run_action_sh(shard_temp_path, assignment_name,
+                                           (shard_number, shard_count))
+
+        logger.log_debug('Running {0} shards on {1}'
+                         .format(shard_count, self.student_repo_path))
+
+        worker_count = min(shard_count, os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            # map() yields the results in shard order, and re-raises the
+            # exception of the first shard that failed
+            outputs = list(executor.map(run_shard,
+                                        range(1, shard_count + 1)))
+
+        return ''.join(output if output.endswith('\n') else output + '\n'
+                       for output in outputs)
+
+
+def report_failure(class_name, assignment, student, faculty_email, message):
 
     s_subject = ('{0}: Failed to process submission - contact instructor'
                  .format(assignment))
@@ -146,7 +246,10 @@ def report_failure(assignment, student, faculty_email, message):
               'This is likely your instructor\'s fault, not yours.',
               'Please contact your instructor about this error!']
 
-    email_sender.enqueue(Email(student.email_address, s_subject, s_body))
+    coalesce_key = 'failure {0} {1}'.format(class_name, assignment)
+
+    email_sender.enqueue(Email(student.email_address, s_subject, s_body,
+                               coalesce_key=coalesce_key))
 
     f_subject = 'git-keeper run_tests failure'
     f_body = ['student: {0} {1}'.format(student.first_name, student.last_name),
@@ -155,4 +258,5 @@ def report_failure(assignment, student, faculty_email, message):
               'further information:',
               message]
 
-    email_sender.enqueue(Email(faculty_email, f_subject, f_body))
+    email_sender.enqueue(Email(faculty_email, f_subject, f_body,
+                               coalesce_key=coalesce_key))
@@ -24,6 +24,7 @@ New submissions are pulled from the global new_submission_queue.
 from queue import Empty
 from threading import Thread
 from gkeepcore.gkeep_exception import GkeepException
+from gkeepcore.path_utils import parse_submission_repo_path
 from gkeepserver.gkeepd_logger import gkeepd_logger as logger
 from gkeepserver.info_refresh_thread import info_refresher
 from gkeepserver.new_submission_queue import new_submission_queue
@@ -71,10 +72,24 @@ class SubmissionTestThread(Thread):
                     submission = new_submission_queue.get(block=True,
                                                           timeout=0.1)
                     submission.run_tests()
-                    info_refresher.enqueue(submission.faculty_username)
+                    _enqueue_info_refresh(submission)
             # get() raises Empty when there is nothing in the queue after
             # timeout seconds
             except Empty:
                 pass
             except Exception as e:
                 logger.log_error('Error while running tests: {0}'.format(e))
+
+
+def _enqueue_info_refresh(submission):
+    # Request a refresh of just the submitting student's repository, or of
+    # everything if the repository path cannot be parsed
+
+    path_info = parse_submission_repo_path(submission.student_repo_path)
+
+    if path_info is None:
+        info_refresher.enqueue(submission.faculty_username)
+    else:
+        class_name, assignment_name = path_info[1:]
+        info_refresher.enqueue(submission.faculty_username, class_name,
+                               assignment_name, submission.student.username)
@@ -0,0 +1,168 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.email_coalescer."""
+
+from time import strftime, localtime
+
+import pytest
+
+from gkeepserver import email_coalescer
+from gkeepserver.email_coalescer import (EmailCoalescer, CoalescedEmail,
+                                         build_digest)
+from gkeepserver.server_email import Email
+
+
+class _Clock:
+    # Stands in for time.time() so that tests control the passing of time
+
+    def __init__(self):
+        self.current_time = 1500000000.0
+
+    def __call__(self):
+        return self.current_time
+
+    def advance(self, seconds):
+        self.current_time += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = _Clock()
+    monkeypatch.setattr(email_coalescer, 'time', fake_clock)
+
+    return fake_clock
+
+
+def _results_email(to_address, class_name, assignment_name, body):
+    # built like the test results emails in gkeepserver.submission
+    subject = '[{0}] {1} submission test results'.format(class_name,
+                                                         assignment_name)
+    coalesce_key = 'results {0} {1}'.format(class_name, assignment_name)
+
+    return Email(to_address, subject, body, coalesce_key=coalesce_key)
+
+
+def _add(coalescer, email):
+    coalescer.add(email, email, window=60)
+
+
+def test_emails_are_grouped_by_address_and_key(clock):
+    coalescer = EmailCoalescer()
+
+    first = _results_email('student@example.com', 'cs1', 'hw1', 'run 1')
+    second = _results_email('Student@Example.com', 'cs1', 'hw1', 'run 2')
+    other_assignment = _results_email('student@example.com', 'cs1', 'hw2',
+                                      'run 1')
+    other_class = _results_email('student@example.com', 'cs2', 'hw1',
+                                 'run 1')
+    other_student = _results_email('other@example.com', 'cs1', 'hw1',
+                                   'run 1')
+
+    for email in (first, other_assignment, other_class, other_student):
+        _add(coalescer, email)
+
+    clock.advance(30)
+    _add(coalescer, second)
+
+    assert len(coalescer) == 5
+
+    # nothing is ready until the window of the first email has passed
+    assert coalescer.pop_ready() == []
+
+    clock.advance(30)
+    groups = coalescer.pop_ready()
+
+    assert [[coalesced_email.email for coalesced_email in group]
+            for group in groups] == [[first, second], [other_assignment],
+                                     [other_class], [other_student]]
+    assert len(coalescer) == 0
+
+
+def test_failure_emails_are_not_combined_across_classes(clock):
+    coalescer = EmailCoalescer()
+
+    # the faculty email from report_failure in gkeepserver.submission, for
+    # two classes with an assignment of the same name
+    for class_name in ('cs1', 'cs2'):
+        _add(coalescer, Email('prof@example.com',
+                              'git-keeper run_tests failure', 'error',
+                              coalesce_key='failure {0} hw1'
+                              .format(class_name)))
+
+    groups = coalescer.pop_ready(force=True)
+
+    assert [len(group) for group in groups] == [1, 1]
+
+
+def test_force_pops_all_groups(clock):
+    coalescer = EmailCoalescer()
+
+    _add(coalescer, _results_email('student@example.com', 'cs1', 'hw1',
+                                   'run 1'))
+
+    assert len(coalescer.pop_ready(force=True)) == 1
+    assert coalescer.pop_ready(force=True) == []
+
+
+def test_email_with_attachment_has_no_key(tmp_path):
+    attachment_path = tmp_path / 'report.txt'
+    attachment_path.write_text('report')
+
+    email = Email('student@example.com', 'Subject', 'Body',
+                  files_to_attach=[str(attachment_path)],
+                  coalesce_key='results cs1 hw1')
+
+    assert email.coalesce_key is None
+
+
+def test_digest_formatting():
+    first = _results_email('student@example.com', 'cs1', 'hw1', 'run 1')
+    second = _results_email('student@example.com', 'cs1', 'hw1',
+                            ['run 2', 'line 2'])
+
+    first_time = 1500000000.0
+    second_time = first_time + 30
+
+    digest = build_digest([CoalescedEmail(first, first, first_time),
+                           CoalescedEmail(second, second, second_time)])
+
+    def timestamp(queued_time):
+        return strftime('%Y-%m-%d %H:%M:%S', localtime(queued_time))
+
+    assert digest.to_address == 'student@example.com'
+    assert digest.subject == \
+        '[cs1] hw1 submission test results (2 messages)'
+
+    expected_lines = [
+        '2 messages were combined into this email. The newest is first.',
+        '',
+        '===== [cs1] hw1 submission test results ({0}) ====='
+        .format(timestamp(second_time)),
+        '',
+        'run 2',
+        'line 2',
+        '',
+        '===== [cs1] hw1 submission test results ({0}) ====='
+        .format(timestamp(first_time)),
+        '',
+        'run 1',
+    ]
+
+    assert digest.body.splitlines() == expected_lines
+
+    # a digest is not coalesced again
+    assert digest.coalesce_key is None
@@ -0,0 +1,222 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.email_outbox."""
+
+import email
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from gkeepserver import email_outbox
+from gkeepserver.email_outbox import EmailOutbox
+from gkeepserver.server_configuration import config
+from gkeepserver.server_email import Email, SharedEmailBody
+
+
+@pytest.fixture(autouse=True)
+def _email_config(monkeypatch):
+    # building a message needs the sender from the configuration
+    monkeypatch.setattr(config, 'from_name', 'Keeper', raising=False)
+    monkeypatch.setattr(config, 'from_address', 'keeper@example.com',
+                        raising=False)
+
+
+class _Logger:
+    # stands in for the system logger, which needs a running thread
+
+    def log_debug(self, message):
+        pass
+
+    log_info = log_warning = log_error = log_debug
+
+
+@pytest.fixture(autouse=True)
+def _logger(monkeypatch):
+    monkeypatch.setattr(email_outbox, 'logger', _Logger())
+
+
+def _message_body(message_string):
+    message = email.message_from_string(message_string)
+    text_part = message.get_payload()[0]
+
+    return text_part.get_payload(decode=True).decode()
+
+
+def test_shared_body_is_spooled_once():
+    shared_body = SharedEmailBody('Assignment instructions\nline two')
+
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        spooled_emails = [
+            outbox.spool(Email('student{0}@example.com'.format(number),
+                               'New assignment',
+                               ['Clone URL:', 'url{0}'.format(number), '',
+                                shared_body]))
+            for number in range(3)
+        ]
+
+        assert os.listdir(outbox.bodies_path) == [shared_body.digest]
+
+        # the spool files only hold what differs between the emails
+        for spooled_email in spooled_emails:
+            assert os.path.getsize(spooled_email.file_path) < 300
+
+        # the message is built from the files when it is sent
+        assert _message_body(spooled_emails[1].message_string) == \
+            'Clone URL:\r\nurl1\r\n\r\nAssignment instructions\r\nline two'
+
+        outbox.remove(spooled_emails[0])
+        outbox.remove(spooled_emails[1])
+
+        assert os.listdir(outbox.bodies_path) == [shared_body.digest]
+
+        outbox.remove(spooled_emails[2])
+
+        assert os.listdir(outbox.bodies_path) == []
+
+
+def test_shared_body_survives_restart():
+    shared_body = SharedEmailBody('Assignment instructions')
+
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        for address in ('a@example.com', 'b@example.com', 'c@example.com'):
+            outbox.spool(Email(address, 'New assignment', shared_body))
+
+        # a body that no spool file refers to, left by a crash
+        unused_body = SharedEmailBody('unused')
+
+        with open(os.path.join(outbox.bodies_path, unused_body.digest),
+                  'w') as f:
+            f.write(unused_body.text)
+
+        # gkeepd starts again
+        outbox = EmailOutbox(outbox_path)
+        first, second, third = outbox.pending()
+
+        assert os.listdir(outbox.bodies_path) == [shared_body.digest]
+
+        # a failed email keeps its body
+        outbox.move_to_failed(first)
+        outbox.remove(second)
+        outbox.remove(third)
+
+        assert os.listdir(outbox.bodies_path) == [shared_body.digest]
+        assert _message_body(first.message_string) == 'Assignment instructions'
+
+        outbox = EmailOutbox(outbox_path)
+        assert outbox.pending() == []
+        assert os.listdir(outbox.bodies_path) == [shared_body.digest]
+
+
+def test_spool_and_remove():
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        spooled_email = outbox.spool(Email('student@example.com', 'Results',
+                                           'All tests passed'))
+
+        assert spooled_email.to_address == 'student@example.com'
+        assert spooled_email.subject == 'Results'
+        assert spooled_email.body == 'All tests passed'
+        assert os.path.dirname(spooled_email.file_path) == outbox_path
+
+        # only the spool file is left, no temporary file
+        spool_filenames = [filename for filename in os.listdir(outbox_path)
+                           if os.path.isfile(os.path.join(outbox_path,
+                                                          filename))]
+        assert spool_filenames == [os.path.basename(spooled_email.file_path)]
+
+        outbox.remove(spooled_email)
+
+        assert not os.path.exists(spooled_email.file_path)
+        assert outbox.pending() == []
+
+
+def test_pending_replays_in_order():
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        for number in range(5):
+            outbox.spool(Email('student{0}@example.com'.format(number),
+                               'Subject {0}'.format(number),
+                               'Body {0}'.format(number)))
+
+        # gkeepd starts again
+        outbox = EmailOutbox(outbox_path)
+        pending_emails = outbox.pending()
+
+        assert [email.to_address for email in pending_emails] == \
+            ['student{0}@example.com'.format(number) for number in range(5)]
+        assert [email.body for email in pending_emails] == \
+            ['Body {0}'.format(number) for number in range(5)]
+
+        # replaying twice finds the same emails until they are removed
+        assert len(outbox.pending()) == 5
+
+        for email in pending_emails:
+            outbox.remove(email)
+
+        assert outbox.pending() == []
+
+
+def test_pending_cleans_up_interrupted_writes():
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        spooled_email = outbox.spool(Email('student@example.com', 'Subject',
+                                           'Body'))
+
+        temp_file_path = os.path.join(outbox_path, 'partial.email.tmp')
+        with open(temp_file_path, 'w') as f:
+            f.write('{"to_add')
+
+        corrupt_file_path = os.path.join(outbox_path, '0-000000.email')
+        with open(corrupt_file_path, 'w') as f:
+            f.write('not json')
+
+        outbox = EmailOutbox(outbox_path)
+        pending_emails = outbox.pending()
+
+        assert [email.file_path for email in pending_emails] == \
+            [spooled_email.file_path]
+        assert not os.path.exists(temp_file_path)
+        assert not os.path.exists(corrupt_file_path)
+        assert os.listdir(outbox.failed_path) == ['0-000000.email']
+
+
+def test_move_to_failed():
+    with TemporaryDirectory() as outbox_path:
+        outbox = EmailOutbox(outbox_path)
+
+        spooled_email = outbox.spool(Email('student@example.com', 'Subject',
+                                           'Body'))
+        filename = os.path.basename(spooled_email.file_path)
+
+        outbox.move_to_failed(spooled_email)
+
+        assert spooled_email.file_path == \
+            os.path.join(outbox.failed_path, filename)
+        assert spooled_email.body == 'Body'
+
+        # failed emails are not sent again after a restart
+        outbox = EmailOutbox(outbox_path)
+        assert outbox.pending() == []
+        assert os.listdir(outbox.failed_path) == [filename]
@@ -0,0 +1,129 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.email_rate_limiter."""
+
+from smtplib import SMTPResponseException
+
+import pytest
+
+from gkeepserver import email_rate_limiter
+from gkeepserver.email_rate_limiter import (TokenBucket, EmailRateLimiter,
+                                            is_throttling_error)
+
+
+class _Clock:
+    # Stands in for time.time() so that tests control the passing of time
+
+    def __init__(self):
+        self.current_time = 1000.0
+
+    def __call__(self):
+        return self.current_time
+
+    def advance(self, seconds):
+        self.current_time += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = _Clock()
+    monkeypatch.setattr(email_rate_limiter, 'time', fake_clock)
+
+    return fake_clock
+
+
+def test_burst_is_available_at_once(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    for _ in range(3):
+        assert bucket.time_until_available() == 0
+        bucket.consume()
+
+    # the next token arrives after 1 / rate seconds
+    assert bucket.time_until_available() == pytest.approx(0.5)
+
+
+def test_refill(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    for _ in range(3):
+        bucket.consume()
+
+    clock.advance(0.25)
+    assert bucket.time_until_available() == pytest.approx(0.25)
+
+    clock.advance(0.25)
+    assert bucket.time_until_available() == 0
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    clock.advance(60)
+
+    for _ in range(3):
+        assert bucket.time_until_available() == 0
+        bucket.consume()
+
+    assert bucket.time_until_available() > 0
+
+
+def test_drain_time(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    # the first 3 go out at once, the other 4 at 2 per second
+    assert bucket.drain_time(7) == pytest.approx(2)
+    assert bucket.drain_time(2) == 0
+
+
+def test_throttle_and_recover(clock):
+    limiter = EmailRateLimiter(rate=16, burst=1)
+
+    limiter.throttled('student@example.com')
+    assert limiter.get_rate() == 8
+
+    # the rate is never reduced below 1/16 of the configured rate
+    for _ in range(10):
+        limiter.throttled('student@example.com')
+    assert limiter.get_rate() == 1
+
+    limiter.succeeded('student@example.com')
+    assert limiter.get_rate() == pytest.approx(2.6)
+
+    for _ in range(20):
+        limiter.succeeded('student@example.com')
+    assert limiter.get_rate() == 16
+
+
+def test_domain_bucket_limits_only_its_domain(clock):
+    limiter = EmailRateLimiter(rate=100, burst=100,
+                               domain_limits={'Slow.edu': (1, 1)})
+
+    limiter.wait('a@slow.edu')
+
+    # a@slow.edu emptied the domain bucket
+    slow_bucket = limiter._buckets_by_domain['slow.edu']
+    assert slow_bucket.time_until_available() == pytest.approx(1)
+
+    limiter.wait('b@example.com')
+    assert limiter._bucket.drain_time(99) == pytest.approx(0.01)
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(SMTPResponseException(421, b'slow down'))
+    assert not is_throttling_error(SMTPResponseException(550, b'no user'))
+    assert not is_throttling_error(OSError())
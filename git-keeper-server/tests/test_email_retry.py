@@ -0,0 +1,99 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.email_retry and its use by the email sender."""
+
+from threading import Barrier, Event, Thread
+from time import sleep, time
+
+from gkeepserver.email_retry import CircuitBreaker
+from gkeepserver.email_sender_thread import EmailSenderThread
+
+
+def test_single_trial_send():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.01)
+
+    assert breaker.record_failure()
+    sleep(0.02)
+
+    thread_count = 4
+    barrier = Barrier(thread_count)
+    results = []
+
+    def worker():
+        allowed = breaker.allow_send()
+        results.append(allowed)
+
+        # keep every thread alive until all have asked
+        barrier.wait()
+
+        # the trial thread ends the trial without a result
+        if allowed:
+            breaker.end_trial()
+
+    threads = [Thread(target=worker) for _ in range(thread_count)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # only one of the workers was allowed to make the trial send
+    assert results.count(True) == 1
+
+    # after the trial ended without a result another trial is allowed, and
+    # a successful one closes the breaker
+    assert breaker.allow_send()
+    assert breaker.record_success()
+    assert breaker.allow_send()
+
+
+def test_waiting_workers_do_not_spin_during_trial():
+    sender = EmailSenderThread()
+    sender._circuit_breaker = CircuitBreaker(failure_threshold=1,
+                                             cooldown=0.01)
+
+    assert sender._circuit_breaker.record_failure()
+    sleep(0.02)
+
+    trial_started = Event()
+    trial_done = Event()
+
+    def trial_worker():
+        assert sender.wait_for_circuit()
+        trial_started.set()
+        trial_done.wait()
+        sender.end_circuit_trial()
+
+    trial_thread = Thread(target=trial_worker)
+    trial_thread.start()
+    trial_started.wait()
+
+    # while the trial is in progress the other workers sleep for the poll
+    # interval on every check rather than returning immediately
+    checks = 0
+    start_time = time()
+
+    while time() - start_time < 0.3:
+        assert not sender.wait_for_circuit()
+        checks += 1
+
+    trial_done.set()
+    trial_thread.join()
+
+    assert checks <= 0.3 / sender.circuit_poll_interval + 1
+    assert sender.wait_for_circuit()
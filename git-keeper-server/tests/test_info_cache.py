@@ -0,0 +1,50 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.info_cache."""
+
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+
+from gkeepserver.info_cache import FingerprintCache, git_ref_paths
+
+
+def test_branch_other_than_master():
+    with TemporaryDirectory() as temp_dir_path:
+        repo_path = os.path.join(temp_dir_path, 'repo')
+        subprocess.check_call(['git', 'init', '-q', '-b', 'main',
+                               repo_path])
+
+        assert os.path.join(repo_path, '.git', 'refs', 'heads', 'main') in \
+            git_ref_paths(repo_path)
+
+        cache = FingerprintCache()
+        computed = []
+
+        def commit_and_get():
+            subprocess.check_call(['git', '-C', repo_path, '-c',
+                                   'user.name=Test', '-c',
+                                   'user.email=t@t', 'commit', '-q',
+                                   '--allow-empty', '-m', 'commit'])
+            cache.get('repo', git_ref_paths(repo_path),
+                      lambda: computed.append(None))
+
+        commit_and_get()
+        commit_and_get()
+
+        # each commit to main changes the fingerprint
+        assert len(computed) == 2
@@ -0,0 +1,79 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for restoring log positions in gkeepserver.log_polling."""
+
+import json
+import os
+from queue import Queue, Empty
+from tempfile import TemporaryDirectory
+
+from gkeepserver.local_log_file_reader import LocalLogFileReader
+from gkeepserver.log_polling import LogPollingThread
+
+
+class _Logger:
+    # stands in for the system logger, which needs a running thread
+
+    def log_debug(self, message):
+        pass
+
+    log_info = log_warning = log_error = log_debug
+
+
+def _events_after_restart(replay_missed_events):
+    # Simulate gkeepd stopping after reading the first event of a log and
+    # starting again after a second event was written. Return the payloads
+    # of the events the poller reports.
+
+    with TemporaryDirectory() as temp_dir_path:
+        log_path = os.path.join(temp_dir_path, 'student.log')
+        snapshot_path = os.path.join(temp_dir_path, 'snapshot.json')
+
+        first_line = '1000000000.0 SUBMISSION first\n'
+
+        with open(log_path, 'w') as f:
+            f.write(first_line)
+            f.write('1000000001.0 SUBMISSION second\n')
+
+        with open(snapshot_path, 'w') as f:
+            json.dump({'version': LogPollingThread.snapshot_version,
+                       'seek_positions': {log_path: len(first_line)}}, f)
+
+        event_queue = Queue()
+        poller = LogPollingThread()
+        poller.initialize(event_queue, LocalLogFileReader, snapshot_path,
+                          _Logger(), polling_interval=0,
+                          replay_missed_events=replay_missed_events)
+        poller._poll()
+
+        payloads = []
+
+        try:
+            while True:
+                payloads.append(event_queue.get(block=False)[1].payload)
+        except Empty:
+            pass
+
+        return payloads
+
+
+def test_missed_events_are_ignored_by_default():
+    assert _events_after_restart(replay_missed_events=False) == []
+
+
+def test_missed_events_are_replayed_if_enabled():
+    assert _events_after_restart(replay_missed_events=True) == ['second']
@@ -0,0 +1,114 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for gkeepserver.roster and the handlers that use it."""
+
+import builtins
+import dis
+import importlib
+import os
+import pkgutil
+import types
+from tempfile import TemporaryDirectory
+
+import pytest
+
+import gkeepserver.event_handlers
+from gkeepcore.faculty import FacultyError
+from gkeepcore.path_utils import class_student_csv_path
+from gkeepcore.student import StudentError
+from gkeepserver.roster import Roster
+from gkeepserver.server_configuration import config
+
+
+def _global_names(code):
+    # Yield the global names that a code object and the functions and
+    # classes nested in it load
+
+    for instruction in dis.get_instructions(code):
+        if instruction.opname in ('LOAD_GLOBAL', 'LOAD_NAME'):
+            yield instruction.argval
+
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            yield from _global_names(constant)
+
+
+def test_handler_names_defined():
+    # the handlers look people up through the roster, so make sure every
+    # global name they use is imported
+    for module_info in pkgutil.iter_modules(
+            gkeepserver.event_handlers.__path__):
+        module = importlib.import_module('gkeepserver.event_handlers.' +
+                                         module_info.name)
+
+        with open(module.__file__) as f:
+            code = compile(f.read(), module.__file__, 'exec')
+
+        for name in _global_names(code):
+            assert hasattr(module, name) or hasattr(builtins, name), \
+                '{0} is not defined in {1}'.format(name, module.__name__)
+
+
+def test_roster(monkeypatch):
+    with TemporaryDirectory() as temp_dir_path:
+        expanduser = os.path.expanduser
+
+        def fake_expanduser(path):
+            if path.startswith('~') and len(path) > 1:
+                return os.path.join(temp_dir_path, path[1:])
+
+            return expanduser(path)
+
+        monkeypatch.setattr(os.path, 'expanduser', fake_expanduser)
+
+        faculty_csv_path = os.path.join(temp_dir_path, 'faculty.csv')
+        monkeypatch.setattr(config, 'faculty_csv_path', faculty_csv_path,
+                            raising=False)
+
+        with open(faculty_csv_path, 'w') as f:
+            f.write('Doe,Jane,jdoe@example.edu\n')
+
+        csv_path = class_student_csv_path('cs1', fake_expanduser('~jdoe'))
+        os.makedirs(os.path.dirname(csv_path))
+
+        with open(csv_path, 'w') as f:
+            f.write('Last,Ann,ann@example.edu\nLast,Bob,bob@example.edu\n')
+
+        roster = Roster()
+
+        assert roster.faculty('jdoe').email_address == 'jdoe@example.edu'
+        assert [s.username for s in roster.class_students('jdoe', 'cs1')] \
+            == ['ann', 'bob']
+        assert roster.student('jdoe', 'cs1', 'bob').first_name == 'Bob'
+
+        with pytest.raises(FacultyError):
+            roster.faculty('nobody')
+
+        # a changed file is read again
+        with open(csv_path, 'w') as f:
+            f.write('Last,Ann,ann@example.edu\n')
+
+        with pytest.raises(StudentError):
+            roster.student('jdoe', 'cs1', 'bob')
+
+        # an invalidated class is read again
+        with open(csv_path, 'w') as f:
+            f.write('Last,Cal,cal@example.edu\n')
+
+        roster.invalidate_class('jdoe', 'cs1')
+
+        assert roster.student('jdoe', 'cs1', 'cal').first_name == 'Cal'
@@ -0,0 +1,164 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Tests for SMTPSession in gkeepserver.server_email.
+
+The emails are sent to the mock SMTP server from
+tests/git-keeper-server/mysmtpd.py, which saves each email to a file.
+"""
+
+import os
+import socket
+import sys
+from subprocess import Popen, DEVNULL
+from tempfile import TemporaryDirectory
+from time import sleep
+
+import pytest
+
+from gkeepserver import server_email
+from gkeepserver.server_configuration import config
+from gkeepserver.server_email import Email, SMTPSession
+
+mysmtpd_path = os.path.join(os.path.dirname(__file__), '..', '..', 'tests',
+                            'git-keeper-server', 'mysmtpd.py')
+
+
+class _SMTPServer:
+    # Runs mysmtpd.py in a subprocess
+
+    def __init__(self, port, email_dir_path):
+        self.port = port
+        self.email_dir_path = email_dir_path
+        self._process = None
+
+    def start(self):
+        self._process = Popen([sys.executable, mysmtpd_path, str(self.port),
+                               self.email_dir_path], stderr=DEVNULL)
+
+        # wait for the server to listen
+        for _ in range(100):
+            try:
+                socket.create_connection(('localhost', self.port)).close()
+                return
+            except OSError:
+                sleep(0.05)
+
+        raise RuntimeError('mysmtpd.py did not start')
+
+    def stop(self):
+        self._process.terminate()
+        self._process.wait()
+
+    def email_count(self):
+        return len(os.listdir(self.email_dir_path))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    with TemporaryDirectory() as email_dir_path:
+        server = _SMTPServer(_free_port(), email_dir_path)
+
+        monkeypatch.setattr(config, 'smtp_server', 'localhost', raising=False)
+        monkeypatch.setattr(config, 'smtp_port', server.port, raising=False)
+        monkeypatch.setattr(config, 'use_tls', False, raising=False)
+        monkeypatch.setattr(config, 'email_username', None, raising=False)
+        monkeypatch.setattr(config, 'email_password', None, raising=False)
+        monkeypatch.setattr(config, 'from_name', 'Keeper', raising=False)
+        monkeypatch.setattr(config, 'from_address', 'keeper@example.com',
+                            raising=False)
+
+        server.start()
+
+        try:
+            yield server
+        finally:
+            server.stop()
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    # count the connections made to the SMTP server
+
+    connection_list = []
+    connect = server_email.connect_to_smtp_server
+
+    def counting_connect():
+        connection_list.append(connect())
+        return connection_list[-1]
+
+    monkeypatch.setattr(server_email, 'connect_to_smtp_server',
+                        counting_connect)
+
+    return connection_list
+
+
+def _email(number):
+    return Email('student{0}@example.com'.format(number), 'Subject',
+                 'Body {0}'.format(number))
+
+
+def test_session_reuses_connection(smtp_server, connections):
+    session = SMTPSession(max_messages=2)
+
+    for number in range(5):
+        _email(number).send(session)
+
+    session.close()
+
+    assert smtp_server.email_count() == 5
+
+    # a new connection is made after every 2 messages
+    assert len(connections) == 3
+
+
+def test_session_reconnects_after_disconnect(smtp_server, connections):
+    session = SMTPSession()
+
+    _email(1).send(session)
+    assert session.is_connected()
+
+    # the server drops the connection
+    smtp_server.stop()
+    smtp_server.start()
+
+    _email(2).send(session)
+    session.close()
+
+    assert smtp_server.email_count() == 2
+    assert len(connections) == 2
+
+
+def test_idle_session_is_closed(smtp_server, connections):
+    session = SMTPSession(idle_timeout=60)
+
+    _email(1).send(session)
+    session.close_if_idle()
+
+    assert session.is_connected()
+
+    session._idle_timeout = 0
+    session.close_if_idle()
+
+    assert not session.is_connected()
+    assert len(connections) == 1
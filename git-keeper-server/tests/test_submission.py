@@ -0,0 +1,104 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Tests for running sharded tests in gkeepserver.submission."""
+
+import os
+from tempfile import TemporaryDirectory
+from time import sleep
+
+import pytest
+
+# imported as a module so that pytest does not collect tests_shard_count
+from gkeepserver import submission
+from gkeepserver.submission import ShardCountError, Submission
+
+
+def _shard_count(shards_file_contents):
+    with TemporaryDirectory() as tests_path:
+        if shards_file_contents is not None:
+            with open(os.path.join(tests_path, 'shards'), 'w') as f:
+                f.write(shards_file_contents)
+
+        return submission.tests_shard_count(tests_path)
+
+
+def test_shard_count():
+    assert _shard_count(None) == 1
+    assert _shard_count('4\n') == 4
+
+    for contents in ('', 'two', '1.5', '0', '-3'):
+        with pytest.raises(ShardCountError):
+            _shard_count(contents)
+
+
+class _Logger:
+    # stands in for the system logger, which needs a running thread
+
+    def log_debug(self, message):
+        pass
+
+    log_info = log_warning = log_error = log_debug
+
+
+@pytest.fixture(autouse=True)
+def _logger(monkeypatch):
+    monkeypatch.setattr(submission, 'logger', _Logger())
+
+
+def _submission(run_action_sh):
+    # A submission whose action.sh runs are replaced by run_action_sh
+
+    repo_path = '/home/student/faculty/class/assignment.git'
+    student_submission = Submission(None, repo_path, '/tests', '/reports',
+                                    'faculty', 'faculty@example.com')
+    student_submission._run_action_sh = run_action_sh
+
+    return student_submission
+
+
+def test_shard_outputs_are_in_shard_order():
+    def run_action_sh(temp_path, assignment_name, shard):
+        shard_number, shard_count = shard
+
+        # later shards finish first
+        sleep(0.01 * (shard_count - shard_number))
+
+        if shard_number == 2:
+            return 'shard 2 without a newline'
+
+        return 'shard {0}\n'.format(shard_number)
+
+    student_submission = _submission(run_action_sh)
+
+    assert student_submission._run_action_sh_shards('assignment', 4) == \
+        'shard 1\nshard 2 without a newline\nshard 3\nshard 4\n'
+
+
+def test_shard_failure_is_raised():
+    class ShardError(Exception):
+        pass
+
+    def run_action_sh(temp_path, assignment_name, shard):
+        if shard[0] == 3:
+            raise ShardError('shard 3 failed')
+
+        return 'shard {0}\n'.format(shard[0])
+
+    student_submission = _submission(run_action_sh)
+
+    with pytest.raises(ShardError):
+        student_submission._run_action_sh_shards('assignment', 4)
@@ -0,0 +1,95 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This script measures how many emails per second gkeepserver can send with and
+without SMTP session pooling.
+
+It starts the mock SMTP server from tests/git-keeper-server/mysmtpd.py on a
+local port, trapping the emails in a temporary directory, and sends the same
+number of emails both ways.
+
+git-keeper-core and git-keeper-server must be installed. The mock server uses
+the smtpd module, which was removed from the standard library in Python 3.12.
+
+Usage:
+
+    python3 email_throughput.py [email count]
+
+"""
+
+import os
+import sys
+from subprocess import Popen
+from tempfile import TemporaryDirectory
+from time import time, sleep
+
+from gkeepserver.server_configuration import config
+from gkeepserver.server_email import Email, SMTPSession
+
+this_file_dir = os.path.dirname(os.path.realpath(__file__))
+mysmtpd_path = os.path.join(this_file_dir, 'git-keeper-server', 'mysmtpd.py')
+
+smtp_port = 2525
+
+
+def send_emails(email_count, smtp_session):
+    start_time = time()
+
+    for i in range(email_count):
+        email = Email('student{0}@example.com'.format(i), 'Test email',
+                      'Test email body')
+        email.send(smtp_session)
+
+    if smtp_session is not None:
+        smtp_session.close()
+
+    return email_count / (time() - start_time)
+
+
+def main():
+    if len(sys.argv) > 1:
+        email_count = int(sys.argv[1])
+    else:
+        email_count = 300
+
+    # set the configuration attributes directly rather than parsing a file
+    config.from_name = 'git-keeper'
+    config.from_address = 'git-keeper@example.com'
+    config.smtp_server = 'localhost'
+    config.smtp_port = smtp_port
+    config.use_tls = False
+    config.email_username = None
+    config.email_password = None
+
+    with TemporaryDirectory() as email_dir_path:
+        smtpd_process = Popen([sys.executable, mysmtpd_path, str(smtp_port),
+                               email_dir_path])
+        # give the server time to start listening
+        sleep(1)
+
+        try:
+            rate = send_emails(email_count, None)
+            print('Pooling off: {0:.1f} emails per second'.format(rate))
+
+            rate = send_emails(email_count, SMTPSession())
+            print('Pooling on:  {0:.1f} emails per second'.format(rate))
+        finally:
+            smtpd_process.terminate()
+            smtpd_process.wait()
+
+
+if __name__ == '__main__':
+    main()
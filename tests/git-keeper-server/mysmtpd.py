@@ -50,7 +50,8 @@ class MySMTPD(smtpd.DebuggingServer):
         :return: None
         """
 
-        smtpd.DebuggingServer.__init__(self, ('localhost', port), None)
+        smtpd.DebuggingServer.__init__(self, ('localhost', port), None,
+                                       decode_data=True)
         self.directory = directory
 
         self.users = {}
@@ -0,0 +1,126 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This script measures how many times per second the hash and commit time of
+the HEAD of a set of repositories can be queried by running git log for each
+query, by using the git cat-file sessions of
+gkeepcore.git_commands.cat_file_pool, and by reading the repository files
+with gkeepcore.git_reader.
+
+Queries cycle through the repositories, as the info refresher does. With more
+repositories than CAT_FILE_POOL_SIZE the pool keeps restarting sessions, which
+shows the cost of a working set that does not fit in the pool.
+
+git-keeper-core must be installed.
+
+Usage:
+
+    python3 git_query_throughput.py [repository count] [query count]
+
+"""
+
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import time
+
+from gkeepcore.git_commands import cat_file_pool
+from gkeepcore.git_reader import parse_commit, read_commit, read_head_hash
+from gkeepcore.shell_command import run_command_in_directory
+
+
+def make_repos(temp_dir_path, repo_count):
+    env = dict(os.environ, GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='t@t',
+               GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='t@t')
+
+    repo_paths = []
+
+    for i in range(repo_count):
+        repo_path = os.path.join(temp_dir_path, 'repo{0}'.format(i))
+        subprocess.check_call(['git', 'init', '-q', '--bare', repo_path])
+
+        work_path = repo_path + '.work'
+        subprocess.check_call(['git', 'clone', '-q', repo_path, work_path],
+                              stderr=subprocess.DEVNULL)
+
+        for j in range(3):
+            subprocess.check_call(['git', '-C', work_path, 'commit', '-q',
+                                   '--allow-empty', '-m', 'commit'], env=env)
+
+        subprocess.check_call(['git', '-C', work_path, 'push', '-q',
+                               'origin', 'HEAD:master'],
+                              stderr=subprocess.DEVNULL)
+
+        repo_paths.append(repo_path)
+
+    return repo_paths
+
+
+def subprocess_query(repo_path):
+    output = run_command_in_directory(repo_path,
+                                      ['git', 'log', '-1', '--format=%H %at'])
+    head_hash, timestamp = output.split()
+
+    return head_hash, int(timestamp)
+
+
+def pool_query(repo_path):
+    head_hash, object_type, contents = cat_file_pool.read_object(repo_path,
+                                                                 'HEAD')
+
+    return head_hash, parse_commit(head_hash, contents).author_time
+
+
+def native_query(repo_path):
+    head_hash = read_head_hash(repo_path)
+
+    return head_hash, read_commit(repo_path, head_hash).author_time
+
+
+def queries_per_second(query, repo_paths, query_count):
+    start_time = time()
+
+    for i in range(query_count):
+        query(repo_paths[i % len(repo_paths)])
+
+    return query_count / (time() - start_time)
+
+
+def main():
+    repo_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    with TemporaryDirectory() as temp_dir_path:
+        repo_paths = make_repos(temp_dir_path, repo_count)
+
+        # all three must agree before their speed means anything
+        for repo_path in repo_paths:
+            assert (subprocess_query(repo_path) == pool_query(repo_path) ==
+                    native_query(repo_path))
+
+        for name, query in (('git log', subprocess_query),
+                            ('cat-file pool', pool_query),
+                            ('native reader', native_query)):
+            rate = queries_per_second(query, repo_paths, query_count)
+            print('{0:14} {1:.1f} queries per second'.format(name + ':',
+                                                            rate))
+
+        cat_file_pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
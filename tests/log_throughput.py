@@ -0,0 +1,82 @@
+# Copyright 2017 Nathan Sommer and Ben Coleman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This script measures how many lines per second can be appended to a log file
+by running the shell command from log_append_command() for each line, and by
+GkeepdLoggerThread, which appends in-process.
+
+git-keeper-core and git-keeper-server must be installed.
+
+Usage:
+
+    python3 log_throughput.py [line count]
+
+"""
+
+import os
+import sys
+from tempfile import TemporaryDirectory
+from time import time
+
+from gkeepcore.log_file import log_append_command
+from gkeepcore.shell_command import run_command
+from gkeepserver.gkeepd_logger import GkeepdLoggerThread
+
+
+def shell_lines_per_second(log_file_path, line_count):
+    start_time = time()
+
+    for i in range(line_count):
+        run_command(log_append_command(log_file_path, 'DEBUG',
+                                       'Test message {0}'.format(i)))
+
+    return line_count / (time() - start_time)
+
+
+def logger_lines_per_second(log_file_path, line_count):
+    logger = GkeepdLoggerThread()
+    logger.initialize(log_file_path)
+    logger.start()
+
+    start_time = time()
+
+    for i in range(line_count):
+        logger.log_debug('Test message {0}'.format(i))
+
+    # shutdown() waits for the queue to be written
+    logger.shutdown()
+
+    return line_count / (time() - start_time)
+
+
+def main():
+    if len(sys.argv) > 1:
+        line_count = int(sys.argv[1])
+    else:
+        line_count = 1000
+
+    with TemporaryDirectory() as temp_dir_path:
+        log_file_path = os.path.join(temp_dir_path, 'shell.log')
+        rate = shell_lines_per_second(log_file_path, line_count)
+        print('Shell command:  {0:.1f} lines per second'.format(rate))
+
+        log_file_path = os.path.join(temp_dir_path, 'logger.log')
+        rate = logger_lines_per_second(log_file_path, line_count)
+        print('Logger thread:  {0:.1f} lines per second'.format(rate))
+
+
+if __name__ == '__main__':
+    main()